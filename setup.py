@@ -58,6 +58,7 @@ setup(
     ],
     install_requires=install_requires,
     # pip install -e .[dev]
-    extras_require={'dev': ['pytest', 'flake8', 'ipython', 'ipdb']},
+    # pip install -e .[pbf] (read local .osm.pbf extracts)
+    extras_require={'dev': ['pytest', 'flake8', 'ipython', 'ipdb'], 'pbf': ['osmium']},
     packages=find_packages(exclude=['examples']),
 )
@@ -0,0 +1,83 @@
+import json
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+import pytest
+
+from urbansprawl import settings
+from urbansprawl.osm import endpoints
+
+STATUS = 'Connected as: 1\nRate limit: 0\n2 slots available now.\nCurrently running queries (pid, space limit, time limit, start time):\n'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubOverpass():
+    """
+    Local Overpass API: Serves /api/status, and answers /api/interpreter with the queued (status code, json) responses
+    """
+    def __init__(self):
+        self.status = STATUS
+        self.status_code = 200
+        self.responses = []
+        self.queries = []
+        self.status_requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, body, content_type):
+                body = body.encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                stub.status_requests += 1
+                self._send(stub.status_code, stub.status, 'text/plain')
+
+            def do_POST(self):
+                data = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                stub.queries.append(data['data'][0])
+                code, response_json = stub.responses.pop(0) if stub.responses else (200, {'elements': []})
+                self._send(code, json.dumps(response_json), 'application/json')
+
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/api/interpreter'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def overpass_servers(monkeypatch, tmp_path):
+    """
+    Two local Overpass API servers, set as the endpoints pool, with the responses cache stored in a temporary folder
+    """
+    servers = [StubOverpass(), StubOverpass()]
+    monkeypatch.setattr(settings, 'overpass_endpoints', [server.url for server in servers])
+    monkeypatch.setattr(settings, 'overpass_cache_folder', str(tmp_path / 'overpass_cache'))
+    monkeypatch.setattr(endpoints, '_endpoint_pool', None)
+    yield servers
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def overpass_server(overpass_servers, monkeypatch):
+    """
+    A single local Overpass API server
+    """
+    monkeypatch.setattr(settings, 'overpass_endpoints', [overpass_servers[0].url])
+    return overpass_servers[0]
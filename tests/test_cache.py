@@ -0,0 +1,82 @@
+import os
+import time
+
+from urbansprawl import settings
+from urbansprawl.osm.cache import cached_overpass_request, evict_cached_responses, get_cache_filename, get_cache_key, is_historical_query
+
+
+def _age(query_str, seconds):
+    """ Pretend the cached response of a query was stored and last read `seconds` ago """
+    stored_time = time.time() - seconds
+    os.utime(get_cache_filename(get_cache_key(query_str)), (stored_time, stored_time))
+
+
+def test_cache_hit_and_miss(overpass_server):
+    overpass_server.responses = [(200, {'elements': [{'type': 'node', 'id': 1}]}), (200, {'elements': []})]
+    query_str = '[out:json]; node(1); out;'
+
+    assert cached_overpass_request({'data': query_str}) == {'elements': [{'type': 'node', 'id': 1}]}
+    # Equivalent query: Served from the cache
+    assert cached_overpass_request({'data': '[out:json];\n  node(1);\tout;  '}) == {'elements': [{'type': 'node', 'id': 1}]}
+    assert overpass_server.queries == [query_str]
+
+    # Another query: Sent to the server
+    assert cached_overpass_request({'data': '[out:json];node(2);out;'}) == {'elements': []}
+    assert len(overpass_server.queries) == 2
+
+
+def test_cache_least_recently_used_eviction(overpass_server, monkeypatch):
+    monkeypatch.setattr(settings, 'overpass_cache_max_size', None)
+    queries = ['[out:json];node({});out;'.format(id_) for id_ in range(3)]
+    for i, query_str in enumerate(queries[:2]):
+        cached_overpass_request({'data': query_str})
+        _age(query_str, 100 - i)
+    # The first response is read again, then a third one is stored
+    cached_overpass_request({'data': queries[0]})
+    cached_overpass_request({'data': queries[2]})
+    assert len(overpass_server.queries) == 3
+
+    sizes = [os.path.getsize(get_cache_filename(get_cache_key(query_str))) for query_str in queries]
+    evict_cached_responses(max_size=sum(sizes) - 1)
+    assert [os.path.isfile(get_cache_filename(get_cache_key(query_str))) for query_str in queries] == [True, False, True]
+
+    cached_overpass_request({'data': queries[1]})
+    assert len(overpass_server.queries) == 4
+
+
+def test_cache_folder_scanned_when_full(overpass_server, monkeypatch):
+    scans = []
+    scandir = os.scandir
+
+    def counted_scandir(path):
+        scans.append(path)
+        return scandir(path)
+    monkeypatch.setattr(os, 'scandir', counted_scandir)
+
+    queries = ['[out:json];node({});out;'.format(id_) for id_ in range(4)]
+    for query_str in queries[:3]:
+        cached_overpass_request({'data': query_str})
+    # The running cache size is measured once
+    assert len(scans) == 1
+
+    sizes = [os.path.getsize(get_cache_filename(get_cache_key(query_str))) for query_str in queries[:3]]
+    monkeypatch.setattr(settings, 'overpass_cache_max_size', sum(sizes))
+    cached_overpass_request({'data': queries[3]})
+    assert len(scans) == 2
+    assert sum(os.path.isfile(get_cache_filename(get_cache_key(query_str))) for query_str in queries) == 3
+
+
+def test_cache_historical_queries_never_expire(overpass_server, monkeypatch):
+    monkeypatch.setattr(settings, 'overpass_cache_max_age', 10)
+    historical = '[out:json][date:"2010-01-01T00:00:00Z"];node(1);out;'
+    current = '[out:json];node(1);out;'
+    assert is_historical_query(historical)
+    assert not is_historical_query(current)
+
+    for query_str in [historical, current]:
+        cached_overpass_request({'data': query_str})
+        _age(query_str, 3600)
+    cached_overpass_request({'data': historical})
+    cached_overpass_request({'data': current})
+    # Only the expired current query is sent again
+    assert overpass_server.queries == [historical, current, current]
@@ -0,0 +1,69 @@
+import time
+
+from urbansprawl.osm.endpoints import OverpassEndpoint, get_endpoint_pool, overpass_post
+
+
+def test_failover_on_server_error(overpass_servers):
+    failing, healthy = overpass_servers
+    failing.responses = [(502, {})]
+    healthy.responses = [(200, {'elements': [{'type': 'node', 'id': 1}]})]
+    pool = get_endpoint_pool()
+    # Route the request to the failing endpoint first
+    pool.endpoints[1].latency = 1.
+
+    with overpass_post({'data': '[out:json];node(1);out;'}) as response:
+        assert response.json() == {'elements': [{'type': 'node', 'id': 1}]}
+    assert len(failing.queries) == 1 and len(healthy.queries) == 1
+
+    # The failing endpoint is paused
+    assert pool.endpoints[0].down_until > time.time()
+    assert pool.endpoints[0].error_rate > 0
+    assert not pool.endpoints[0].is_available(time.time())
+
+
+def test_back_off_on_too_many_requests(overpass_servers):
+    busy, idle = overpass_servers
+    busy.responses = [(429, {})]
+    pool = get_endpoint_pool()
+    pool.endpoints[1].latency = 1.
+
+    with overpass_post({'data': '[out:json];node(1);out;'}) as response:
+        assert response.status_code == 200
+    assert len(busy.queries) == 1 and len(idle.queries) == 1
+
+    # A busy endpoint is not a failing one: Its status is checked again, and it waits for a slot
+    endpoint = pool.endpoints[0]
+    assert busy.status_requests == 2
+    assert endpoint.busy_until > time.time() + 4
+    assert endpoint.error_rate == 0 and endpoint.down_until == 0
+
+    with overpass_post({'data': '[out:json];node(2);out;'}):
+        pass
+    assert len(busy.queries) == 1 and len(idle.queries) == 2
+
+
+def test_status_slots(overpass_server):
+    endpoint = OverpassEndpoint(overpass_server.url)
+    endpoint.check_status()
+    assert endpoint.slots is None and endpoint.busy_until == 0
+
+    overpass_server.status = ('Connected as: 1\nRate limit: 2\n'
+                              'Slot available after: 2018-01-01T00:00:12Z, in 12 seconds.\n'
+                              'Slot available after: 2018-01-01T00:00:30Z, in 30 seconds.\n'
+                              'Currently running queries (pid, space limit, time limit, start time):\n')
+    endpoint.check_status()
+    assert endpoint.slots == 2
+    assert abs(endpoint.busy_until - (endpoint.status_time + 12)) < 1e-6
+    assert not endpoint.is_available(time.time())
+
+    overpass_server.status = 'Connected as: 1\nRate limit: 2\n1 slot available now.\n'
+    endpoint = OverpassEndpoint(overpass_server.url)
+    endpoint.check_status()
+    assert endpoint.slots == 2 and endpoint.busy_until == 0
+    endpoint.active = 2
+    assert not endpoint.is_available(time.time())
+
+    # Status unavailable: The endpoint is paused
+    overpass_server.status_code = 503
+    endpoint.check_status()
+    assert endpoint.down_until > time.time()
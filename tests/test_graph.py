@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import osmnx as ox
+import pytest
+from shapely.geometry import Point, box
+
+from urbansprawl.osm.graph import CSRGraph
+from urbansprawl.sprawl.utils import divide_long_edges_csr
+from urbansprawl.sprawl.accessibility_parallel import (get_count_activities_fixed_distance, get_count_activities_fixed_distance_csr,
+                                                       get_minimum_cost_activities_travel, get_minimum_cost_activities_travel_csr)
+
+# Streets: Residential 100 (1-2-3-4) and 101 (3-5-6), oneway primary 102 (6-7-1), tertiary 103 (4-8) oneway against its nodes
+NODES = {1: (48.850, 2.350), 2: (48.851, 2.350), 3: (48.852, 2.350), 4: (48.853, 2.350),
+         5: (48.852, 2.352), 6: (48.850, 2.353), 7: (48.849, 2.352), 8: (48.854, 2.351)}
+WAYS = {100: ([1, 2, 3, 4], {'highway': 'residential', 'name': 'Rue A'}),
+        101: ([3, 5, 6], {'highway': 'residential'}),
+        102: ([6, 7, 1], {'highway': 'primary', 'oneway': 'yes'}),
+        103: ([4, 8], {'highway': 'tertiary', 'oneway': '-1'})}
+
+
+def _response():
+    elements = [{'type': 'node', 'id': id_, 'lat': lat, 'lon': lon} for id_, (lat, lon) in NODES.items()]
+    elements += [{'type': 'way', 'id': id_, 'nodes': nodes, 'tags': tags} for id_, (nodes, tags) in WAYS.items()]
+    return {'elements': elements}
+
+
+def _edges(G):
+    """ Sorted (u, v, length) of the edges of a networkx graph """
+    return sorted((u, v, data['length']) for u, v, data in G.edges(data=True))
+
+
+def _assert_same_graph(G, H):
+    for array in ['indptr', 'indices', 'lengths', 'x', 'y', 'osmid', 'edge_osmid', 'edge_oneway', 'geometry_indptr', 'geometry_x', 'geometry_y']:
+        assert np.array_equal(getattr(G, array), getattr(H, array)), array
+    for label in ['highway', 'name']:
+        assert getattr(G, label + '_values')[getattr(G, 'edge_' + label)].tolist() == getattr(H, label + '_values')[getattr(H, 'edge_' + label)].tolist()
+
+
+def test_from_overpass_matches_osmnx():
+    G_osmnx = ox.simplify_graph(ox.create_graph([_response()], retain_all=True, network_type='drive'))
+    G = CSRGraph.from_overpass([_response()], network_type='drive')
+
+    assert G.osmid.tolist() == sorted(G_osmnx.nodes())
+    edges, expected = _edges(G.to_networkx()), _edges(G_osmnx)
+    assert [(u, v) for u, v, _ in edges] == [(u, v) for u, v, _ in expected]
+    assert np.allclose([length for _, _, length in edges], [length for _, _, length in expected], rtol=1e-5)
+    # Node 2 is not an intersection: Simplified away, its segment lengths are summed up
+    assert 2 not in G.osmid
+    assert (8, 4) in [(u, v) for u, v, _ in edges] and (4, 8) not in [(u, v) for u, v, _ in edges]
+
+
+def test_save_load(tmp_path):
+    G = CSRGraph.from_overpass([_response()], network_type='drive', name='streets')
+    folder = str(tmp_path / 'graph.csr')
+    G.save(folder)
+    loaded = CSRGraph.load(folder)
+    _assert_same_graph(G, loaded)
+    assert loaded.name == 'streets' and isinstance(loaded.indices, np.memmap)
+    assert np.allclose(loaded.shortest_path_lengths(0), G.shortest_path_lengths(0))
+
+    # Stored again in place, and read into memory
+    G.save(folder)
+    assert not isinstance(CSRGraph.load(folder, mmap_mode=None).indices, np.memmap)
+
+
+def test_networkx_round_trip():
+    G = CSRGraph.from_overpass([_response()], network_type='drive')
+    H = CSRGraph.from_networkx(G.to_networkx())
+    _assert_same_graph(G, H)
+    assert G.to_scipy() is G.to_scipy()
+
+
+def test_truncate_largest_component():
+    G = CSRGraph.from_overpass([_response()], network_type='drive', simplify=False)
+    # Nodes 1 to 4 and 8: Node 8 is out of the region
+    truncated = G.truncate(box(2.3495, 48.8495, 2.3505, 48.8535))
+    assert truncated.osmid.tolist() == [1, 2, 3, 4]
+    assert truncated.number_of_edges() == 6
+
+    # Two components: Streets 100 and 103, and an isolated street
+    response = _response()
+    response['elements'] += [{'type': 'node', 'id': 9, 'lat': 48.86, 'lon': 2.36}, {'type': 'node', 'id': 10, 'lat': 48.861, 'lon': 2.36},
+                             {'type': 'way', 'id': 104, 'nodes': [9, 10], 'tags': {'highway': 'residential'}}]
+    G = CSRGraph.from_overpass([response], network_type='drive', simplify=False)
+    assert G.largest_component().osmid.tolist() == list(range(1, 9))
+
+
+def _grid_graph():
+    """ Projected graph: Two-way streets along a 3x3 grid of 100 meters, with the bottom row street of 400 meters """
+    positions = {(i, j): 3 * j + i for j in range(3) for i in range(3)}
+    u, v = [], []
+    for (i, j), node in positions.items():
+        for neighbor in [(i + 1, j), (i, j + 1)]:
+            if neighbor in positions:
+                u += [node, positions[neighbor]]
+                v += [positions[neighbor], node]
+    x = np.array([100. * (node % 3) for node in range(9)])
+    y = np.array([100. * (node // 3) for node in range(9)])
+    lengths = np.hypot(x[u] - x[v], y[u] - y[v])
+    lengths[(np.array(u) < 3) & (np.array(v) < 3)] = 400.
+    return CSRGraph.from_edges(u, v, lengths, x, y, np.arange(1, 10), crs={'init': 'epsg:32631'})
+
+
+def test_divide_long_edges_csr():
+    G = _grid_graph()
+    divided = divide_long_edges_csr(G, 150)
+    # 400 meters edges are divided in 4 pieces, 100 meters edges are kept
+    assert divided.number_of_nodes() == G.number_of_nodes() + 2 * 2 * 3
+    assert divided.lengths.max() <= 150
+    assert np.isclose(divided.lengths.sum(), G.lengths.sum())
+    # Shortest paths between the former nodes are kept
+    former = divided.node_index(G.osmid)
+    for source in range(G.number_of_nodes()):
+        assert np.allclose(divided.shortest_path_lengths(former[source])[former], G.shortest_path_lengths(source))
+
+
+@pytest.mark.parametrize('fixed_activities', [False, True])
+def test_accessibility_networkx_and_csr(fixed_activities):
+    G = _grid_graph()
+    num_activities = np.array([0, 0, 3, 1, 0, 0, 2, 0, 4])
+    G_nx = G.to_networkx()
+    for node, activities in zip(G.osmid.tolist(), num_activities.tolist()):
+        G_nx.nodes[node]['num_activities'] = activities
+    arguments = pd.Series({'max_node_distance': 50, 'fixed_distance_max_travel_distance': 250, 'fixed_distance_max_num_activities': 100,
+                           'fixed_activities_min_number': 3, 'fixed_activities_max_travel_distance': 1000})
+
+    calculate_nx, calculate_csr = (get_minimum_cost_activities_travel, get_minimum_cost_activities_travel_csr) if fixed_activities else \
+        (get_count_activities_fixed_distance, get_count_activities_fixed_distance_csr)
+    for point in [Point(10, 5), Point(190, 110), Point(100, 200)]:
+        value = calculate_csr(G, num_activities, point, arguments)
+        assert value == calculate_nx(G_nx, point, arguments)
+        assert np.isfinite(value)
+    assert np.isnan(calculate_csr(G, num_activities, Point(500, 500), arguments))
@@ -0,0 +1,89 @@
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Point, box
+
+from urbansprawl import settings
+from urbansprawl.osm import history, utils
+from urbansprawl.osm.elements import null_data_gdf
+from urbansprawl.osm.history import get_osm_history, load_osm_history, materialize_osm_data
+
+DATES = ['2018-01-01T00:00:00Z', '2018-06-01T00:00:00Z', '2019-01-01T00:00:00Z']
+REGION = dict(north=48.856, south=48.848, east=2.356, west=2.344)
+
+
+def _square(lon, lat, size=0.0005):
+    return box(lon, lat, lon + size, lat + size)
+
+
+def _snapshot(date):
+    """
+    Features of the region at each date:
+        building 10 (house, then apartments from the second date), building 11 (with cafe 20, both deleted at the third date)
+        building 12 (created at the second date), within residential land use 30
+    """
+    polygon = box(REGION['west'], REGION['south'], REGION['east'], REGION['north'])
+    buildings = {10: ({'building': 'house' if date == DATES[0] else 'apartments'}, _square(2.350, 48.850))}
+    if date != DATES[2]:
+        buildings[11] = ({'building': 'yes'}, _square(2.352, 48.850))
+    if date != DATES[0]:
+        buildings[12] = ({'building': 'yes'}, _square(2.350, 48.852))
+    ids = sorted(buildings)
+    df_osm_built = gpd.GeoDataFrame([buildings[id_][0] for id_ in ids], index=ids, geometry=[buildings[id_][1] for id_ in ids], crs={'init': 'epsg:4326'})
+    df_osm_building_parts = null_data_gdf({'osm_id': [0], 'building:part': ['yes'], 'height': ['']}, polygon)
+    df_osm_lu = gpd.GeoDataFrame({'landuse': ['residential']}, index=[30], geometry=[_square(2.346, 48.849, 0.006)], crs={'init': 'epsg:4326'})
+    if date == DATES[2]:
+        df_osm_pois = null_data_gdf({'osm_id': [0]}, polygon)
+    else:
+        df_osm_pois = gpd.GeoDataFrame({'amenity': ['cafe']}, index=[20], geometry=[Point(2.3522, 48.8502)], crs={'init': 'epsg:4326'})
+    return df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois
+
+
+def test_history_versions_and_materialization(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'storage_folder', str(tmp_path))
+    monkeypatch.setattr(utils, 'storage_folder', str(tmp_path))
+    retrieved = []
+
+    def create_osm_features_gdfs(date, **kwargs):
+        retrieved.append(date)
+        return _snapshot(date[len('[date:"'):-len('"]')])
+    monkeypatch.setattr(history, 'create_osm_features_gdfs', create_osm_features_gdfs)
+
+    get_osm_history('city', DATES, region_args=REGION, max_workers=2)
+    assert len(retrieved) == 3
+    # Stored dates are not retrieved again
+    get_osm_history('city', DATES[:2], region_args=REGION)
+    assert len(retrieved) == 3
+
+    dates, versions = load_osm_history('city')
+    assert dates == DATES
+    buildings = versions['buildings'].sort_values(['osm_id', 'valid_from'])
+    validity = [(int(osm_id), valid_from, valid_to if isinstance(valid_to, str) else None)
+                for osm_id, valid_from, valid_to in buildings[['osm_id', 'valid_from', 'valid_to']].values]
+    assert validity == [(10, DATES[0], DATES[1]), (10, DATES[1], None), (11, DATES[0], DATES[2]), (12, DATES[1], None)]
+    assert [(int(osm_id), valid_to) for osm_id, valid_to in versions['points'][['osm_id', 'valid_to']].values] == [(20, DATES[2])]
+    # The land use polygon never changed: A single version
+    assert len(versions['landuse']) == 1
+
+    # Latest retrieved date prior to the materialized one
+    expected = {'2018-03-01T00:00:00Z': ({10: 'residential', 11: 'mixed'}, [20]),
+                DATES[1]: ({10: 'residential', 11: 'mixed', 12: 'residential'}, [20]),
+                '2020-01-01T00:00:00Z': ({10: 'residential', 12: 'residential'}, [])}
+    for date, (expected_buildings, expected_pois) in expected.items():
+        df_osm_built, df_osm_building_parts, df_osm_pois = materialize_osm_data('city', date)
+        # Building 11 holds cafe 20
+        assert dict(zip(df_osm_built.osm_id, df_osm_built.classification)) == expected_buildings
+        assert df_osm_pois.osm_id.tolist() == expected_pois
+        # No building part at any date: Null-data point
+        assert df_osm_building_parts.osm_id.tolist() == [0]
+    # Null-data point at the centroid of the features of all layers: Land use 30 holds the buildings
+    centroid = gpd.GeoSeries([Point(2.349, 48.852)], crs={'init': 'epsg:4326'}).to_crs(df_osm_building_parts.crs)
+    assert df_osm_building_parts.geometry.distance(centroid.iloc[0]).max() < 1
+    assert materialize_osm_data('city', '2017-01-01T00:00:00Z') == (None, None, None)
+
+
+def test_materialize_without_buildings(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'storage_folder', str(tmp_path))
+    monkeypatch.setattr(utils, 'storage_folder', str(tmp_path))
+    monkeypatch.setattr(history, 'create_osm_features_gdfs', lambda date, **kwargs: (_snapshot(DATES[2])[0].iloc[:0],) + _snapshot(DATES[2])[1:])
+    get_osm_history('city', DATES[2:], region_args=REGION)
+    assert materialize_osm_data('city', DATES[2]) == (None, None, None)
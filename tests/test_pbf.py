@@ -0,0 +1,68 @@
+"""
+The extract holds, around the region of interest 2.340, 48.846 - 2.360, 48.854:
+    buildings 10 (within) and 11 (out of the region), building part 12, land use 13
+    land use relation 100 (members 14 within and 15 out of the region), building relation 101 (member 16)
+    a cafe (within) and a bakery (out of the region)
+    streets: residential 20, footway 21, parking aisle 22, tertiary 23 (south of the region, within 500m) and primary 24 (farther)
+"""
+import os
+
+import pytest
+from shapely.geometry import box
+
+osmium = pytest.importorskip('osmium')
+
+from urbansprawl.osm import pbf
+from urbansprawl.osm.pbf import parse_osm_filter, match_osm_filter, read_pbf_elements, create_osm_features_gdfs_from_pbf, pbf_net_download
+
+PBF_FILE = os.path.join(os.path.dirname(__file__), 'data', 'extract.osm.pbf')
+REGION = dict(north=48.854, south=48.846, east=2.360, west=2.340)
+
+
+def test_match_osm_filter():
+    clauses = parse_osm_filter('["highway"]["highway"!~"footway|steps"]["service"!~"parking"]["area"!="yes"]')
+    assert match_osm_filter({'highway': 'residential'}, clauses)
+    assert not match_osm_filter({'highway': 'footway'}, clauses)
+    assert not match_osm_filter({'highway': 'service', 'service': 'parking_aisle'}, clauses)
+    assert not match_osm_filter({'highway': 'pedestrian', 'area': 'yes'}, clauses)
+    assert not match_osm_filter({'building': 'yes'}, clauses)
+
+
+def test_read_pbf_elements():
+    layers = read_pbf_elements(PBF_FILE, **REGION)
+    assert set(layers['building'].ways) == {10, 16}
+    assert set(layers['building:part'].ways) == {12}
+    # Member ways out of the region are not retrieved
+    assert set(layers['landuse'].ways) == {13, 14}
+    assert set(layers['landuse'].relations) == {100}
+    assert [tags for tags in layers['pois'].node_tags.values()] == [{'amenity': 'cafe'}]
+    assert 'network' not in layers
+
+
+def test_create_osm_features_gdfs_from_pbf():
+    df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois = create_osm_features_gdfs_from_pbf(PBF_FILE, **REGION)
+    assert sorted(df_osm_built.index) == [10, 16]
+    assert df_osm_building_parts.loc[12, 'building:levels'] == '3'
+    assert sorted(df_osm_lu.index) == [13, 14]
+    assert len(df_osm_pois) == 1
+
+
+def test_network_read_along_with_features(monkeypatch):
+    reads = []
+
+    def counted_read(*args, **kwargs):
+        reads.append(kwargs.get('network_type'))
+        return read_pbf_elements(*args, **kwargs)
+    monkeypatch.setattr(pbf, 'read_pbf_elements', counted_read)
+
+    polygon = box(REGION['west'], REGION['south'], REGION['east'], REGION['north'])
+    network_polygon = pbf._buffered_region(polygon, 500)
+    create_osm_features_gdfs_from_pbf(PBF_FILE, polygon=polygon, network_type='drive_service')
+    shared = pbf_net_download(PBF_FILE, polygon=network_polygon, network_type='drive_service')
+    # The extract is read once: The network is shared with the following graph retrieval
+    assert reads == ['drive_service']
+
+    read = pbf_net_download(PBF_FILE, polygon=network_polygon, network_type='drive_service')
+    assert reads == ['drive_service', 'drive_service']
+    assert shared == read
+    assert {element['id'] for element in read[0]['elements'] if element['type'] == 'way'} == {20, 23}
@@ -0,0 +1,195 @@
+import datetime
+import os
+
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import box
+
+from urbansprawl.osm import update, utils
+from urbansprawl.osm.core import process_osm_features
+from urbansprawl.osm.elements import OSMElements, ways_to_gdf, nodes_to_gdf
+from urbansprawl.osm.tags import pois_keys
+from urbansprawl.osm.update import parse_osm_change, complete_osm_change, update_layer, update_processed_osm_data
+from urbansprawl.osm.utils import associate_structures, update_relation, load_geodataframe, store_geodataframe, store_relations, load_relations, get_dataframes_filenames, get_landuse_filename, get_relations_filename
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_parse_osm_change():
+    change = parse_osm_change(os.path.join(DATA, 'change.osc'))
+    assert change.changed == {'node': {1001, 1}, 'way': {2001}, 'relation': {3001}}
+    assert change.deleted == {'node': {1002}, 'way': {2003}, 'relation': {3002}}
+    assert change.elements.node_tags[1001] == {'amenity': 'cafe'}
+    assert change.elements.relations[3001][0] == [('way', 2002, 'outer')]
+    # osmChange files do not hold the former version of relations
+    assert change.former_members == {}
+
+
+def test_parse_augmented_diff():
+    change = parse_osm_change(os.path.join(DATA, 'change.adiff'))
+    assert change.changed == {'node': set(), 'way': {2001}, 'relation': {3001}}
+    assert change.deleted == {'node': set(), 'way': {2003}, 'relation': {3002}}
+    # Way nodes coordinates are inlined, the old version is not part of the change
+    assert change.elements.contains_nodes(np.array([1, 2, 3, 4])).all()
+    assert not change.elements.contains_nodes(np.array([5])).any()
+    assert change.former_members == {3001: {2002, 2004}, 3002: {2005}}
+
+
+def test_complete_osm_change_relation_members(monkeypatch):
+    queries = []
+
+    def run_tile_queries(query_strs, run, description=None):
+        queries.extend(query_strs)
+        return []
+    monkeypatch.setattr(update, 'run_tile_queries', run_tile_queries)
+
+    change = complete_osm_change(parse_osm_change(os.path.join(DATA, 'change.adiff')), date='[date:"2018-01-01T00:00:01Z"]', former_date='[date:"2018-01-01T00:00:00Z"]')
+    # Former and current members of the changed and deleted relations are rebuilt
+    assert change.changed['way'] == {2001, 2002, 2004, 2005}
+    assert '[date:"2018-01-01T00:00:01Z"][out:json];way(id:2002,2004,2005);(._;>;);out;' in queries
+    # Former members are known: The previous version of the relations is not queried
+    assert not any('2018-01-01T00:00:00Z' in query for query in queries)
+    assert any(query.endswith('way(id:2001,2002,2004,2005);rel(bw);out body;') for query in queries)
+
+    change = complete_osm_change(parse_osm_change(os.path.join(DATA, 'change.osc')), former_date='[date:"2018-01-01T00:00:00Z"]')
+    assert '[date:"2018-01-01T00:00:00Z"][out:json];relation(id:3001,3002);out body;' in queries
+    # Ways using the moved node: Tagged ways, and untagged members of tagged relations
+    assert any(query.startswith('[out:json];node(id:1,1001);way(bn)->.n;') and 'way.n(r.r);' in query for query in queries)
+
+
+def _squares(centers, size, start_id=0):
+    return gpd.GeoDataFrame({'osm_id': np.arange(start_id, start_id + len(centers))},
+                            geometry=[box(x - size, y - size, x + size, y + size) for x, y in centers])
+
+
+def test_update_layer():
+    df_osm = _squares([(0, 0), (10, 0), (20, 0)], 1)
+    df_new = _squares([(30, 0)], 1, start_id=1)
+    df_osm, changed, positions = update_layer(df_osm, {1}, df_new, None)
+    assert df_osm.osm_id.tolist() == [0, 2, 1]
+    assert positions.tolist() == [0, -1, 1]
+    assert changed.geometry.centroid.x.tolist() == [10, 30]
+
+
+def test_update_relation():
+    buildings = _squares([(0, 0), (10, 0), (20, 0), (30, 0)], 4)
+    parts = _squares([(0, 0), (10, 0), (11, 1), (20, 0), (30, 0)], 1)
+    relation = associate_structures(buildings, parts)
+
+    # Part 2 is removed, a part is added to building 3, building 1 is removed and a building is created
+    parts, changed_parts, parts_positions = update_layer(parts, {2}, _squares([(31, 1)], 1, start_id=5), None)
+    buildings, _, buildings_positions = update_layer(buildings, {1}, _squares([(40, 0)], 4, start_id=4), None)
+    rows = np.concatenate((np.flatnonzero(buildings_positions >= 0), [-1]))
+    to_update = np.flatnonzero(buildings.intersects(changed_parts.unary_union).values | (rows == -1))
+    updated = update_relation(relation, rows, parts_positions, to_update, associate_structures(buildings.iloc[to_update], parts))
+
+    expected = associate_structures(buildings, parts)
+    assert np.array_equal(updated[0], expected[0])
+    assert np.array_equal(updated[1], expected[1])
+
+
+def _square(elements, node_id, lat, lon, size):
+    """ Nodes of a closed square way, from its south-west corner """
+    ids = list(range(node_id, node_id + 4))
+    for id_, (dlat, dlon) in zip(ids, [(0, 0), (0, size), (size, size), (size, 0)]):
+        elements.add({'type': 'node', 'id': id_, 'lat': lat + dlat, 'lon': lon + dlon})
+    return ids + [ids[0]]
+
+
+def _city(after):
+    """
+    OSM data of a small region, before or after tests/data/change.osc:
+        building 2001 (created, with cafe 1001) shares node 1 (moved) with way 2006, untagged member of land use relation 3003
+        building 2003 (deleted, with shop 1002), building 2010 (with part 2011) within land use ways 2004 and 2007
+        land use relation 3001 (members 2002 and 2004, then 2002 only), building relation 3002 (member 2005, deleted)
+    """
+    elements = OSMElements()
+    elements.add({'type': 'node', 'id': 1, 'lat': 48.85 if after else 48.8499, 'lon': 2.35 if after else 2.3499})
+    for id_, (lat, lon) in zip([2, 3, 4, 5, 6, 7], [(48.85, 2.3505), (48.8505, 2.3505), (48.8505, 2.35), (48.85, 2.3495), (48.8495, 2.3495), (48.8495, 2.35)]):
+        elements.add({'type': 'node', 'id': id_, 'lat': lat, 'lon': lon})
+    ways = {2006: ([1, 5, 6, 7, 1], {}),
+            2002: (_square(elements, 21, 48.849, 2.349, 0.003), {}),
+            2004: (_square(elements, 31, 48.853, 2.353, 0.002), {}),
+            2010: (_square(elements, 35, 48.8535, 2.3535, 0.0005), {'building': 'yes'}),
+            2011: (_square(elements, 39, 48.8536, 2.3536, 0.0002), {'building:part': 'yes', 'building:levels': '2.5'}),
+            2005: (_square(elements, 41, 48.8515, 2.348, 0.0005), {}),
+            2007: (_square(elements, 45, 48.8525, 2.3525, 0.004), {'landuse': 'retail'})}
+    relations = {3001: ([2002, 2004], {'type': 'multipolygon', 'landuse': 'residential'}),
+                 3003: ([2006], {'type': 'multipolygon', 'landuse': 'residential'})}
+    if after:
+        ways[2001] = ([1, 2, 3, 4, 1], {'building': 'yes'})
+        elements.add({'type': 'node', 'id': 1001, 'lat': 48.8502, 'lon': 2.3502, 'tags': {'amenity': 'cafe'}})
+        relations[3001] = ([2002], relations[3001][1])
+    else:
+        ways[2003] = (_square(elements, 11, 48.851, 2.351, 0.0005), {'building': 'house'})
+        elements.add({'type': 'node', 'id': 1002, 'lat': 48.8512, 'lon': 2.3512, 'tags': {'shop': 'bakery'}})
+        relations[3002] = ([2005], {'type': 'multipolygon', 'building': 'yes'})
+    for id_, (nodes, tags) in ways.items():
+        elements.add({'type': 'way', 'id': id_, 'nodes': nodes, 'tags': tags})
+    for id_, (members, tags) in relations.items():
+        elements.add({'type': 'relation', 'id': id_, 'members': [{'type': 'way', 'ref': ref, 'role': 'outer'} for ref in members], 'tags': tags})
+    return elements
+
+
+def _processed_city(elements):
+    """ Full processing of the features: Ways tagged with each key, or members of a relation tagged with it """
+    def layer(key):
+        members = {ref for members, tags in elements.relations.values() if key in tags for _, ref, _ in members}
+        return ways_to_gdf(elements, [id_ for id_, (_, tags) in elements.ways.items() if key in tags or id_ in members])
+    pois = [id_ for id_, tags in elements.node_tags.items() if any(key in tags for key in pois_keys)]
+    return process_osm_features(layer('building'), layer('building:part'), layer('landuse'), nodes_to_gdf(elements, pois), 'city')
+
+
+def _structures_osm_ids(df_osm_built, df_osm_structures, relation):
+    """ OSM identifiers of the structures of each building """
+    indptr, indices = relation
+    osm_ids = df_osm_structures.osm_id.values[indices]
+    return {osm_id: sorted(osm_ids[indptr[i]:indptr[i + 1]]) for i, osm_id in enumerate(df_osm_built.osm_id.values)}
+
+
+def test_update_processed_osm_data(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, 'storage_folder', str(tmp_path))
+    before, after = _city(after=False), _city(after=True)
+    df_osm_built, df_osm_building_parts, df_osm_pois, df_osm_lu, relations = _processed_city(before)
+    for df_osm, filename in zip([df_osm_built, df_osm_building_parts, df_osm_pois], get_dataframes_filenames('city')):
+        store_geodataframe(df_osm, filename)
+    store_geodataframe(df_osm_lu, get_landuse_filename('city'))
+    store_relations(relations, get_relations_filename('city'))
+
+    def run_tile_queries(query_strs, run, description=None):
+        """ Overpass API answers at the time of the change """
+        completion = OSMElements()
+        if any('relation(id:' in query for query in query_strs):  # Former version of the changed relations
+            for id_ in [3001, 3002]:
+                completion.relations[id_] = before.relations[id_]
+            return [completion]
+        # Nodes of the created way, former and current members of the changed relations, and relation 3003 of the moved node
+        for id_ in [2, 3, 4, 5, 6, 7] + list(range(21, 25)) + list(range(31, 35)) + list(range(41, 45)):
+            position = after.lookup(np.array([id_]))[0][0]
+            _, lon, lat = after.node_arrays()
+            completion.add({'type': 'node', 'id': id_, 'lat': lat[position], 'lon': lon[position]})
+        for id_ in [2002, 2004, 2005, 2006]:
+            completion.ways[id_] = after.ways[id_]
+        completion.relations[3003] = after.relations[3003]
+        return [completion]
+    monkeypatch.setattr(update, 'run_tile_queries', run_tile_queries)
+
+    updated = update_processed_osm_data('city', os.path.join(DATA, 'change.osc'), date=datetime.datetime(2018, 1, 1))
+    expected = _processed_city(after)
+
+    for df_updated, df_expected in zip(updated, expected[:3]):
+        assert sorted(df_updated.osm_id) == sorted(df_expected.osm_id)
+    df_updated = updated[0].set_index('osm_id').sort_index()
+    df_expected = expected[0].set_index('osm_id').sort_index()
+    assert df_updated.classification.tolist() == df_expected.classification.tolist()
+    m2_columns = [column for column in df_expected.columns if column.startswith('m2_')]
+    assert m2_columns
+    assert np.allclose(df_updated[m2_columns].values.astype(float), df_expected[m2_columns].values.astype(float), equal_nan=True)
+    # The moved node changed the geometry of the relation member
+    df_osm_lu = load_geodataframe(get_landuse_filename('city')).set_index('osm_id')
+    assert np.isclose(df_osm_lu.geometry.area.loc[2006], expected[3].set_index('osm_id').geometry.area.loc[2006])
+
+    # Stored relations: Loaded for the updated data frames, and equal to the relations of a full processing
+    stored = load_relations(get_relations_filename('city'), *updated)
+    for name, df_structures, df_expected_structures in [('containing_parts', updated[1], expected[1]), ('containing_poi', updated[2], expected[2])]:
+        assert _structures_osm_ids(updated[0], df_structures, stored[name]) == _structures_osm_ids(expected[0], df_expected_structures, expected[4][name])
@@ -0,0 +1,38 @@
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Point, box
+
+from urbansprawl.osm.utils import compute_relations, store_relations, load_relations, get_structures_relation, associate_structures
+
+
+def _frames():
+    buildings = gpd.GeoDataFrame({'osm_id': [1, 2]}, geometry=[box(0, 0, 4, 4), box(10, 0, 14, 4)])
+    parts = gpd.GeoDataFrame({'osm_id': [10, 11]}, geometry=[box(1, 1, 2, 2), box(11, 1, 12, 2)])
+    pois = gpd.GeoDataFrame({'osm_id': [20, 21, 22]}, geometry=[Point(1, 1), Point(12, 2), Point(30, 0)])
+    return buildings, parts, pois
+
+
+def test_relations_checked_against_structures(tmp_path):
+    buildings, parts, pois = _frames()
+    relations = compute_relations(buildings, parts, pois)
+    relations_filename = str(tmp_path / 'relations.npz')
+    store_relations(relations, relations_filename)
+
+    loaded = load_relations(relations_filename, buildings, parts, pois)
+    for name in ['containing_parts', 'containing_poi']:
+        assert np.array_equal(loaded[name][0], relations[name][0])
+        assert np.array_equal(loaded[name][1], relations[name][1])
+
+    # Reordered points of interest: The stored relation does not refer to them any more
+    reordered_pois = pois.iloc[[2, 0, 1]].reset_index(drop=True)
+    loaded = load_relations(relations_filename, buildings, parts, reordered_pois)
+    assert 'containing_parts' in loaded and 'containing_poi' not in loaded
+    # Other buildings
+    assert load_relations(relations_filename, buildings.iloc[::-1], parts, pois) is None
+
+    indptr, indices = get_structures_relation(buildings, reordered_pois, 'containing_poi', relations)
+    expected = associate_structures(buildings, reordered_pois, operation='intersects')
+    assert np.array_equal(indptr, expected[0]) and np.array_equal(indices, expected[1])
+    assert reordered_pois.osm_id.values[indices].tolist() == [20, 21]
+    # Matching relation: Used as is
+    assert get_structures_relation(buildings, pois, 'containing_poi', relations) is relations['containing_poi']
@@ -0,0 +1,349 @@
+###################################################################################################
+# Repository: https://github.com/lgervasoni/urbansprawl
+# MIT License
+###################################################################################################
+
+import os
+import re
+import json
+import gzip
+import time
+import hashlib
+import datetime
+import threading
+from osmnx import log
+
+from .endpoints import overpass_post
+from .. import settings
+
+# Guards the cache eviction: concurrent requests may store responses at the same time
+_eviction_lock = threading.Lock()
+# Running size of the cache in bytes, and the folder it was measured for: Initialised by a single scan of the folder, then updated when storing and evicting responses
+_cache_size = None
+_cache_size_folder = None
+
+# Quoted strings (kept as they are) or runs of whitespace (collapsed)
+_query_tokens = re.compile(r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')|\s+')
+# Date setting of the query, e.g.: [date:"2004-05-06T00:00:00Z"] or [date:'2004-05-06T00:00:00Z']
+_query_date = re.compile(r'\[date:\s*["\']([^"\']+)["\']\s*\]')
+
+class OverpassResourceError(Exception):
+	"""
+	The Overpass server aborted a query for lack of resources (query timed out, or run out of memory): Its region needs to be split
+	"""
+	pass
+
+def check_response_remark(remark):
+	"""
+	Raise an OverpassResourceError if the remark of a response reports a server runtime error (partial response)
+	"""
+	if ( 'runtime error' in str(remark) ):
+		raise OverpassResourceError(remark)
+
+###################################################
+### Cache keys
+###################################################
+
+def normalize_query(query_str):
+	"""
+	Normalize an Overpass query string, so that equivalent queries share the same cache entry
+	Whitespace outside quoted strings is collapsed, and the date setting is written using double quotes
+
+	Parameters
+	----------
+	query_str : string
+		Overpass QL query
+
+	Returns
+	----------
+	string
+		normalized query
+	"""
+	query_str = _query_tokens.sub(lambda m: m.group(1) if m.group(1) else ' ', query_str).strip()
+	return _query_date.sub(lambda m: '[date:"{}"]'.format(m.group(1)), query_str)
+
+def get_cache_key(query_str):
+	"""
+	Get the cache key of an Overpass query: Hash of its normalized string, including its date setting
+
+	Parameters
+	----------
+	query_str : string
+		Overpass QL query
+
+	Returns
+	----------
+	string
+		hexadecimal digest
+	"""
+	return hashlib.sha256( normalize_query(query_str).encode('utf-8') ).hexdigest()
+
+def is_historical_query(query_str, margin=24*3600):
+	"""
+	Determine if the query targets the database at a past time-stamp: Its results can never change
+
+	Parameters
+	----------
+	query_str : string
+		Overpass QL query
+	margin : int
+		seconds before the current time for a date to be considered past (covers the replication delay of the Overpass database)
+
+	Returns
+	----------
+	boolean
+		True if the date setting of the query is past
+	"""
+	match = _query_date.search(query_str)
+	if (match is None):
+		return False
+	try:
+		date = datetime.datetime.strptime(match.group(1), "%Y-%m-%dT%H:%M:%SZ")
+	except ValueError:
+		return False
+	return ( datetime.datetime.utcnow() - date ).total_seconds() > margin
+
+###################################################
+### Cached requests
+###################################################
+
+def get_cache_filename(key):
+	"""
+	Get the compressed response file name of a cache key
+	"""
+	return os.path.join(settings.overpass_cache_folder, key + '.json.gz')
+
+def get_cached_response_filename(query_str):
+	"""
+	Get the compressed response file of an Overpass query, if cached
+	A cached response expires after `settings.overpass_cache_max_age` seconds, unless the query targets a past date
+
+	Parameters
+	----------
+	query_str : string
+		Overpass QL query
+
+	Returns
+	----------
+	string
+		compressed response file name (None if not cached or expired)
+	"""
+	if (settings.overpass_cache_folder is None): # Cache disabled
+		return None
+
+	filename = get_cache_filename( get_cache_key(query_str) )
+	try:
+		stored_time = os.path.getmtime(filename)
+	except OSError: # Not cached
+		return None
+
+	max_age = settings.overpass_cache_max_age
+	if ( (max_age is not None) and (time.time() - stored_time > max_age) and (not is_historical_query(query_str)) ):
+		return None
+
+	# Access time drives the least recently used eviction (modification time keeps the storage time)
+	try:
+		os.utime(filename, (time.time(), stored_time))
+	except OSError: # Evicted meanwhile
+		return None
+	return filename
+
+def load_cached_response(query_str):
+	"""
+	Load the cached response of an Overpass query
+
+	Parameters
+	----------
+	query_str : string
+		Overpass QL query
+
+	Returns
+	----------
+	dict
+		response json (None if not cached or expired)
+	"""
+	filename = get_cached_response_filename(query_str)
+	if (filename is None):
+		return None
+
+	try:
+		with gzip.open(filename, 'rt', encoding='utf-8') as f:
+			return json.load(f)
+	except (OSError, ValueError): # Evicted meanwhile, or corrupted file
+		return None
+
+def get_temporary_filename(query_str):
+	"""
+	Get a temporary file name to write the compressed response of an Overpass query to
+	Concurrent readers never see a partial response: It is moved to the cache once complete (see `store_cached_response_file`)
+	"""
+	if not(os.path.isdir(settings.overpass_cache_folder)):
+		os.makedirs(settings.overpass_cache_folder, exist_ok=True)
+	return '{}.{}.{}.tmp'.format(get_cache_filename( get_cache_key(query_str) ), os.getpid(), threading.get_ident())
+
+def _scan_cached_responses():
+	"""
+	Cached responses: (last access time, size, path) of each file
+	"""
+	entries = []
+	for entry in os.scandir(settings.overpass_cache_folder):
+		if not entry.name.endswith('.json.gz'):
+			continue
+		try:
+			stat = entry.stat()
+		except OSError:
+			continue
+		entries.append( (max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path) )
+	return entries
+
+def _update_cache_size(delta):
+	"""
+	Update the running cache size by `delta` bytes, scanning the cache folder the first time (must be called with the eviction lock held)
+	"""
+	global _cache_size, _cache_size_folder
+	if (_cache_size is None) or (_cache_size_folder != settings.overpass_cache_folder):
+		_cache_size = sum( size for _, size, _ in _scan_cached_responses() )
+		_cache_size_folder = settings.overpass_cache_folder
+	else:
+		_cache_size += delta
+	return _cache_size
+
+def store_cached_response_file(query_str, temporary_filename):
+	"""
+	Move a complete compressed response file to the cache, then evict the least recently used responses if the cache size is exceeded
+	The cache folder is only scanned once the running cache size exceeds `settings.overpass_cache_max_size`
+
+	Parameters
+	----------
+	query_str : string
+		Overpass QL query
+	temporary_filename : string
+		compressed response file name
+
+	Returns
+	----------
+
+	"""
+	filename = get_cache_filename( get_cache_key(query_str) )
+	size = os.path.getsize(temporary_filename)
+	with _eviction_lock:
+		try: # Replaced response
+			size -= os.path.getsize(filename)
+		except OSError:
+			pass
+		os.replace(temporary_filename, filename)
+		cache_size = _update_cache_size(size)
+
+	if (settings.overpass_cache_max_size is not None) and (cache_size > settings.overpass_cache_max_size):
+		evict_cached_responses()
+
+def store_cached_response(query_str, response_json):
+	"""
+	Store the compressed response of an Overpass query
+
+	Parameters
+	----------
+	query_str : string
+		Overpass QL query
+	response_json : dict
+		response json
+
+	Returns
+	----------
+
+	"""
+	temporary_filename = get_temporary_filename(query_str)
+	with gzip.open(temporary_filename, 'wt', encoding='utf-8') as f:
+		json.dump(response_json, f)
+	store_cached_response_file(query_str, temporary_filename)
+
+def evict_cached_responses(max_size=None):
+	"""
+	Remove the least recently used responses until the cache size is within `max_size` bytes
+	The cache folder is scanned only if the running cache size exceeds `max_size`. The scan corrects the running size (e.g. responses stored by other processes)
+
+	Parameters
+	----------
+	max_size : int
+		maximum size of the cache in bytes (default: `settings.overpass_cache_max_size`)
+
+	Returns
+	----------
+
+	"""
+	global _cache_size
+	if (max_size is None):
+		max_size = settings.overpass_cache_max_size
+	if (max_size is None):
+		return
+
+	with _eviction_lock:
+		if ( _update_cache_size(0) <= max_size ):
+			return
+		entries = _scan_cached_responses()
+		cache_size = sum( size for _, size, _ in entries )
+		_cache_size = cache_size
+		if (cache_size <= max_size):
+			return
+
+		for _, size, path in sorted(entries):
+			try:
+				os.remove(path)
+			except OSError:
+				continue
+			cache_size -= size
+			_cache_size = cache_size
+			if (cache_size <= max_size):
+				break
+		log('Evicted least recently used Overpass responses: Cache size {:,.1f} MB'.format(cache_size / 1024**2) )
+
+def overpass_json_request(data, timeout=180):
+	"""
+	Send a request to the Overpass API through the shared endpoint pool (see `endpoints.py`), and read its json response
+	"""
+	start_time = time.time()
+	with overpass_post(data, timeout=timeout) as response:
+		response_json = response.json()
+		log('Downloaded {:,.1f} KB from {} in {:,.2f} seconds'.format(len(response.content)/1000, response.url, time.time()-start_time))
+	return response_json
+
+def cached_overpass_request(data, timeout=180):
+	"""
+	Send a request to the Overpass API, unless its response is found in the persistent cache (`settings.overpass_cache_folder`)
+	Responses reporting a server runtime error are not stored: An OverpassResourceError is raised instead
+
+	Parameters
+	----------
+	data : dict
+		key-value pairs of parameters to post to the API, the query string under key 'data'
+	timeout : int
+		the timeout interval for the requests library
+
+	Returns
+	----------
+	dict
+		response json
+	"""
+	if (settings.overpass_cache_folder is None): # Cache disabled
+		response_json = overpass_json_request(data=data, timeout=timeout)
+		check_response_remark( response_json.get('remark') )
+		return response_json
+
+	query_str = data['data']
+	response_json = load_cached_response(query_str)
+	if (response_json is not None):
+		log('Retrieved Overpass response from cache: {}'.format( get_cache_key(query_str) ) )
+		return response_json
+
+	response_json = overpass_json_request(data=data, timeout=timeout)
+
+	# Partial responses are not stored
+	check_response_remark( response_json.get('remark') )
+	store_cached_response(query_str, response_json)
+	return response_json
+
+def merge_response_jsons(response_jsons):
+	"""
+	Merge the responses of the sub-queries of a split query into a single response
+	"""
+	return { 'elements':[ element for response_json in response_jsons for element in response_json['elements'] ] }
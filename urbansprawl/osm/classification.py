@@ -5,14 +5,19 @@
 
 import osmnx as ox
 import pandas as pd
-import geopandas as gpd
 import numpy as np
 from scipy import spatial
+import shapely
+from shapely.strtree import STRtree
+from shapely.prepared import prep
 
 from osmnx import log
 
 from .tags import key_classification, landuse_classification, activity_classification
 
+# Vectorized spatial index queries with predicates (shapely >= 2.0)
+_bulk_queries = hasattr(shapely, 'within')
+
 ####################################################################################
 # Under uncertainty: Residential assumption?
 RESIDENTIAL_ASSUMPTION_UNCERTAINTY = True
@@ -53,6 +58,14 @@ def aggregate_classification(classification_list):
 
 	return classification	
 
+# Precompiled classification tables: For each key tag (without its land use), land uses of each value
+_key_tag_classification = {}
+for key, values in key_classification.items():
+	# Get the corresponding key tag (without its land use) ; First part of key defines the land use
+	key_tag = key.replace("activity_","").replace("residential_","").replace("other_","").replace("infer_","")
+	for value in values:
+		_key_tag_classification.setdefault(key_tag, {}).setdefault(value, []).append( key.split("_")[0] )
+
 def classify_tag(tags, return_key_value=True):
 	""" 
 	Classify the land use of input OSM tag in `activity`, `residential`, `mixed`, None, or `infer` (to infer later)
@@ -70,17 +83,16 @@ def classify_tag(tags, return_key_value=True):
 	# key_value: Dictionary of osm key : osm value
 	classification, key_value = [], {}
 
-	for key, value in key_classification.items():
-		# Get the corresponding key tag (without its land use)
-		key_tag = key.replace("activity_","").replace("residential_","").replace("other_","").replace("infer_","")
-
-		if tags.get(key_tag) in value:
-			# First part of key defines the land use
-			new_classification = key.split("_")[0]
-			# Add the new classification
-			classification.append( new_classification )
-			# Associate the key-value
-			key_value[key_tag] = tags.get(key_tag)
+	for key_tag, values_classification in _key_tag_classification.items():
+		value = tags.get(key_tag)
+		try:
+			new_classification = values_classification.get(value)
+		except TypeError: # Unhashable value
+			new_classification = None
+		if (new_classification):
+			# Add the new classification, and associate the key-value
+			classification.extend( new_classification )
+			key_value[key_tag] = value
 
 	classification = aggregate_classification(classification)
 
@@ -89,6 +101,36 @@ def classify_tag(tags, return_key_value=True):
 	else:
 		return classification
 
+def classify_tags(df_osm):
+	""" 
+	Classify the land use of each row of input data frame (see `classify_tag`)
+	Rows are factorized by their classification tags: Each distinct combination is classified once, and its result broadcast to its rows
+
+	Parameters
+	----------
+	df_osm : pandas.DataFrame
+		OpenStreetMap features, with a column per tag
+	
+	Returns
+	----------
+	list, list
+		returns the classification, and the dict relating `key`:`value` defining it, of each row
+	"""
+	columns = [ key_tag for key_tag in _key_tag_classification if key_tag in df_osm.columns ]
+	tags = df_osm[columns].astype(object)
+	tags = tags.where( tags.notnull(), None )
+
+	# Distinct tag combinations, and combination of each row
+	if (columns):
+		rows = zip( *[ tags[column].values for column in columns ] )
+	else:
+		rows = [ () ] * len(df_osm)
+	combinations = {}
+	codes = [ combinations.setdefault(combination, len(combinations)) for combination in rows ]
+	results = [ classify_tag( dict( zip(columns, combination) ) ) for combination in combinations ]
+
+	return [ results[code][0] for code in codes ], [ dict( results[code][1] ) for code in codes ]
+
 ############################################
 ### Land use inference
 ############################################
@@ -117,6 +159,34 @@ def classify_landuse_inference(land_use):
 	else:
 		return None # No tag
 
+def _smallest_containing_landuse(geometries, landuse_geometries, landuse_areas):
+	""" 
+	Position of the smallest land use polygon containing each geometry, -1 if none
+	Land use polygons are sorted by area once: The smallest container is the first one in that order
+	"""
+	smallest = np.full( len(geometries), len(landuse_geometries), dtype=np.int64 )
+	if ( len(geometries) == 0 ) or ( len(landuse_geometries) == 0 ):
+		return np.full( len(geometries), -1, dtype=np.int64 )
+
+	order = np.argsort(landuse_areas, kind='mergesort')
+	sorted_geometries = landuse_geometries[order]
+	tree = STRtree( list(sorted_geometries) )
+
+	if (_bulk_queries): # All pairs (geometry, containing land use) at once
+		geometries_idx, landuse_idx = tree.query(geometries, predicate='within')
+		np.minimum.at(smallest, geometries_idx, landuse_idx)
+	else: # Candidates from the tree, tested in area order against the prepared land use polygons
+		prepared = [ prep(geometry) for geometry in sorted_geometries ]
+		position = { id(geometry):i for i, geometry in enumerate(sorted_geometries) }
+		for i, geometry in enumerate(geometries):
+			for candidate in sorted( position[ id(landuse) ] for landuse in tree.query(geometry) ):
+				if ( prepared[candidate].contains(geometry) ):
+					smallest[i] = candidate
+					break
+
+	found = smallest < len(landuse_geometries)
+	return np.where( found, order[ np.where(found, smallest, 0) ], -1 )
+
 def compute_landuse_inference(df_buildings, df_landuse):
 	""" 
 	Compute land use inference for building polygons with no information
@@ -134,29 +204,26 @@ def compute_landuse_inference(df_buildings, df_landuse):
 	----------
 	
 	"""
-	# Get those indices which need to be inferred, and keep geometry column only
-	df_buildings_to_infer = df_buildings.loc[ df_buildings['classification'] == 'infer', ["geometry"] ]
-	# Add land use polygon's area
-	df_landuse['area'] = df_landuse.apply(lambda x: x.geometry.area, axis=1)
+	# Get those buildings which need to be inferred
+	to_infer = ( df_buildings['classification'] == 'infer' ).values
+	geometries = df_buildings.geometry.values[to_infer]
 
-	# Get geometries to infer within Land use polygons matching
-	sjoin = gpd.sjoin(df_buildings_to_infer, df_landuse, op='within')
+	# Land use polygons with a valid geometry
+	valid = ( df_landuse.geometry.notnull() & ~ df_landuse.geometry.is_empty ).values
+	landuse_geometries = np.array( list( df_landuse.geometry.values[valid] ), dtype=object )
+	landuse_values = df_landuse["landuse"].values[valid]
 
-	# Add index column to sort values
-	sjoin['index'] = sjoin.index
-	# Sort values by index, then by area
-	sjoin.sort_values(by=['index','area'], inplace=True)
-	# Drop duplicates. Keep first (minimum computing area)
-	sjoin.drop_duplicates(subset=['index'], keep='first', inplace=True)
+	# Smallest land use polygon containing each building to infer
+	smallest = _smallest_containing_landuse( np.array( list(geometries), dtype=object ), landuse_geometries, df_landuse.geometry.area.values[valid] )
+	inferred = np.full( len(smallest), None, dtype=object )
+	inferred[ smallest >= 0 ] = landuse_values[ smallest[ smallest >= 0 ] ]
 
 	##### Set key:value and classification
-	# Set default value: inferred:None
-	df_buildings.loc[ df_buildings_to_infer.index, "key_value" ] = df_buildings.loc[ df_buildings_to_infer.index].apply(lambda x: {"inferred":None} , axis=1)
-	# Set land use for those buildings within a defined land use polygon
-	df_buildings.loc[ sjoin.index, "key_value" ] = sjoin.apply(lambda x: {'inferred':x.landuse}, axis=1)
-
-	# Set classification
-	df_buildings.loc[ df_buildings_to_infer.index, "classification" ] = df_buildings.loc[ df_buildings_to_infer.index, "key_value" ].apply(lambda x: classify_landuse_inference(x.get("inferred")) )
+	# Classification of each distinct inferred land use (None: No encompassing land use polygon)
+	inferred_classification = { land_use:classify_landuse_inference(land_use) for land_use in set(inferred) }
+	index_to_infer = df_buildings.index[to_infer]
+	df_buildings.loc[ index_to_infer, "key_value" ] = pd.Series( [ {"inferred":land_use} for land_use in inferred ], index=index_to_infer, dtype=object )
+	df_buildings.loc[ index_to_infer, "classification" ] = [ inferred_classification[land_use] for land_use in inferred ]
 
 	# Remove useless rows
 	df_buildings.drop( df_buildings[ df_buildings.classification.isin([None,"other"]) ].index, inplace=True)
@@ -167,6 +234,12 @@ def compute_landuse_inference(df_buildings, df_landuse):
 ### Activity type classification
 ############################################
 
+# Precompiled activity table: Activity classification of each value
+_value_activity_category = {}
+for key, values in activity_classification.items():
+	for value in values:
+		_value_activity_category.setdefault(value, key)
+
 def value_activity_category(x):
 	""" 
 	Classify the activity of input activity value
@@ -181,10 +254,24 @@ def value_activity_category(x):
 	string
 		returns the activity classification
 	"""
-	for key, value in activity_classification.items():
-		if x in value:
-			return key
-	return None
+	try:
+		return _value_activity_category.get(x)
+	except TypeError: # Unhashable value
+		return None
+
+# Activity classification of each key (None: given by its value)
+_key_activity_category = {
+	'shop': 'shop',
+	'leisure': 'leisure/amenity',
+	'amenity': 'leisure/amenity',
+	'man_made' : 'commercial/industrial',
+	'industrial' : 'commercial/industrial',
+	'landuse' : None,
+	'inferred' : None, # Inferred cases adopted land use values
+	'building' : None,
+	'building:use' : None,
+	'building:part' : None
+}
 
 def key_value_activity_category(key, value):
 	""" 
@@ -203,18 +290,9 @@ def key_value_activity_category(key, value):
 		returns the activity classification
 	"""
 	# Note that some values repeat for different keys (e.g. shop=fuel and amenity=fuel), but they do not belong to the same activity classification
-	return {
-		'shop': 'shop',
-		'leisure': 'leisure/amenity',
-		'amenity': 'leisure/amenity',
-		'man_made' : 'commercial/industrial',
-		'industrial' : 'commercial/industrial',
-		'landuse' : value_activity_category(value),
-		'inferred' : value_activity_category(value), # Inferred cases adopted land use values
-		'building' : value_activity_category(value),
-		'building:use' : value_activity_category(value),
-		'building:part' : value_activity_category(value)
-	}.get(key, None)
+	if not (key in _key_activity_category):
+		return None
+	return _key_activity_category[key] or value_activity_category(value)
 
 def classify_activity_category(key_values):
 	""" 
@@ -236,3 +314,32 @@ def classify_activity_category(key_values):
 	categories = set( [ key_value_activity_category(key,value) for key,value in key_values.items() ] )
 	categories.discard(None)
 	return list(categories)
+
+def classify_activity_categories(key_values):
+	""" 
+	Classify the activity category of each input dict of key:value pairs (see `classify_activity_category`)
+	Each distinct dict is classified once, and its result broadcast
+
+	Parameters
+	----------
+	key_values : iterable
+		dicts containing pairs of key:value relating to its usage
+	
+	Returns
+	----------
+	list
+		returns the activity classification of each input dict
+	"""
+	categories = {}
+	results = []
+	for key_value in key_values:
+		combination = tuple( sorted( key_value.items() ) )
+		try:
+			category = categories.get(combination)
+		except TypeError: # Unhashable values
+			results.append( classify_activity_category(key_value) )
+			continue
+		if (category is None):
+			category = categories[combination] = classify_activity_category(key_value)
+		results.append( list(category) )
+	return results
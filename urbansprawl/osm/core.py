@@ -8,15 +8,18 @@ import pandas as pd
 import numpy as np
 import time
 import os.path
+from concurrent.futures import ThreadPoolExecutor
 from osmnx import log
 
-from .overpass import create_landuse_gdf, create_pois_gdf, create_building_parts_gdf, create_buildings_gdf_from_input, retrieve_route_graph
+from .overpass import create_landuse_gdf, create_pois_gdf, create_building_parts_gdf, create_buildings_gdf, create_buildings_gdf_from_input, retrieve_route_graph
+from .overpass import get_region_of_interest, download_route_graph, store_route_graph, create_osm_features_gdfs
+from .pbf import create_osm_features_gdfs_from_pbf
 from .tags import columns_osm_tag, height_tags, building_parts_to_filter
-from .classification import compute_landuse_inference, classify_tag, classify_activity_category
+from .classification import compute_landuse_inference, classify_tags, classify_activity_categories
 from .surface import compute_landuses_m2
-from .utils import load_geodataframe, store_geodataframe, get_dataframes_filenames, associate_structures, sanity_check_height_tags
+from .utils import load_geodataframe, store_geodataframe, get_dataframes_filenames, get_landuse_filename, get_relations_filename, store_relations, load_relations, compute_relations, relations_operations, sanity_check_height_tags
 
-def get_route_graph(city_ref, date="", polygon=None, north=None, south=None, east=None, west=None, force_crs=None):
+def get_route_graph(city_ref, date="", polygon=None, north=None, south=None, east=None, west=None, force_crs=None, pbf_file=None, compact=False):
 	""" 
 	Wrapper to retrieve city's street network
 	Loads the data if stored locally
@@ -39,16 +42,182 @@ def get_route_graph(city_ref, date="", polygon=None, north=None, south=None, eas
 		western longitude of bounding box
 	force_crs : dict
 		graph will be projected to input crs
+	pbf_file : string
+		path to a local .osm.pbf extract to read the street network from, instead of querying the Overpass API
+	compact : bool
+		if True, return a compact CSRGraph (see `osm.graph`)
 
 	Returns
 	----------
-	networkx.multidigraph
+	networkx.multidigraph or CSRGraph
 		projected graph
 	"""
-	return retrieve_route_graph(city_ref, date, polygon, north, south, east, west, force_crs)
+	return retrieve_route_graph(city_ref, date, polygon, north, south, east, west, force_crs, pbf_file, compact)
+
+def prepare_osm_gdf(df_osm, layer, city_ref=None, to_crs=None):
+	"""
+	Prepare the OpenStreetMap features retrieved for a layer: Set OSM identifiers, sanity check height tags, drop unnecessary columns, classify tags and project geometries
+	Features which do not provide valuable information are removed
+
+	Parameters
+	----------
+	df_osm : geopandas.GeoDataFrame
+		features retrieved from OpenStreetMap, indexed by OSM identifier
+	layer : string
+		'buildings', 'building_parts', 'points' or 'landuse'
+	city_ref : str
+		Name of input city / region
+	to_crs : dict
+		geometries are projected to input crs (if None, to the UTM zone of the features)
+
+	Returns
+	----------
+	gpd.GeoDataFrame
+		prepared features
+	"""
+	if (layer == "building_parts"):
+		# Filter: 1) rows not needed (roof, etc) and 2) building that already exists in `buildings` extract
+		if ("building" in df_osm.columns):
+			df_osm = df_osm[ (~ df_osm["building:part"].isin(building_parts_to_filter) ) & (~ df_osm["building:part"].isnull() ) & (df_osm["building"].isnull()) ]
+		else:
+			df_osm = df_osm[ (~ df_osm["building:part"].isin(building_parts_to_filter) ) & (~ df_osm["building:part"].isnull() ) ]
+
+	df_osm["osm_id"] = df_osm.index
+	df_osm.reset_index(drop=True, inplace=True)
+	df_osm.gdf_name = str(city_ref) + '_' + layer if not city_ref is None else layer
+
+	if (layer == "landuse"):
+		# Drop useless columns
+		columns_of_interest = ["osm_id", "geometry", "landuse"]
+		df_osm.drop( [ col for col in list( df_osm.columns ) if not col in columns_of_interest ], axis=1, inplace=True )
+		return ox.project_gdf(df_osm, to_crs=to_crs)
+
+	###########
+	### Sanity check of height tags
+	###########
+	if (layer in ["buildings", "building_parts"]):
+		# Height tags are kept as numeric columns
+		sanity_check_height_tags(df_osm)
+		columns_of_interest = columns_osm_tag + ["osm_id", "geometry"] + height_tags
+	else:
+		columns_of_interest = columns_osm_tag + ["osm_id", "geometry"]
+
+	# Remove columns which do not provide valuable information
+	df_osm.drop( [ col for col in list( df_osm.columns ) if not col in columns_of_interest ], axis=1, inplace=True )
+
+	###########
+	### Classification
+	###########
+	df_osm['classification'], df_osm['key_value'] = classify_tags(df_osm)
+
+	if (layer == "buildings"): # Remove unnecessary buildings
+		df_osm.drop( df_osm[ df_osm.classification.isnull() ].index, inplace=True )
+		df_osm.reset_index(inplace=True, drop=True)
+	elif (layer == "points"): # Remove unnecessary POIs
+		df_osm.drop( df_osm[ df_osm.classification.isin(["infer","other"]) | df_osm.classification.isnull() ].index, inplace=True )
+		df_osm.reset_index(inplace=True, drop=True)
+	else: # Building parts will acquire its containing building land use if it is not available
+		df_osm.loc[ df_osm.classification.isin(["infer","other"]), "classification" ] = None
+
+	# Remove already used tags
+	df_osm.drop( [ c for c in columns_osm_tag if c in df_osm.columns ], axis=1, inplace=True )
+
+	###########
+	### Project
+	###########
+	return ox.project_gdf(df_osm, to_crs=to_crs)
+
+def process_osm_features(df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois, city_ref=None, kwargs={"default_height":3, "meters_per_level":3, "associate_landuses_m2":True, "mixed_building_first_floor_activity":True, "minimum_m2_building_area":9}):
+	"""
+	Process the OpenStreetMap features retrieved for a region: Height tags sanity check, classification and projection, buildings land use inference, structures association, and land uses surface
+
+	Parameters
+	----------
+	df_osm_built : geopandas.GeoDataFrame
+		buildings retrieved from OpenStreetMap, indexed by OSM identifier
+	df_osm_building_parts : geopandas.GeoDataFrame
+		building parts retrieved from OpenStreetMap, indexed by OSM identifier
+	df_osm_lu : geopandas.GeoDataFrame
+		land use polygons retrieved from OpenStreetMap, indexed by OSM identifier
+	df_osm_pois : geopandas.GeoDataFrame
+		points of interest retrieved from OpenStreetMap, indexed by OSM identifier
+	city_ref : str
+		Name of input city / region
+	kwargs : dict
+		additional arguments to drive the process (see `get_processed_osm_data`)
+
+	Returns
+	----------
+	[ gpd.GeoDataFrame, gpd.GeoDataFrame, gpd.GeoDataFrame, gpd.GeoDataFrame, dict ]
+		processed buildings, building parts, points of interest, land use polygons, and structures relations of the buildings ('containing_parts', 'containing_poi', see `compute_relations`)
+	"""
+	####################################################
+	### Height tags sanity check, classification and projection
+	####################################################
+	start_time = time.time()
+
+	### Project to UTM coordinates within the same zone
+	df_osm_built = prepare_osm_gdf(df_osm_built, "buildings", city_ref)
+	df_osm_lu = prepare_osm_gdf(df_osm_lu, "landuse", city_ref, to_crs=df_osm_built.crs)
+	df_osm_pois = prepare_osm_gdf(df_osm_pois, "points", city_ref, to_crs=df_osm_built.crs)
+	df_osm_building_parts = prepare_osm_gdf(df_osm_building_parts, "building_parts", city_ref, to_crs=df_osm_built.crs)
+
+	# Drop buildings with an area lower than a threshold
+	df_osm_built.drop( df_osm_built[ df_osm_built.geometry.area < kwargs["minimum_m2_building_area"] ].index, inplace=True )
+
+	log('Done: Height tags sanity check, OSM tags classification and geometries re-projection. Elapsed time (H:M:S): ' + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
+
+	####################################################
+	### Infer buildings land use (under uncertainty)
+	####################################################
+	start_time = time.time()
+
+	compute_landuse_inference(df_osm_built, df_osm_lu)
+
+	assert( len( df_osm_built[df_osm_built.key_value =={"inferred":"other"} ] ) == 0 )
+	assert( len( df_osm_built[df_osm_built.classification.isnull()] ) == 0 )
+	assert( len( df_osm_pois[df_osm_pois.classification.isnull()] ) == 0 )
+
+	log('Done: Land use deduction. Elapsed time (H:M:S): ' + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
+
+	####################################################
+	### Associate for each building, its containing building parts and Points of interest
+	####################################################
+	start_time = time.time()
+
+	relations = compute_relations(df_osm_built, df_osm_building_parts, df_osm_pois)
+
+	# Classify activity types
+	df_osm_built['activity_category'] = classify_activity_categories(df_osm_built.key_value)
+	df_osm_pois['activity_category'] = classify_activity_categories(df_osm_pois.key_value)
+	df_osm_building_parts['activity_category'] = classify_activity_categories(df_osm_building_parts.key_value)
+
+	log('Done: Building parts association and activity categorization. Elapsed time (H:M:S): ' + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
+
+	####################################################
+	### Associate effective number of levels, and measure the surface dedicated to each land use per building
+	####################################################
+	if (kwargs["associate_landuses_m2"]):
+		start_time = time.time()
+
+		default_height = kwargs["default_height"]
+		meters_per_level = kwargs["meters_per_level"]
+		mixed_building_first_floor_activity = kwargs["mixed_building_first_floor_activity"]
+		compute_landuses_m2(df_osm_built, df_osm_building_parts, df_osm_pois, relations["containing_parts"], relations["containing_poi"], default_height=default_height, meters_per_level=meters_per_level, mixed_building_first_floor_activity=mixed_building_first_floor_activity)
+
+		# Set the composed classification given, for each building, its containing Points of Interest and building parts classification
+		df_osm_built.loc[ (df_osm_built.m2_activity > 0) & (df_osm_built.m2_residential > 0), "classification" ] = "mixed"
+
+		log('Done: Land uses surface association. Elapsed time (H:M:S): ' + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
+
+	df_osm_built.loc[ df_osm_built.activity_category.apply(lambda x: len(x)==0 ), "activity_category" ] = np.nan
+	df_osm_pois.loc[ df_osm_pois.activity_category.apply(lambda x: len(x)==0 ), "activity_category" ] = np.nan
+	df_osm_building_parts.loc[ df_osm_building_parts.activity_category.apply(lambda x: len(x)==0 ), "activity_category" ] = np.nan		
+
+	return df_osm_built, df_osm_building_parts, df_osm_pois, df_osm_lu, relations
 
 def get_processed_osm_data(city_ref=None, region_args={"polygon":None, "place":None, "which_result":1, "point":None, "address":None, "distance":None, "north":None, "south":None, "east":None, "west":None},
-			kwargs={"retrieve_graph":True, "default_height":3, "meters_per_level":3, "associate_landuses_m2":True, "mixed_building_first_floor_activity":True, "minimum_m2_building_area":9, "date":None}):
+			kwargs={"retrieve_graph":True, "default_height":3, "meters_per_level":3, "associate_landuses_m2":True, "mixed_building_first_floor_activity":True, "minimum_m2_building_area":9, "date":None, "max_workers":1, "combined_query":False, "pbf_file":None}):
 	"""
 	Retrieves buildings, building parts, and Points of Interest associated with a residential/activity land use from OpenStreetMap data for input city
 	If a name for input city is given, the data will be loaded (if it was previously stored)
@@ -99,11 +268,20 @@ def get_processed_osm_data(city_ref=None, region_args={"polygon":None, "place":N
 				minimum area to be considered a building (otherwise filtered)
 			date : datetime.datetime
 				query the database at a certain time-stamp
+			max_workers : int
+				number of layers (buildings, building parts, land use, POIs, street network) retrieved at the same time (1: sequential retrieval)
+				the Overpass requests in flight remain bounded by `settings.overpass_max_workers`, shared by all the queries
+			combined_query : boolean
+				if True: Buildings, building parts, land use and POIs are retrieved with a single Overpass query per (sub-)region, and split client-side
+				if False: A dedicated Overpass query is sent for each feature class
+			pbf_file : string
+				path to a local .osm.pbf extract to read the data from, instead of querying the Overpass API (date is then ignored)
 
 	Returns
 	----------
 	[ gpd.GeoDataFrame, gpd.GeoDataFrame, gpd.GeoDataFrame ]
 		returns the output geo dataframe containing all buildings, building parts, and points associated to a residential or activity land usage
+		the structures relations of the buildings are stored along with them (see `load_relations` and `get_relations_filename`)
 	
 	"""
 	log("OSM data requested for city: " + str(city_ref) )
@@ -119,7 +297,12 @@ def get_processed_osm_data(city_ref=None, region_args={"polygon":None, "place":N
 		if ( os.path.isfile(geo_poly_file) ): # File exists
 			log("Found stored files for city " + city_ref)
 			# Load local GeoDataFrames
-			return load_geodataframe(geo_poly_file), load_geodataframe(geo_poly_parts_file), load_geodataframe(geo_point_file)
+			df_osm_built, df_osm_building_parts, df_osm_pois = load_geodataframe(geo_poly_file), load_geodataframe(geo_poly_parts_file), load_geodataframe(geo_point_file)
+			# Structures relations of the buildings
+			relations = load_relations(get_relations_filename(city_ref), df_osm_built, df_osm_building_parts, df_osm_pois)
+			if (relations is None) or any( name not in relations for name in relations_operations ): # Stored before the relations files, or for other structures
+				store_relations( compute_relations(df_osm_built, df_osm_building_parts, df_osm_pois), get_relations_filename(city_ref) )
+			return df_osm_built, df_osm_building_parts, df_osm_pois
 
 	# Get keyword arguments for input region of interest
 	polygon, place, which_result, point, address, distance, north, south, east, west = region_args.get("polygon"), region_args.get("place"), region_args.get("which_result"), region_args.get("point"), region_args.get("address"), region_args.get("distance"), region_args.get("north"), region_args.get("south"), region_args.get("east"), region_args.get("west")
@@ -137,165 +320,82 @@ def get_processed_osm_data(city_ref=None, region_args={"polygon":None, "place":N
 	else:
 		date_query = ""
 
-	##########################
-	### Overpass query: Buildings
-	##########################
-	# Query and update bounding box / polygon
-	df_osm_built, polygon, north, south, east, west = create_buildings_gdf_from_input(date=date_query, polygon=polygon, place=place, which_result=which_result, point=point, address=address, distance=distance, north=north, south=south, east=east, west=west)
-	df_osm_built["osm_id"] = df_osm_built.index
-	df_osm_built.reset_index(drop=True, inplace=True)
-	df_osm_built.gdf_name = str(city_ref) + '_buildings' if not city_ref is None else 'buildings'
-	##########################
-	### Overpass query: Land use polygons. Aid to perform buildings land use inference
-	##########################
-	df_osm_lu = create_landuse_gdf(date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)
-	df_osm_lu["osm_id"] = df_osm_lu.index
-	# Drop useless columns
-	columns_of_interest = ["osm_id", "geometry", "landuse"]
-	df_osm_lu.drop( [ col for col in list( df_osm_lu.columns ) if not col in columns_of_interest ], axis=1, inplace=True )
-	df_osm_lu.reset_index(drop=True, inplace=True)
-	df_osm_lu.gdf_name = str(city_ref) + '_landuse' if not city_ref is None else 'landuse'
-	##########################
-	### Overpass query: POIs
-	##########################
-	df_osm_pois = create_pois_gdf(date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)
-	df_osm_pois["osm_id"] = df_osm_pois.index
-	df_osm_pois.reset_index(drop=True, inplace=True)
-	df_osm_pois.gdf_name = str(city_ref) + '_points' if not city_ref is None else 'points'
-	##########
-	### Overpass query: Building parts. Allow to calculate the real amount of M^2 for each building
-	##########
-	df_osm_building_parts = create_building_parts_gdf(date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)	
-	# Filter: 1) rows not needed (roof, etc) and 2) building that already exists in `buildings` extract
-	if ("building" in df_osm_building_parts.columns):
-		df_osm_building_parts = df_osm_building_parts[ (~ df_osm_building_parts["building:part"].isin(building_parts_to_filter) ) & (~ df_osm_building_parts["building:part"].isnull() ) & (df_osm_building_parts["building"].isnull()) ]
-	else:
-		df_osm_building_parts = df_osm_building_parts[ (~ df_osm_building_parts["building:part"].isin(building_parts_to_filter) ) & (~ df_osm_building_parts["building:part"].isnull() ) ]
-	df_osm_building_parts["osm_id"] = df_osm_building_parts.index
-	df_osm_building_parts.reset_index(drop=True, inplace=True)
-	df_osm_building_parts.gdf_name = str(city_ref) + '_building_parts' if not city_ref is None else 'building_parts'
-	
-	log("Done: OSM data requests. Elapsed time (H:M:S): " + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
-
-	####################################################
-	### Sanity check of height tags
-	####################################################
-	start_time = time.time()
-
-	sanity_check_height_tags(df_osm_built)
-	sanity_check_height_tags(df_osm_building_parts)
-
-	def remove_nan_dict(x): # Remove entries with NaN values
-		return { k:v for k, v in x.items() if pd.notnull(v) }
-
-	df_osm_built['height_tags'] = df_osm_built[ [ c for c in height_tags if c in df_osm_built.columns ] ].apply(lambda x: remove_nan_dict(x.to_dict() ), axis=1)
-	df_osm_building_parts['height_tags'] = df_osm_building_parts[ [ c for c in height_tags if c in df_osm_building_parts.columns ] ].apply(lambda x: remove_nan_dict(x.to_dict() ), axis=1)
-
-	###########
-	### Remove columns which do not provide valuable information
-	###########	
-	columns_of_interest = columns_osm_tag + ["osm_id", "geometry", "height_tags"]
-	df_osm_built.drop( [ col for col in list( df_osm_built.columns ) if not col in columns_of_interest ], axis=1, inplace=True )
-	df_osm_building_parts.drop( [ col for col in list( df_osm_building_parts.columns ) if not col in columns_of_interest ], axis=1, inplace=True)
-
-	columns_of_interest = columns_osm_tag + ["osm_id", "geometry"]
-	df_osm_pois.drop( [ col for col in list( df_osm_pois.columns ) if not col in columns_of_interest ], axis=1, inplace=True )	
-
-	
-	log('Done: Height tags sanity check and unnecessary columns have been dropped. Elapsed time (H:M:S): ' + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
-
-	###########
-	### Classification
-	###########
-	start_time = time.time()
-
-	df_osm_built['classification'], df_osm_built['key_value'] = list( zip(*df_osm_built.apply( classify_tag, axis=1) ) )
-	df_osm_pois['classification'], df_osm_pois['key_value'] = list( zip(*df_osm_pois.apply( classify_tag, axis=1) ) )
-	df_osm_building_parts['classification'], df_osm_building_parts['key_value'] = list( zip(*df_osm_building_parts.apply( classify_tag, axis=1) ) )
-
-	# Remove unnecessary buildings
-	df_osm_built.drop( df_osm_built[ df_osm_built.classification.isnull() ].index, inplace=True )
-	df_osm_built.reset_index(inplace=True, drop=True)
-	# Remove unnecessary POIs
-	df_osm_pois.drop( df_osm_pois[ df_osm_pois.classification.isin(["infer","other"]) | df_osm_pois.classification.isnull() ].index, inplace=True )
-	df_osm_pois.reset_index(inplace=True, drop=True)
-	# Building parts will acquire its containing building land use if it is not available
-	df_osm_building_parts.loc[ df_osm_building_parts.classification.isin(["infer","other"]), "classification" ] = None
-
-	log('Done: OSM tags classification. Elapsed time (H:M:S): ' + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
-	
-	###########
-	### Remove already used tags
-	###########
-	start_time = time.time()
-
-	df_osm_built.drop( [ c for c in columns_osm_tag if c in df_osm_built.columns ], axis=1, inplace=True )
-	df_osm_pois.drop( [ c for c in columns_osm_tag if c in df_osm_pois.columns ], axis=1, inplace=True )
-	df_osm_building_parts.drop( [ c for c in columns_osm_tag if c in df_osm_building_parts.columns ], axis=1, inplace=True)
-
-	###########
-	### Project, drop small buildings and reset indices
-	###########
-	### Project to UTM coordinates within the same zone
-	df_osm_built = ox.project_gdf(df_osm_built)
-	df_osm_lu = ox.project_gdf(df_osm_lu, to_crs=df_osm_built.crs)
-	df_osm_pois = ox.project_gdf(df_osm_pois, to_crs=df_osm_built.crs)
-	df_osm_building_parts = ox.project_gdf(df_osm_building_parts, to_crs=df_osm_built.crs)
-
-	# Drop buildings with an area lower than a threshold
-	df_osm_built.drop( df_osm_built[ df_osm_built.geometry.area < kwargs["minimum_m2_building_area"] ].index, inplace=True )
-
-	log('Done: Geometries re-projection. Elapsed time (H:M:S): ' + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
-
-	####################################################
-	### Infer buildings land use (under uncertainty)
-	####################################################
-	start_time = time.time()
+	G = None
+	max_workers = kwargs.get("max_workers", 1) or 1
+	combined_query = kwargs.get("combined_query", False)
+	pbf_file = kwargs.get("pbf_file")
 
-	compute_landuse_inference(df_osm_built, df_osm_lu)
-	# Free space
-	del df_osm_lu
-
-	assert( len( df_osm_built[df_osm_built.key_value =={"inferred":"other"} ] ) == 0 )
-	assert( len( df_osm_built[df_osm_built.classification.isnull()] ) == 0 )
-	assert( len( df_osm_pois[df_osm_pois.classification.isnull()] ) == 0 )
-
-	log('Done: Land use deduction. Elapsed time (H:M:S): ' + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
-
-	####################################################
-	### Associate for each building, its containing building parts and Points of interest
-	####################################################
-	start_time = time.time()
-
-	associate_structures(df_osm_built, df_osm_building_parts, operation='contains', column='containing_parts')
-	associate_structures(df_osm_built, df_osm_pois, operation='intersects', column='containing_poi')
-
-	# Classify activity types
-	df_osm_built['activity_category'] = df_osm_built.apply(lambda x: classify_activity_category(x.key_value), axis=1)
-	df_osm_pois['activity_category'] = df_osm_pois.apply(lambda x: classify_activity_category(x.key_value), axis=1)
-	df_osm_building_parts['activity_category'] = df_osm_building_parts.apply(lambda x: classify_activity_category(x.key_value), axis=1)
-
-	log('Done: Building parts association and activity categorization. Elapsed time (H:M:S): ' + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
-
-	####################################################
-	### Associate effective number of levels, and measure the surface dedicated to each land use per building
-	####################################################
-	if (kwargs["associate_landuses_m2"]):
-		start_time = time.time()
-
-		default_height = kwargs["default_height"]
-		meters_per_level = kwargs["meters_per_level"]
-		mixed_building_first_floor_activity = kwargs["mixed_building_first_floor_activity"]
-		compute_landuses_m2(df_osm_built, df_osm_building_parts, df_osm_pois, default_height=default_height, meters_per_level=meters_per_level, mixed_building_first_floor_activity=mixed_building_first_floor_activity)
-
-		# Set the composed classification given, for each building, its containing Points of Interest and building parts classification
-		df_osm_built.loc[ df_osm_built.apply(lambda x: x.landuses_m2["activity"]>0 and x.landuses_m2["residential"]>0, axis=1 ), "classification" ] = "mixed"
+	if (pbf_file): # Local extract
+		##########################
+		### Local .osm.pbf extract: Buildings, land use polygons, POIs and building parts
+		##########################
+		polygon, north, south, east, west = get_region_of_interest(polygon=polygon, place=place, which_result=which_result, point=point, address=address, distance=distance, north=north, south=south, east=east, west=west)
+		if (date_query):
+			log("Date is ignored when reading a local extract: " + pbf_file)
+		# Street network read within the same pass, unless its graph is stored
+		if ( kwargs["retrieve_graph"] and not os.path.isfile( os.path.join(ox.settings.data_folder, str(city_ref)+'_network.graphml') ) ):
+			network_type = 'drive_service'
+		else:
+			network_type = None
+		df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois = create_osm_features_gdfs_from_pbf(pbf_file, polygon=polygon, north=north, south=south, east=east, west=west, network_type=network_type)
+
+	elif ( combined_query or (max_workers > 1) ): # Combined query and/or concurrent retrieval
+		##########################
+		### Overpass queries: Buildings, land use polygons, POIs, building parts and street network graph
+		##########################
+		# Resolve the region of interest, then send all queries at the same time
+		polygon, north, south, east, west = get_region_of_interest(polygon=polygon, place=place, which_result=which_result, point=point, address=address, distance=distance, north=north, south=south, east=east, west=west)
+		log("Requesting OSM data using " + str(max_workers) + " concurrent workers" + (" and a combined query" if combined_query else "") )
+
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			if (combined_query): # Buildings, building parts, land use polygons and POIs within a single query
+				future_features = executor.submit(create_osm_features_gdfs, date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)
+			else:
+				future_built = executor.submit(create_buildings_gdf, date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)
+				future_lu = executor.submit(create_landuse_gdf, date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)
+				future_pois = executor.submit(create_pois_gdf, date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)
+				future_parts = executor.submit(create_building_parts_gdf, date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)
+			# Street network graph: Projected and stored once the buildings projection is known
+			if ( kwargs["retrieve_graph"] and city_ref and not os.path.isfile( os.path.join(ox.settings.data_folder, str(city_ref)+'_network.graphml') ) ):
+				future_graph = executor.submit(download_route_graph, city_ref, date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)
+			else:
+				future_graph = None
+
+			# Join the results before processing
+			if (combined_query):
+				df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois = future_features.result()
+			else:
+				df_osm_built = future_built.result()
+				df_osm_lu = future_lu.result()
+				df_osm_pois = future_pois.result()
+				df_osm_building_parts = future_parts.result()
+			if (future_graph is not None):
+				try:
+					G = future_graph.result()
+				except Exception as e:
+					log("Osmnx graph could not be retrieved." + str(e))
+	else:
+		##########################
+		### Overpass query: Buildings
+		##########################
+		# Query and update bounding box / polygon
+		df_osm_built, polygon, north, south, east, west = create_buildings_gdf_from_input(date=date_query, polygon=polygon, place=place, which_result=which_result, point=point, address=address, distance=distance, north=north, south=south, east=east, west=west)
+		##########################
+		### Overpass query: Land use polygons. Aid to perform buildings land use inference
+		##########################
+		df_osm_lu = create_landuse_gdf(date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)
+		##########################
+		### Overpass query: POIs
+		##########################
+		df_osm_pois = create_pois_gdf(date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)
+		##########
+		### Overpass query: Building parts. Allow to calculate the real amount of M^2 for each building
+		##########
+		df_osm_building_parts = create_building_parts_gdf(date=date_query, polygon=polygon, north=north, south=south, east=east, west=west)
 
-		log('Done: Land uses surface association. Elapsed time (H:M:S): ' + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
+	log("Done: OSM data requests. Elapsed time (H:M:S): " + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
 
-	df_osm_built.loc[ df_osm_built.activity_category.apply(lambda x: len(x)==0 ), "activity_category" ] = np.nan
-	df_osm_pois.loc[ df_osm_pois.activity_category.apply(lambda x: len(x)==0 ), "activity_category" ] = np.nan
-	df_osm_building_parts.loc[ df_osm_building_parts.activity_category.apply(lambda x: len(x)==0 ), "activity_category" ] = np.nan		
+	df_osm_built, df_osm_building_parts, df_osm_pois, df_osm_lu, relations = process_osm_features(df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois, city_ref, kwargs)
 
 	##########################
 	### Overpass query: Street network graph
@@ -303,7 +403,10 @@ def get_processed_osm_data(city_ref=None, region_args={"polygon":None, "place":N
 	if (kwargs["retrieve_graph"]): # Save graph for input city shape
 		start_time = time.time()
 
-		get_route_graph(city_ref, date=date_query, polygon=polygon, north=north, south=south, east=east, west=west, force_crs=df_osm_built.crs)
+		if (G is not None): # Graph retrieved concurrently: Project and store it
+			store_route_graph(G, city_ref, force_crs=df_osm_built.crs)
+		else:
+			get_route_graph(city_ref, date=date_query, polygon=polygon, north=north, south=south, east=east, west=west, force_crs=df_osm_built.crs, pbf_file=pbf_file)
 
 		log('Done: Street network graph retrieval. Elapsed time (H:M:S): ' + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
 
@@ -315,6 +418,10 @@ def get_processed_osm_data(city_ref=None, region_args={"polygon":None, "place":N
 		store_geodataframe(df_osm_built, geo_poly_file)
 		store_geodataframe(df_osm_building_parts, geo_poly_parts_file)
 		store_geodataframe(df_osm_pois, geo_point_file)
+		# Land use polygons: Allow incremental updates (see `update.py`)
+		store_geodataframe(df_osm_lu, get_landuse_filename(city_ref))
+		# Structures relations of the buildings, as index arrays
+		store_relations(relations, get_relations_filename(city_ref))
 		log("Stored OSM data files for city: "+city_ref)
 
 	return df_osm_built, df_osm_building_parts, df_osm_pois
\ No newline at end of file
@@ -0,0 +1,523 @@
+###################################################################################################
+# Repository: https://github.com/lgervasoni/urbansprawl
+# MIT License
+###################################################################################################
+
+import os
+import re
+import json
+import gzip
+import time
+import codecs
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from array import array
+from shapely.geometry import Point
+from shapely.geometry import Polygon
+import shapely
+from osmnx import log
+import logging as lg
+
+from .. import settings
+from .endpoints import overpass_post
+from .cache import get_cached_response_filename, get_temporary_filename, store_cached_response_file, check_response_remark, OverpassResourceError
+
+# Opening of the elements array within an Overpass json response
+_elements_start = re.compile(r'"elements"\s*:\s*\[')
+# Remark field following the elements array, e.g.: "remark": "runtime error: Query timed out..."
+_remark = re.compile(r'"remark"\s*:\s*("(?:[^"\\]|\\.)*")')
+# Size of the chunks read from the response stream
+_chunk_size = 1 << 16
+# Vectorized geometries creation (shapely >= 2.0)
+_bulk_geometries = hasattr(shapely, 'polygons')
+
+#######################################################################
+### Elements container
+#######################################################################
+
+class OSMElements():
+	"""
+	Compact container of OpenStreetMap elements, filled incrementally while the Overpass responses are parsed
+	Nodes coordinates are stored as arrays, ways nodes as integer arrays. Only tags are kept as dictionaries
+
+	Attributes
+	----------
+	node_ids, node_lon, node_lat : array.array
+		nodes identifiers and coordinates
+	node_tags : dict
+		tags of tagged nodes, by node identifier
+	ways : dict
+		(nodes array, tags) of each way, by way identifier
+	relations : dict
+		(members list of (type, ref, role), tags) of each relation, by relation identifier
+	keep_tags : set
+		tag keys retained (None: all tags are retained)
+	"""
+	def __init__(self, keep_tags=None):
+		self.node_ids = array('q')
+		self.node_lon = array('d')
+		self.node_lat = array('d')
+		self.node_tags = {}
+		self.ways = {}
+		self.relations = {}
+		self.keep_tags = keep_tags
+		self._node_arrays = None
+
+	def _tags(self, element):
+		"""
+		Tags of an element, restricted to the retained keys
+		"""
+		tags = element.get('tags', {})
+		if (self.keep_tags is None):
+			return tags
+		return { key:value for key, value in tags.items() if key in self.keep_tags }
+
+	def add(self, element):
+		"""
+		Add an element of an Overpass json response
+		Coordinates inlined within ways (`out geom` output mode) are added as nodes
+		"""
+		type_ = element.get('type')
+		if (type_ == 'node'):
+			self.node_ids.append(element['id'])
+			self.node_lon.append(element['lon'])
+			self.node_lat.append(element['lat'])
+			if 'tags' in element:
+				self.node_tags[element['id']] = self._tags(element)
+			self._node_arrays = None
+		elif (type_ == 'way'):
+			if 'geometry' in element:
+				for id_, coord in zip(element['nodes'], element['geometry']):
+					if (coord is not None):
+						self.node_ids.append(id_)
+						self.node_lon.append(coord['lon'])
+						self.node_lat.append(coord['lat'])
+				self._node_arrays = None
+			self.ways[element['id']] = ( array('q', element['nodes']), self._tags(element) )
+		elif (type_ == 'relation'):
+			self.relations[element['id']] = ( [ (member['type'], member['ref'], member.get('role','')) for member in element.get('members',[]) ], self._tags(element) )
+
+	def merge(self, other):
+		"""
+		Add the elements of another container (e.g. retrieved for a different tile)
+		"""
+		self.node_ids.extend(other.node_ids)
+		self.node_lon.extend(other.node_lon)
+		self.node_lat.extend(other.node_lat)
+		self.node_tags.update(other.node_tags)
+		self.ways.update(other.ways)
+		self.relations.update(other.relations)
+		self._node_arrays = None
+		return self
+
+	def node_arrays(self):
+		"""
+		Sorted unique node identifiers, and their coordinates
+
+		Returns
+		----------
+		[ np.array, np.array, np.array ]
+			node identifiers (sorted), longitudes, latitudes
+		"""
+		if (self._node_arrays is None):
+			ids, first = np.unique( np.frombuffer(self.node_ids, dtype=np.int64), return_index=True )
+			self._node_arrays = ( ids, np.frombuffer(self.node_lon, dtype=np.float64)[first], np.frombuffer(self.node_lat, dtype=np.float64)[first] )
+		return self._node_arrays
+
+	def lookup(self, nodes):
+		"""
+		Position of input nodes within the sorted node arrays
+
+		Parameters
+		----------
+		nodes : np.array
+			node identifiers
+
+		Returns
+		----------
+		[ np.array, np.array ]
+			positions, and boolean mask of the nodes retrieved
+		"""
+		ids, _, _ = self.node_arrays()
+		nodes = np.asarray(nodes, dtype=np.int64)
+		if ( len(ids) == 0 ):
+			return np.zeros(len(nodes), dtype=np.int64), np.zeros(len(nodes), dtype=bool)
+		positions = np.minimum( np.searchsorted(ids, nodes), len(ids)-1 )
+		return positions, ( ids[positions] == nodes )
+
+	def coordinates(self, nodes):
+		"""
+		Get the (lon, lat) coordinates of input nodes. Raises KeyError if a node was not retrieved
+		"""
+		positions, found = self.lookup(nodes)
+		if not ( found.all() ):
+			raise KeyError( np.asarray(nodes)[~found][0] )
+		_, lon, lat = self.node_arrays()
+		return np.column_stack( (lon[positions], lat[positions]) )
+
+	def contains_nodes(self, nodes):
+		"""
+		Boolean mask of input nodes which were retrieved
+		"""
+		return self.lookup(nodes)[1]
+
+def merge_elements(elements_list):
+	"""
+	Merge the containers of the sub-queries of a split query into a single container
+	"""
+	elements = OSMElements()
+	for other in elements_list:
+		elements.merge(other)
+	return elements
+
+#######################################################################
+### Streaming parser
+#######################################################################
+
+def parse_overpass_stream(chunks, callback):
+	"""
+	Incrementally parse an Overpass json response: Each element is passed to `callback` as soon as it is complete
+	Only the element being decoded is held in memory, not the whole response
+
+	Parameters
+	----------
+	chunks : iterable
+		bytes chunks of the json response
+	callback : function
+		called with each element dict of the response
+
+	Returns
+	----------
+	string
+		remark of the response (None if not given)
+	"""
+	decoder = json.JSONDecoder()
+	utf8 = codecs.getincrementaldecoder('utf-8')()
+	buffer, position = '', 0
+	within_elements, finished = False, False
+	tail = []
+
+	for chunk in chunks:
+		text = utf8.decode(chunk)
+		if (finished):
+			tail.append(text)
+			continue
+		buffer = buffer[position:] + text
+		position = 0
+
+		if not (within_elements):
+			match = _elements_start.search(buffer)
+			if (match is None): # Header not entirely read yet
+				continue
+			within_elements = True
+			position = match.end()
+
+		while True:
+			# Skip separators between elements
+			while ( (position < len(buffer)) and (buffer[position] in ', \t\r\n') ):
+				position += 1
+			if (position >= len(buffer)):
+				break
+			if (buffer[position] == ']'): # End of the elements array
+				finished = True
+				tail.append(buffer[position+1:])
+				buffer, position = '', 0
+				break
+			try:
+				element, position = decoder.raw_decode(buffer, position)
+			except ValueError: # Incomplete element: Wait for the next chunk
+				break
+			callback(element)
+
+	if not (finished):
+		raise ValueError('Incomplete Overpass response: ' + buffer[position:position+200])
+
+	remark = _remark.search( ''.join(tail) )
+	if (remark is None):
+		return None
+	return json.loads( remark.group(1) )
+
+def _overpass_stream(data, timeout, temporary_filename=None):
+	"""
+	Stream the bytes of an Overpass API response, optionally copying them to a compressed file
+	The request is sent through the shared endpoint pool (see `endpoints.py`)
+	"""
+	start_time = time.time()
+	with overpass_post(data, timeout=timeout, stream=True) as response:
+		output = None if temporary_filename is None else gzip.open(temporary_filename, 'wb')
+		size = 0
+		try:
+			for chunk in response.iter_content(chunk_size=_chunk_size):
+				size += len(chunk)
+				if (output is not None):
+					output.write(chunk)
+				yield chunk
+		finally:
+			if (output is not None):
+				output.close()
+		url = response.url
+	log('Streamed {:,.1f} KB from {} in {:,.2f} seconds'.format(size/1000, url, time.time()-start_time))
+
+def _cached_stream(filename):
+	"""
+	Stream the bytes of a cached compressed response
+	"""
+	with gzip.open(filename, 'rb') as f:
+		for chunk in iter(lambda: f.read(_chunk_size), b''):
+			yield chunk
+
+def overpass_elements_request(data, elements, timeout=180):
+	"""
+	Send a request to the Overpass API, and add the elements of its response to `elements` while it is being received
+	The response is read from the persistent cache if stored, otherwise it is stored while streamed
+	Raises an OverpassResourceError if the server aborted the query (partial response)
+
+	Parameters
+	----------
+	data : dict
+		key-value pairs of parameters to post to the API, the query string under key 'data'
+	elements : OSMElements
+		container filled with the response elements
+	timeout : int
+		the timeout interval for the requests library
+
+	Returns
+	----------
+	OSMElements
+		the filled container
+	"""
+	query_str = data['data']
+
+	filename = get_cached_response_filename(query_str)
+	if (filename is not None):
+		log('Retrieved Overpass response from cache: {}'.format(filename))
+		parse_overpass_stream( _cached_stream(filename), elements.add )
+		return elements
+
+	temporary_filename = None if settings.overpass_cache_folder is None else get_temporary_filename(query_str)
+	try:
+		remark = parse_overpass_stream( _overpass_stream(data, timeout, temporary_filename), elements.add )
+	except Exception:
+		if (temporary_filename is not None) and os.path.isfile(temporary_filename):
+			os.remove(temporary_filename)
+		raise
+
+	if (remark is not None):
+		log('Overpass response remark: ' + str(remark), level=lg.WARNING)
+	try:
+		check_response_remark(remark)
+	except OverpassResourceError: # Partial response: Do not store it
+		if (temporary_filename is not None):
+			os.remove(temporary_filename)
+		raise
+	if (temporary_filename is not None):
+		store_cached_response_file(query_str, temporary_filename)
+	return elements
+
+#######################################################################
+### GeoDataFrames assembly
+#######################################################################
+
+def _polygons(coords, offsets):
+	"""
+	Build the polygons whose exterior rings are given by consecutive slices of `coords`
+	A single vectorized call is used if available (shapely >= 2.0), otherwise polygons are built one at a time
+
+	Parameters
+	----------
+	coords : np.array
+		(lon, lat) coordinates of all rings
+	offsets : np.array
+		start of each ring within `coords`, followed by the total number of coordinates
+
+	Returns
+	----------
+	np.array
+		polygons (object array)
+	"""
+	if ( len(offsets) <= 1 ): # No rings
+		return np.empty(0, dtype=object)
+	if (_bulk_geometries):
+		ring_index = np.repeat( np.arange(len(offsets)-1), np.diff(offsets) )
+		return shapely.polygons( shapely.linearrings(coords, indices=ring_index) )
+	polygons = np.empty(len(offsets)-1, dtype=object)
+	polygons[:] = [ Polygon( coords[start:end] ) for start, end in zip(offsets[:-1], offsets[1:]) ]
+	return polygons
+
+def _points(coords):
+	"""
+	Build the points of input (lon, lat) coordinates (object array)
+	"""
+	if (_bulk_geometries):
+		return shapely.points(coords)
+	points = np.empty(len(coords), dtype=object)
+	points[:] = [ Point(coord) for coord in coords ]
+	return points
+
+def _features_gdf(ids, tags, columns):
+	"""
+	Assemble identifiers, tags dictionaries and additional columns into a GeoDataFrame
+	"""
+	if ( len(ids) == 0 ): # No features
+		gdf = gpd.GeoDataFrame()
+	else:
+		gdf = gpd.GeoDataFrame( pd.DataFrame.from_records(tags, index=ids, columns=sorted( set().union(*tags) )) )
+		for column, values in columns.items():
+			gdf[column] = pd.Series(values, index=gdf.index)
+		gdf = gdf.set_geometry('geometry')
+	gdf.crs = {'init':'epsg:4326'}
+	return gdf
+
+def concat_gdfs(gdfs):
+	"""
+	Concatenate the partial GeoDataFrames assembled for each tile of a region
+	Features retrieved by several tiles (crossing tile borders) are kept once
+
+	Parameters
+	----------
+	gdfs : list
+		GeoDataFrames indexed by OSM identifier
+
+	Returns
+	----------
+	GeoDataFrame
+		concatenated features
+	"""
+	gdfs = [ gdf for gdf in gdfs if len(gdf) ]
+	if not (gdfs):
+		return _features_gdf([], [], {})
+	gdf = gpd.GeoDataFrame( pd.concat(gdfs, sort=False), crs=gdfs[0].crs )
+	return gdf[ ~ gdf.index.duplicated(keep='first') ]
+
+def ways_to_gdf(elements, way_ids=None):
+	"""
+	Assemble the closed ways of the container into a GeoDataFrame of polygons
+	Way nodes are looked up in the sorted node arrays at once, and all polygons are built from a single coordinates array
+	Ways whose nodes are missing or not forming a polygon are discarded
+
+	Parameters
+	----------
+	elements : OSMElements
+		parsed elements
+	way_ids : iterable
+		ways to assemble (default: all ways)
+
+	Returns
+	----------
+	GeoDataFrame
+		polygons indexed by way identifier, with their nodes and tags
+	"""
+	if (way_ids is None):
+		way_ids = elements.ways.keys()
+	way_ids = np.fromiter(way_ids, dtype=np.int64)
+	ways = [ elements.ways[id_] for id_ in way_ids ]
+
+	# Rings as offsets within the concatenated way nodes
+	lengths = np.array( [ len(nodes) for nodes, _ in ways ], dtype=np.int64 )
+	offsets = np.concatenate( ( [0], np.cumsum(lengths) ) )
+	nodes = np.concatenate( [ np.frombuffer(nodes, dtype=np.int64) for nodes, _ in ways ] ) if ways else np.zeros(0, dtype=np.int64)
+	positions, found = elements.lookup(nodes)
+
+	# Valid ways: All nodes retrieved, and at least 3 distinct positions (4 coordinates once closed)
+	missing = np.bincount( np.repeat( np.arange(len(ways)), lengths ), weights=~found, minlength=len(ways) )
+	closed = np.zeros(len(ways), dtype=bool)
+	closed[lengths > 0] = ( nodes[ offsets[:-1][lengths > 0] ] == nodes[ offsets[1:][lengths > 0] - 1 ] )
+	valid = (missing == 0) & ( lengths - closed >= 3 )
+	for i in np.flatnonzero(~valid):
+		log('Polygon has invalid geometry: {}'.format( nodes[offsets[i]:offsets[i+1]].tolist() ))
+
+	# Keep the valid rings only
+	keep = np.repeat(valid, lengths)
+	_, lon, lat = elements.node_arrays()
+	coords = np.column_stack( ( lon[ positions[keep] ], lat[ positions[keep] ] ) )
+	ring_offsets = np.concatenate( ( [0], np.cumsum(lengths[valid]) ) )
+
+	ways_nodes = nodes[keep].tolist()
+	return _features_gdf( way_ids[valid], [ ways[i][1] for i in np.flatnonzero(valid) ],
+						 { 'nodes' : [ ways_nodes[start:end] for start, end in zip(ring_offsets[:-1], ring_offsets[1:]) ],
+						   'geometry' : _polygons(coords, ring_offsets) } )
+
+def nodes_to_gdf(elements, node_ids=None):
+	"""
+	Assemble the nodes of the container into a GeoDataFrame of points
+
+	Parameters
+	----------
+	elements : OSMElements
+		parsed elements
+	node_ids : iterable
+		nodes to assemble (default: all nodes)
+
+	Returns
+	----------
+	GeoDataFrame
+		points indexed by node identifier, with their tags
+	"""
+	ids, lon, lat = elements.node_arrays()
+	if (node_ids is None):
+		positions = np.arange(len(ids))
+	else:
+		positions, found = elements.lookup( np.fromiter(node_ids, dtype=np.int64) )
+		positions = positions[found]
+
+	return _features_gdf( ids[positions], [ elements.node_tags.get(id_, {}) for id_ in ids[positions].tolist() ],
+						 { 'geometry' : _points( np.column_stack( (lon[positions], lat[positions]) ) ) } )
+
+def null_data_gdf(data, polygon=None, north=None, south=None, east=None, west=None):
+	"""
+	One-row data frame with null information located at the centroid of the region of interest (avoid later Spatial-Join crash)
+
+	Parameters
+	----------
+	data : dict
+		columns of the row, as lists
+	polygon : shapely Polygon or MultiPolygon
+		region of interest
+	north, south, east, west : float
+		bounding box of the region of interest, if no polygon is given
+
+	Returns
+	----------
+	GeoDataFrame
+	"""
+	if (polygon is not None): # Polygon given
+		point = polygon.centroid
+	else: # Bounding box
+		point = Point( (east+west)/2. , (north+south)/2. )
+	data["geometry"] = [point]
+	return gpd.GeoDataFrame(data, crs={'init': 'epsg:4326'})
+
+def filter_features_gdfs(df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois, retain_invalid=False, polygon=None, north=None, south=None, east=None, west=None):
+	"""
+	Discard the invalid geometries of the buildings, building parts, land use and POIs GeoDataFrames
+	Empty building parts and POIs are replaced by a null-data point located at the centroid of the region of interest (as `create_building_parts_gdf` and `create_pois_gdf` do)
+
+	Parameters
+	----------
+	df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois : GeoDataFrame
+		assembled buildings, building parts, land use and POIs
+	retain_invalid : bool
+		if False discard any footprints with an invalid geometry
+	polygon : shapely Polygon or MultiPolygon
+		region of interest
+	north, south, east, west : float
+		bounding box of the region of interest, if no polygon is given
+
+	Returns
+	----------
+	[ GeoDataFrame, GeoDataFrame, GeoDataFrame, GeoDataFrame ]
+		buildings, building parts, land use and POIs
+	"""
+	if not retain_invalid:
+		df_osm_built = df_osm_built[df_osm_built['geometry'].is_valid]
+		df_osm_lu = df_osm_lu[df_osm_lu['geometry'].is_valid]
+		try:
+			df_osm_building_parts = df_osm_building_parts[df_osm_building_parts['geometry'].is_valid]
+		except: # Empty data frame
+			df_osm_building_parts = null_data_gdf( {"osm_id":[0], "building:part":["yes"], "height":[""]}, polygon, north, south, east, west )
+		try:
+			df_osm_pois = df_osm_pois[df_osm_pois['geometry'].is_valid]
+		except: # Empty data frame
+			df_osm_pois = null_data_gdf( {"osm_id":[0]}, polygon, north, south, east, west )
+	return df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois
@@ -0,0 +1,328 @@
+###################################################################################################
+# Repository: https://github.com/lgervasoni/urbansprawl
+# MIT License
+###################################################################################################
+
+import re
+import time
+import threading
+import requests
+from contextlib import contextmanager
+from osmnx import log
+import logging as lg
+
+from .. import settings
+
+# Pool of Overpass API endpoints (e.g. internal mirrors) the requests are balanced over
+# The slots of each endpoint are read from its /api/status page, its latency and error rate tracked from the requests sent
+# Each request is routed to the least loaded healthy endpoint. Endpoints failing to respond are paused, their requests sent to another endpoint
+
+# Status page lines
+_status_rate_limit = re.compile(r'Rate limit:\s*(\d+)')
+_status_slots_available = re.compile(r'(\d+)\s+slots? available now')
+_status_slot_after = re.compile(r'Slot available after:.*?in\s+(-?\d+)\s+seconds')
+# Smoothing factor of the latency and error rate moving averages
+_ewma_alpha = 0.3
+
+#######################################################################
+### Endpoints
+#######################################################################
+
+class OverpassEndpoint():
+	"""
+	Health of an Overpass API endpoint: Running requests, slots, latency and error rate
+
+	Parameters
+	----------
+	url : string
+		interpreter URL, e.g. 'http://overpass-api.de/api/interpreter'
+	"""
+	def __init__(self, url):
+		self.url = url
+		self.status_url = url.rsplit('/', 1)[0] + '/status'
+		# Requests currently sent to the endpoint
+		self.active = 0
+		# Concurrent requests allowed by the endpoint (None: unlimited or unknown), and time before which no slot is free
+		self.slots = None
+		self.busy_until = 0.
+		self.status_time = None
+		# Time before which the endpoint is considered down
+		self.down_until = 0.
+		# Exponentially weighted moving averages of the response latency (seconds) and of the failures
+		self.latency = None
+		self.error_rate = 0.
+
+	def check_status(self, timeout=10):
+		"""
+		Read the slots of the endpoint from its status page
+		The endpoint is paused (`settings.overpass_endpoint_cooldown`) if the status can not be retrieved
+		"""
+		self.status_time = time.time()
+		try:
+			response = requests.get(self.status_url, timeout=timeout)
+			response.raise_for_status()
+		except Exception as e:
+			log('Overpass endpoint {} status unavailable: {}'.format(self.url, e), level=lg.WARNING)
+			self.record_failure()
+			return
+		# Responding endpoint: Healthy again
+		self.down_until = 0.
+		status = response.text
+		rate_limit = _status_rate_limit.search(status)
+		# Rate limit 0: No limit of concurrent requests
+		self.slots = ( int( rate_limit.group(1) ) or None ) if rate_limit else None
+		slots_available = _status_slots_available.search(status)
+		waits = [ int(seconds) for seconds in _status_slot_after.findall(status) ]
+		if (self.slots is not None) and (not slots_available) and (waits):
+			self.busy_until = max( self.busy_until, self.status_time + max( 0, min(waits) ) )
+
+	def is_available(self, now):
+		"""
+		Whether a request can be sent to the endpoint now
+		"""
+		if (now < self.down_until) or (now < self.busy_until):
+			return False
+		return (self.slots is None) or (self.active < self.slots)
+
+	def load(self):
+		"""
+		Expected waiting time of a new request: Running requests, weighted by latency and error rate
+		Endpoints without latency measure yet are favoured, to be measured
+		"""
+		latency = 0.1 if self.latency is None else self.latency
+		return (self.active + 1) * latency * (1. + 4. * self.error_rate)
+
+	def record_success(self, latency):
+		"""
+		Update the latency and error rate after a response
+		"""
+		self.latency = latency if self.latency is None else (1. - _ewma_alpha) * self.latency + _ewma_alpha * latency
+		self.error_rate = (1. - _ewma_alpha) * self.error_rate
+		self.down_until = 0.
+
+	def record_failure(self):
+		"""
+		Update the error rate after a failure, and pause the endpoint
+		"""
+		self.error_rate = (1. - _ewma_alpha) * self.error_rate + _ewma_alpha
+		self.down_until = time.time() + settings.overpass_endpoint_cooldown
+
+class EndpointPool():
+	"""
+	Thread-safe pool of Overpass API endpoints
+
+	Parameters
+	----------
+	urls : list
+		interpreter URL of each endpoint
+	"""
+	def __init__(self, urls):
+		self.urls = list(urls)
+		self.endpoints = [ OverpassEndpoint(url) for url in self.urls ]
+		self.condition = threading.Condition()
+
+	def _refresh_status(self):
+		"""
+		Check the status of the endpoints not checked for `settings.overpass_status_interval` seconds
+		"""
+		now = time.time()
+		with self.condition:
+			stale = [ endpoint for endpoint in self.endpoints if (endpoint.status_time is None) or (now - endpoint.status_time > settings.overpass_status_interval) ]
+			# Mark them as checked: A single thread checks each endpoint
+			for endpoint in stale:
+				endpoint.status_time = now
+		for endpoint in stale:
+			endpoint.check_status()
+
+	def acquire(self, exclude=()):
+		"""
+		Select the least loaded available endpoint, waiting until one is available
+		Endpoints in `exclude` (e.g. failed for the current request) are only selected if no other endpoint is healthy
+
+		Parameters
+		----------
+		exclude : list
+			endpoints to avoid
+
+		Returns
+		----------
+		OverpassEndpoint
+			selected endpoint, to be released
+		"""
+		while True:
+			self._refresh_status()
+			with self.condition:
+				now = time.time()
+				candidates = [ endpoint for endpoint in self.endpoints if endpoint.is_available(now) ]
+				preferred = [ endpoint for endpoint in candidates if endpoint not in exclude ]
+				if (preferred or candidates):
+					endpoint = min( preferred or candidates, key=lambda endpoint: endpoint.load() )
+					endpoint.active += 1
+					return endpoint
+				# Wait for a released endpoint, or for a paused endpoint to recover
+				resume = min( max(endpoint.down_until, endpoint.busy_until) for endpoint in self.endpoints )
+				self.condition.wait( timeout=min( max(resume - now, 0.1), settings.overpass_status_interval ) )
+
+	def release(self, endpoint, latency=None, failed=False):
+		"""
+		Release an endpoint, recording the outcome of its request
+
+		Parameters
+		----------
+		endpoint : OverpassEndpoint
+			endpoint selected by `acquire`
+		latency : float
+			response latency, in seconds (None: not recorded)
+		failed : bool
+			whether the endpoint failed to respond
+		"""
+		with self.condition:
+			endpoint.active -= 1
+			if (failed):
+				endpoint.record_failure()
+			elif (latency is not None):
+				endpoint.record_success(latency)
+			self.condition.notify_all()
+
+	def post(self, data, timeout=180, stream=False):
+		"""
+		Send a request to the least loaded available endpoint, failing over to another endpoint if it does not respond
+		Busy endpoints (HTTP 429 or 504 status) have their status checked again before being selected
+
+		Parameters
+		----------
+		data : dict
+			key-value pairs of parameters to post to the API
+		timeout : int
+			the timeout interval for the requests library
+		stream : bool
+			whether to stream the response body
+
+		Returns
+		----------
+		[ requests.Response, OverpassEndpoint ]
+			response, and the endpoint to release once the response is consumed
+		"""
+		failed = []
+		while True:
+			endpoint = self.acquire(exclude=failed)
+			start_time = time.time()
+			try:
+				response = requests.post(endpoint.url, data=data, timeout=timeout, stream=stream)
+			except requests.exceptions.Timeout:
+				# Expensive query: Reported to the caller, which may split it
+				self.release(endpoint, latency=time.time()-start_time)
+				raise
+			except requests.exceptions.RequestException as e:
+				self.release(endpoint, failed=True)
+				failed.append(endpoint)
+				log('Overpass endpoint {} failed ({}). Pausing it'.format(endpoint.url, e), level=lg.WARNING)
+				if ( len(failed) >= len(self.endpoints) ):
+					raise
+				continue
+
+			if (response.status_code in [429, 504]):
+				response.close()
+				log('Server at {} returned status code {}. Re-trying request'.format(endpoint.url, response.status_code), level=lg.WARNING)
+				# Check its slots again, waiting at least a few seconds
+				with self.condition:
+					endpoint.status_time = None
+					endpoint.busy_until = time.time() + 5
+				self.release(endpoint)
+				continue
+			if (response.status_code >= 500):
+				response.close()
+				self.release(endpoint, failed=True)
+				failed.append(endpoint)
+				log('Server at {} returned status code {}. Pausing it'.format(endpoint.url, response.status_code), level=lg.WARNING)
+				if ( len(failed) >= len(self.endpoints) ):
+					response.raise_for_status()
+				continue
+			return response, endpoint
+
+# Pool shared by all the Overpass requests of the process
+_endpoint_pool = None
+_endpoint_pool_lock = threading.Lock()
+# Requests in flight, shared by all the Overpass requests of the process (layers, tiles, dates retrieved concurrently)
+_request_slots = None
+_request_slots_size = None
+
+def get_endpoint_urls():
+	"""
+	Get the configured Overpass API endpoints (`settings.overpass_endpoints`, or `settings.overpass_endpoint`)
+	"""
+	if (settings.overpass_endpoints):
+		return list(settings.overpass_endpoints)
+	return [ settings.overpass_endpoint ]
+
+def get_endpoint_pool():
+	"""
+	Get the endpoint pool shared by all the Overpass requests, created from the current settings
+
+	Returns
+	----------
+	EndpointPool
+		shared endpoint pool
+	"""
+	global _endpoint_pool
+	with _endpoint_pool_lock:
+		if (_endpoint_pool is None) or (_endpoint_pool.urls != get_endpoint_urls()):
+			_endpoint_pool = EndpointPool( get_endpoint_urls() )
+		return _endpoint_pool
+
+def get_request_slots():
+	"""
+	Get the semaphore bounding the Overpass requests in flight (`settings.overpass_max_workers`), shared by all the requests of the process
+	Nested thread pools (e.g. layers retrieved concurrently, each one subdivided into tiles) can not exceed it
+
+	Returns
+	----------
+	threading.BoundedSemaphore
+		shared request slots
+	"""
+	global _request_slots, _request_slots_size
+	with _endpoint_pool_lock:
+		size = max( 1, settings.overpass_max_workers )
+		if (_request_slots is None) or (_request_slots_size != size):
+			_request_slots, _request_slots_size = threading.BoundedSemaphore(size), size
+		return _request_slots
+
+#######################################################################
+### Requests
+#######################################################################
+
+@contextmanager
+def overpass_post(data, timeout=180, stream=False):
+	"""
+	Send a request to the Overpass API through the shared endpoint pool, within the shared bound of requests in flight (see `get_request_slots`)
+	The endpoint and request slot are released, and the response closed, when leaving the context
+
+	Parameters
+	----------
+	data : dict
+		key-value pairs of parameters to post to the API
+	timeout : int
+		the timeout interval for the requests library
+	stream : bool
+		whether to stream the response body
+
+	Returns
+	----------
+	requests.Response
+		response, after a successful status
+	"""
+	pool = get_endpoint_pool()
+	slots = get_request_slots()
+	slots.acquire()
+	try:
+		response, endpoint = pool.post(data, timeout=timeout, stream=stream)
+		start_time = time.time()
+		try:
+			response.raise_for_status()
+			yield response
+		finally:
+			response.close()
+			latency = response.elapsed.total_seconds() + (time.time() - start_time)
+			pool.release(endpoint, latency=latency)
+	finally:
+		slots.release()
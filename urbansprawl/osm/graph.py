@@ -0,0 +1,548 @@
+###################################################################################################
+# Repository: https://github.com/lgervasoni/urbansprawl
+# MIT License
+###################################################################################################
+
+import osmnx as ox
+import os
+import json
+import shutil
+import numpy as np
+import geopandas as gpd
+import networkx as nx
+from scipy import sparse
+from scipy import spatial
+from scipy.sparse import csgraph
+from shapely.prepared import prep
+from shapely.geometry import LineString
+from osmnx import log
+
+from .elements import OSMElements, _points
+from .tiles import _intersects_xy
+
+# Mean earth radius in meters (as used by osmnx great circle distances)
+_earth_radius = 6371009
+# Values of the oneway tag for one-directional ways ('-1': opposite direction of the way nodes)
+_oneway_values = {'yes', 'true', '1', '-1'}
+# Edge labels (OSM tags), stored as codes into the array of their distinct values ('': missing)
+_edge_labels = ['highway', 'name']
+# Binary storage: Arrays stored (one .npy file each), and format version of the metadata header
+_stored_arrays = ['indptr', 'indices', 'lengths', 'x', 'y', 'osmid', 'edge_osmid', 'edge_oneway', 'edge_highway', 'highway_values', 'edge_name', 'name_values', 'geometry_indptr', 'geometry_x', 'geometry_y']
+_format_version = 2
+
+class CSRGraph():
+	"""
+	Compact directed street network graph: Compressed sparse row (CSR) adjacency arrays, edge lengths, and node coordinates
+	Nodes are numbered 0..n-1 following their OSM identifiers (sorted ascending). Parallel edges are kept
+
+	Attributes
+	----------
+	indptr : np.array
+		outgoing edges of node i are indices[ indptr[i]:indptr[i+1] ]
+	indices : np.array
+		target node of each edge
+	lengths : np.array
+		length of each edge, in meters
+	x, y : np.array
+		node coordinates (longitude, latitude unless projected)
+	osmid : np.array
+		OSM identifier of each node (sorted)
+	edge_osmid : np.array
+		OSM identifier of the way of each edge
+	edge_oneway : np.array
+		True for the edges of oneway streets
+	edge_highway, edge_name : np.array
+		highway and name tags of each edge, as codes into highway_values and name_values
+	geometry_indptr : np.array
+		coordinates of edge i are geometry_x, geometry_y[ geometry_indptr[i]:geometry_indptr[i+1] ] (none for straight edges)
+	crs : dict
+		coordinate reference system of the node coordinates
+	name : string
+		name of the graph
+	"""
+	def __init__(self, indptr, indices, lengths, x, y, osmid, edge_osmid=None, crs={'init':'epsg:4326'}, name='unnamed', edge_oneway=None, edge_labels=None, geometry=None):
+		self.indptr = np.asarray(indptr, dtype=np.int64)
+		self.indices = np.asarray(indices, dtype=np.int32)
+		self.lengths = np.asarray(lengths, dtype=np.float32)
+		self.x = np.asarray(x, dtype=np.float64)
+		self.y = np.asarray(y, dtype=np.float64)
+		self.osmid = np.asarray(osmid, dtype=np.int64)
+		self.edge_osmid = np.asarray(edge_osmid, dtype=np.int64) if edge_osmid is not None else np.full(len(self.indices), -1, dtype=np.int64)
+		self.edge_oneway = np.asarray(edge_oneway, dtype=bool) if edge_oneway is not None else np.zeros(len(self.indices), dtype=bool)
+		# Edge labels: { label : (codes, values) }
+		for label in _edge_labels:
+			codes, values = (edge_labels or {}).get( label, ( np.zeros(len(self.indices), dtype=np.int32), [''] ) )
+			setattr(self, 'edge_' + label, np.asarray(codes, dtype=np.int32))
+			setattr(self, label + '_values', np.asarray(values, dtype=np.str_))
+		# Edge geometries: (indptr, x, y)
+		geometry_indptr, geometry_x, geometry_y = geometry if geometry is not None else ( np.zeros(len(self.indices) + 1), [], [] )
+		self.geometry_indptr = np.asarray(geometry_indptr, dtype=np.int64)
+		self.geometry_x = np.asarray(geometry_x, dtype=np.float64)
+		self.geometry_y = np.asarray(geometry_y, dtype=np.float64)
+		self.crs = crs
+		self.name = name
+		self._tree, self._adjacency = None, None
+
+	def __repr__(self):
+		return 'CSRGraph(name={}, nodes={:,}, edges={:,}, {:,.1f} MB)'.format(self.name, self.number_of_nodes(), self.number_of_edges(), self.nbytes / 1024**2)
+
+	##########################
+	### Construction
+	##########################
+
+	@classmethod
+	def from_edges(cls, u, v, lengths, x, y, osmid, edge_osmid=None, crs={'init':'epsg:4326'}, name='unnamed', edge_oneway=None, edge_labels=None, geometry=None):
+		"""
+		Build the graph from edge arrays (source and target node positions), and optionally their attributes and geometries (see the constructor)
+		"""
+		u, v = np.asarray(u, dtype=np.int64), np.asarray(v, dtype=np.int64)
+		order = np.argsort(u, kind='stable')
+		indptr = np.concatenate( ( [0], np.cumsum( np.bincount(u, minlength=len(osmid)) ) ) )
+		# Edges in input order, then sorted by source node
+		G = cls([0, len(v)], v, lengths, x, y, osmid, edge_osmid, crs, name, edge_oneway, edge_labels, geometry)
+		return cls(indptr, G.indices[order], G.lengths[order], x, y, osmid, crs=crs, name=name, **G._edge_data(order))
+
+	@classmethod
+	def from_overpass(cls, response_jsons, network_type='all_private', simplify=True, name='unnamed'):
+		"""
+		Build the graph straight from Overpass API responses (or `pbf_net_download` output), without an intermediate networkx graph
+		Edges follow the way nodes, in both directions unless the way is oneway (all edges are bidirectional for walking networks)
+		If simplified, the graph nodes are the way ends and the nodes shared by several ways (or visited twice by a way): Edge lengths sum the segments in between, and edge geometries follow them
+		This is close to osmnx strict simplification. Ways cut by the border of the retrieved region end there: Retrieve a buffer around the region of interest, then truncate the graph (see `download_route_csr_graph`)
+
+		Parameters
+		----------
+		response_jsons : list
+			Overpass API responses
+		network_type : string
+			street network type, as defined by osmnx
+		simplify : bool
+			if True, keep intersections and dead-ends as graph nodes only
+		name : string
+			name of the graph
+
+		Returns
+		----------
+		CSRGraph
+			graph in latitude-longitude coordinates
+		"""
+		elements = OSMElements(keep_tags={'oneway', 'junction', 'highway', 'name'})
+		for response_json in response_jsons:
+			for element in response_json['elements']:
+				elements.add(element)
+		ids, lon, lat = elements.node_arrays()
+
+		way_ids = np.fromiter(elements.ways.keys(), dtype=np.int64)
+		ways = list( elements.ways.values() )
+		# Oneway direction of each way: 1 (forward), -1 (backward), 0 (both)
+		direction = np.zeros(len(ways), dtype=np.int8)
+		if (network_type != 'walk'):
+			for i, (_, tags) in enumerate(ways):
+				if ( tags.get('oneway') in _oneway_values ) or ( tags.get('junction') == 'roundabout' ):
+					direction[i] = -1 if tags.get('oneway') == '-1' else 1
+
+		# Way nodes retrieved, concatenated
+		lengths = np.array( [ len(nodes) for nodes, _ in ways ], dtype=np.int64 )
+		nodes = np.concatenate( [ np.frombuffer(nodes, dtype=np.int64) for nodes, _ in ways ] ) if ways else np.zeros(0, dtype=np.int64)
+		way_index = np.repeat( np.arange(len(ways)), lengths )
+		positions, found = elements.lookup(nodes)
+		positions, way_index = positions[found], way_index[found]
+
+		# Segments between consecutive nodes of a way, and cumulative distance along the concatenated ways
+		same_way = ( way_index[1:] == way_index[:-1] )
+		segments = np.where( same_way, great_circle(lat[positions[:-1]], lon[positions[:-1]], lat[positions[1:]], lon[positions[1:]]), 0. )
+		distance = np.concatenate( ( [0.], np.cumsum(segments) ) )
+
+		# Graph nodes
+		first = np.concatenate( ( [True], ~same_way ) )
+		last = np.concatenate( ( ~same_way, [True] ) )
+		if (simplify):
+			is_vertex = first | last | ( np.bincount(positions, minlength=len(ids))[positions] >= 2 )
+		else:
+			is_vertex = np.ones(len(positions), dtype=bool)
+		vertex_positions, vertex_way, vertex_distance = positions[is_vertex], way_index[is_vertex], distance[is_vertex]
+
+		# Edges between consecutive graph nodes of a way
+		edge = ( vertex_way[1:] == vertex_way[:-1] )
+		u, v = vertex_positions[:-1][edge], vertex_positions[1:][edge]
+		edge_lengths = (vertex_distance[1:] - vertex_distance[:-1])[edge]
+		edge_way = vertex_way[:-1][edge]
+		forward, backward = ( direction[edge_way] >= 0 ), ( direction[edge_way] <= 0 )
+
+		# Edge geometries: Way nodes from one graph node to the next (straight edges hold none), reversed for backward edges
+		vertex_index = np.flatnonzero(is_vertex)
+		first_node, last_node = vertex_index[:-1][edge], vertex_index[1:][edge]
+		counts = np.where( last_node - first_node >= 2, last_node - first_node + 1, 0 )
+		start, counts = np.concatenate( (first_node[forward], last_node[backward]) ), np.concatenate( (counts[forward], counts[backward]) )
+		step = np.concatenate( ( np.ones(forward.sum(), dtype=np.int64), -np.ones(backward.sum(), dtype=np.int64) ) )
+		geometry_indptr = np.concatenate( ( [0], np.cumsum(counts) ) )
+		offsets = np.arange(geometry_indptr[-1]) - np.repeat(geometry_indptr[:-1], counts)
+		geometry_positions = positions[ np.repeat(start, counts) + np.repeat(step, counts) * offsets ]
+
+		# Edge attributes, following their way
+		edge_way = np.concatenate( (edge_way[forward], edge_way[backward]) )
+		edge_labels = {}
+		for label in _edge_labels:
+			codes, values = _encode_labels( [ tags.get(label) for _, tags in ways ] )
+			edge_labels[label] = ( codes[edge_way], values )
+
+		# Number the graph nodes following their identifiers
+		graph_nodes, inverse = np.unique( np.concatenate( (u, v) ), return_inverse=True )
+		u, v = inverse[:len(u)], inverse[len(u):]
+
+		G = cls.from_edges( np.concatenate( (u[forward], v[backward]) ), np.concatenate( (v[forward], u[backward]) ),
+						   np.concatenate( (edge_lengths[forward], edge_lengths[backward]) ),
+						   lon[graph_nodes], lat[graph_nodes], ids[graph_nodes], edge_osmid=way_ids[edge_way], name=name,
+						   edge_oneway=( direction[edge_way] != 0 ), edge_labels=edge_labels,
+						   geometry=( geometry_indptr, lon[geometry_positions], lat[geometry_positions] ) )
+		log('Created CSR graph from {:,} ways: {:,} nodes and {:,} edges ({:,.1f} MB)'.format(len(ways), G.number_of_nodes(), G.number_of_edges(), G.nbytes / 1024**2))
+		return G
+
+	@classmethod
+	def from_networkx(cls, G):
+		"""
+		Build the graph from a networkx (osmnx) graph. Node attributes other than coordinates are dropped, edges keep their length, osmid, oneway, highway, name and geometry
+		Labels holding several values (simplified edges) are kept as their string representation, as in GraphML files
+
+		Parameters
+		----------
+		G : networkx.MultiDiGraph
+			input graph, with 'x' and 'y' node attributes and 'length' edge attributes
+
+		Returns
+		----------
+		CSRGraph
+			compact graph
+		"""
+		osmid = np.array( sorted( G.nodes() ), dtype=np.int64 )
+		x = np.array( [ G.nodes[node]['x'] for node in osmid.tolist() ], dtype=np.float64 )
+		y = np.array( [ G.nodes[node]['y'] for node in osmid.tolist() ], dtype=np.float64 )
+
+		edges = list( G.edges(data=True) )
+		u = np.searchsorted( osmid, np.array( [ edge[0] for edge in edges ], dtype=np.int64 ) )
+		v = np.searchsorted( osmid, np.array( [ edge[1] for edge in edges ], dtype=np.int64 ) )
+		lengths = np.array( [ data.get('length', 0.) for _, _, data in edges ], dtype=np.float64 )
+		# Simplified edges may hold the identifiers of several ways: Keep the first one
+		edge_osmid = np.array( [ ( data['osmid'][0] if isinstance(data.get('osmid'), list) else data.get('osmid', -1) ) for _, _, data in edges ], dtype=np.int64 )
+		# Oneway values are strings in GraphML files loaded by osmnx
+		edge_oneway = np.array( [ data.get('oneway') in (True, 'True') for _, _, data in edges ], dtype=bool )
+		edge_labels = { label:_encode_labels( [ data.get(label) for _, _, data in edges ] ) for label in _edge_labels }
+		coords = [ np.asarray(data['geometry'].coords).reshape(-1, 2) if 'geometry' in data else np.zeros((0, 2)) for _, _, data in edges ]
+		geometry_indptr = np.concatenate( ( [0], np.cumsum( [ len(coord) for coord in coords ] ) ) )
+		coords = np.concatenate(coords) if coords else np.zeros((0, 2))
+
+		return cls.from_edges(u, v, lengths, x, y, osmid, edge_osmid, crs=G.graph.get('crs', {'init':'epsg:4326'}), name=G.graph.get('name', 'unnamed'),
+							  edge_oneway=edge_oneway, edge_labels=edge_labels, geometry=( geometry_indptr, coords[:,0], coords[:,1] ))
+
+	def to_networkx(self):
+		"""
+		Convert the graph to a networkx MultiDiGraph, as loaded by osmnx from GraphML files (node coordinates 'x' and 'y', edge 'length', 'osmid', 'oneway', 'highway', 'name' and 'geometry' if any)
+
+		Returns
+		----------
+		networkx.MultiDiGraph
+			graph
+		"""
+		G = nx.MultiDiGraph(name=self.name, crs=self.crs)
+		osmid = self.osmid.tolist()
+		G.add_nodes_from( ( node, {'osmid':node, 'x':x, 'y':y} ) for node, x, y in zip(osmid, self.x.tolist(), self.y.tolist()) )
+		u, v = self.edges()
+		edges = [ {'length':length, 'osmid':way, 'oneway':oneway} for length, way, oneway in zip(self.lengths.tolist(), self.edge_osmid.tolist(), self.edge_oneway.tolist()) ]
+		# Labels and geometries, if available
+		for label in _edge_labels:
+			for data, value in zip(edges, getattr(self, label + '_values')[ getattr(self, 'edge_' + label) ].tolist()):
+				if (value):
+					data[label] = value
+		coords = np.column_stack( (self.geometry_x, self.geometry_y) )
+		for edge in np.flatnonzero( np.diff(self.geometry_indptr) ).tolist():
+			edges[edge]['geometry'] = LineString( coords[ self.geometry_indptr[edge]:self.geometry_indptr[edge+1] ] )
+		G.add_edges_from( ( osmid[i], osmid[j], data ) for i, j, data in zip(u.tolist(), v.tolist(), edges) )
+		return G
+
+	def _edge_data(self, selection):
+		"""
+		Get the attributes and geometries of selected edges, as keyword arguments of the constructor
+
+		Parameters
+		----------
+		selection : np.array
+			positions of the selected edges
+
+		Returns
+		----------
+		dict
+			edge_osmid, edge_oneway, edge_labels and geometry
+		"""
+		return { 'edge_osmid':self.edge_osmid[selection], 'edge_oneway':self.edge_oneway[selection],
+				 'edge_labels':{ label:( getattr(self, 'edge_' + label)[selection], getattr(self, label + '_values') ) for label in _edge_labels },
+				 'geometry':_take_ranges(self.geometry_indptr, selection, self.geometry_x, self.geometry_y) }
+
+	##########################
+	### Binary storage
+	##########################
+
+	def save(self, folder):
+		"""
+		Store the graph as a folder of NumPy arrays (.npy) plus a metadata header (crs, name), to be loaded through memory mapping
+		The folder is written aside, then moved into place: Concurrent readers never see a partial graph
+
+		Parameters
+		----------
+		folder : string
+			graph folder
+
+		Returns
+		----------
+
+		"""
+		temporary_folder = '{}.{}.tmp'.format(folder.rstrip('/'), os.getpid())
+		os.makedirs(temporary_folder, exist_ok=True)
+		for array in _stored_arrays:
+			np.save( os.path.join(temporary_folder, array + '.npy'), getattr(self, array) )
+		with open( os.path.join(temporary_folder, 'meta.json'), 'w' ) as f:
+			json.dump( { 'format_version':_format_version, 'name':self.name, 'crs':self.crs if isinstance(self.crs, (dict, str)) else str(self.crs),
+						 'number_of_nodes':self.number_of_nodes(), 'number_of_edges':self.number_of_edges() }, f )
+		if ( os.path.isdir(folder) ):
+			shutil.rmtree(folder)
+		os.replace(temporary_folder, folder)
+
+	@classmethod
+	def load(cls, folder, mmap_mode='r'):
+		"""
+		Load a graph stored with `save`. Arrays are memory mapped (read-only by default): Loading is immediate, and processes opening the same graph share its pages
+
+		Parameters
+		----------
+		folder : string
+			graph folder
+		mmap_mode : string
+			numpy memory mapping mode (None: arrays are read into memory)
+
+		Returns
+		----------
+		CSRGraph
+			stored graph
+		"""
+		with open( os.path.join(folder, 'meta.json') ) as f:
+			meta = json.load(f)
+		if ( meta.get('format_version') != _format_version ):
+			raise ValueError('Unsupported graph format version: {}'.format( meta.get('format_version') ))
+		arrays = { array:np.load( os.path.join(folder, array + '.npy'), mmap_mode=mmap_mode ) for array in _stored_arrays }
+		G = cls.__new__(cls)
+		for array, values in arrays.items():
+			setattr(G, array, values)
+		G.crs, G.name, G._tree, G._adjacency = meta['crs'], meta['name'], None, None
+		return G
+
+	##########################
+	### Properties
+	##########################
+
+	def number_of_nodes(self):
+		return len(self.osmid)
+
+	def number_of_edges(self):
+		return len(self.indices)
+
+	@property
+	def nbytes(self):
+		""" Memory used by the graph arrays, in bytes """
+		return sum( getattr(self, array).nbytes for array in _stored_arrays )
+
+	def edges(self):
+		"""
+		Source and target node positions of each edge
+
+		Returns
+		----------
+		[ np.array, np.array ]
+			source and target node positions
+		"""
+		return np.repeat( np.arange(self.number_of_nodes()), np.diff(self.indptr) ), self.indices
+
+	def node_index(self, osmid):
+		"""
+		Get the position of nodes given their OSM identifiers. Raises KeyError if a node does not belong to the graph
+
+		Parameters
+		----------
+		osmid : int or array-like
+			OSM identifiers
+
+		Returns
+		----------
+		int or np.array
+			node positions
+		"""
+		ids = np.asarray(osmid, dtype=np.int64)
+		positions = np.minimum( np.searchsorted(self.osmid, ids), max(self.number_of_nodes()-1, 0) )
+		if not ( self.number_of_nodes() and np.all( self.osmid[positions] == ids ) ):
+			raise KeyError(osmid)
+		return positions
+
+	##########################
+	### Operations
+	##########################
+
+	def subgraph(self, mask):
+		"""
+		Get the subgraph induced by the nodes of a boolean mask
+
+		Parameters
+		----------
+		mask : np.array
+			nodes to keep
+
+		Returns
+		----------
+		CSRGraph
+			subgraph
+		"""
+		mask = np.asarray(mask, dtype=bool)
+		new_position = np.cumsum(mask) - 1
+		u, v = self.edges()
+		keep = np.flatnonzero( mask[u] & mask[v] )
+		return CSRGraph.from_edges( new_position[ u[keep] ], new_position[ v[keep] ], self.lengths[keep],
+								   self.x[mask], self.y[mask], self.osmid[mask], crs=self.crs, name=self.name, **self._edge_data(keep) )
+
+	def truncate(self, polygon):
+		"""
+		Keep the nodes within a polygon (in the coordinates of the graph)
+
+		Parameters
+		----------
+		polygon : shapely Polygon or MultiPolygon
+			region of interest
+
+		Returns
+		----------
+		CSRGraph
+			truncated graph
+		"""
+		return self.subgraph( _intersects_xy(polygon, prep(polygon), self.x, self.y) )
+
+	def largest_component(self):
+		"""
+		Keep the largest weakly connected component of the graph
+		"""
+		if ( self.number_of_nodes() == 0 ):
+			return self
+		_, labels = csgraph.connected_components( self.to_scipy(), directed=True, connection='weak' )
+		return self.subgraph( labels == np.argmax( np.bincount(labels) ) )
+
+	def project(self, to_crs=None):
+		"""
+		Project the node coordinates and edge geometries (to the UTM zone of the graph centroid if no crs is given). Edge lengths are kept
+
+		Parameters
+		----------
+		to_crs : dict
+			target coordinate reference system
+
+		Returns
+		----------
+		CSRGraph
+			projected graph
+		"""
+		# Nodes, then edge geometry coordinates
+		gdf_points = gpd.GeoDataFrame( geometry=list( _points( np.column_stack( ( np.concatenate( (self.x, self.geometry_x) ), np.concatenate( (self.y, self.geometry_y) ) ) ) ) ), crs=self.crs )
+		gdf_points = ox.project_gdf(gdf_points, to_crs=to_crs)
+		x, y, n = gdf_points.geometry.x.values, gdf_points.geometry.y.values, self.number_of_nodes()
+		edge_data = self._edge_data( np.arange(self.number_of_edges()) )
+		edge_data['geometry'] = ( self.geometry_indptr, x[n:], y[n:] )
+		G = CSRGraph(self.indptr, self.indices, self.lengths, x[:n], y[:n], self.osmid, crs=gdf_points.crs, name=self.name, **edge_data)
+		return G
+
+	def to_scipy(self):
+		"""
+		Get the sparse adjacency matrix of edge lengths. Parallel edges are reduced to the shortest one
+		The matrix is built once, then kept along with the graph (e.g. for successive shortest paths computations)
+
+		Returns
+		----------
+		scipy.sparse.csr_matrix
+			adjacency matrix
+		"""
+		if (self._adjacency is None):
+			u, v = self.edges()
+			# Shortest edge first for each (u, v): Duplicated entries would be summed
+			order = np.lexsort( (self.lengths, v, u) )
+			u, v, lengths = u[order], v[order], self.lengths[order]
+			first = np.concatenate( ( [True], (u[1:] != u[:-1]) | (v[1:] != v[:-1]) ) )
+			n = self.number_of_nodes()
+			self._adjacency = sparse.csr_matrix( ( lengths[first], (u[first], v[first]) ), shape=(n, n) )
+		return self._adjacency
+
+	def shortest_path_lengths(self, source, cutoff=np.inf):
+		"""
+		Shortest path lengths from a source node to all nodes, using edge lengths as weights
+
+		Parameters
+		----------
+		source : int
+			position of the source node
+		cutoff : float
+			maximum path length (farther nodes are set to infinity)
+
+		Returns
+		----------
+		np.array
+			path length to each node
+		"""
+		return csgraph.dijkstra( self.to_scipy(), directed=True, indices=source, limit=cutoff )
+
+	def nearest_nodes(self, x, y, return_dist=False):
+		"""
+		Get the positions of the nodes closest to input coordinates (in the coordinates of the graph)
+
+		Parameters
+		----------
+		x : float or array-like
+			x coordinates
+		y : float or array-like
+			y coordinates
+		return_dist : bool
+			optionally also return the distances to the nearest nodes
+
+		Returns
+		----------
+		np.array or tuple
+			node positions, or tuple (node positions, distances)
+		"""
+		if (self._tree is None):
+			self._tree = spatial.cKDTree( np.column_stack( (self.x, self.y) ) )
+		distances, positions = self._tree.query( np.column_stack( ( np.atleast_1d(x), np.atleast_1d(y) ) ) )
+		if (return_dist):
+			return positions, distances
+		return positions
+
+def _encode_labels(values):
+	"""
+	Encode labels (None: missing) as codes into the array of their distinct values
+	"""
+	values = np.array( [ '' if value is None else str(value) for value in values ] + [''], dtype=np.str_ )
+	labels, codes = np.unique(values, return_inverse=True)
+	return codes[:-1].astype(np.int32), labels
+
+def _take_ranges(indptr, selection, *arrays):
+	"""
+	Select the ranges arrays[ indptr[i]:indptr[i+1] ] of positions i in `selection`, concatenated
+
+	Returns
+	----------
+	tuple
+		indptr of the selected ranges, followed by the selected values of each input array
+	"""
+	starts, counts = indptr[:-1][selection], np.diff(indptr)[selection]
+	new_indptr = np.concatenate( ( [0], np.cumsum(counts) ) ).astype(np.int64)
+	index = np.repeat(starts - new_indptr[:-1], counts) + np.arange(new_indptr[-1])
+	return (new_indptr,) + tuple( np.asarray(array)[index] for array in arrays )
+
+def great_circle(lat1, lng1, lat2, lng2, earth_radius=_earth_radius):
+	"""
+	Vectorized great circle distance (haversine) between pairs of coordinates, in meters
+	"""
+	phi1, phi2 = np.deg2rad(lat1), np.deg2rad(lat2)
+	d_phi, d_theta = phi2 - phi1, np.deg2rad(lng2) - np.deg2rad(lng1)
+	h = np.sin(d_phi / 2)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(d_theta / 2)**2
+	return 2 * earth_radius * np.arcsin( np.sqrt( np.clip(h, 0, 1) ) )
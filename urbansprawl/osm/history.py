@@ -0,0 +1,280 @@
+###################################################################################################
+# Repository: https://github.com/lgervasoni/urbansprawl
+# MIT License
+###################################################################################################
+
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+from concurrent.futures import ThreadPoolExecutor
+from osmnx import log
+import logging as lg
+
+from .overpass import get_region_of_interest, create_osm_features_gdfs
+from .core import process_osm_features
+from .elements import null_data_gdf
+from .tags import features_tags
+from .utils import get_history_filenames, geo_driver
+from .. import settings
+
+# Time series of OpenStreetMap data: The features of a region are retrieved at several dates (attic queries, sent in parallel)
+# Each version of a feature is stored once, with its validity interval: From the first retrieved date it was found at, to the first later retrieved date it was not
+# Overpass responses carry no version numbers (metadata is not queried): A version is identified by the digest of its retained tags and geometry
+# The layers of a date are materialized on demand from the stored versions
+
+# Layers, in the order returned by `create_osm_features_gdfs`
+_layers = ["buildings", "building_parts", "landuse", "points"]
+# Versions columns
+_history_columns = ["osm_id", "version", "valid_from", "valid_to"]
+
+#######################################################################
+### Versions
+#######################################################################
+
+def _date_str(date):
+	"""
+	Date as stored in the history (ISO 8601 string, as used by the Overpass date setting)
+	"""
+	if hasattr(date, 'strftime'):
+		return date.strftime("%Y-%m-%dT%H:%M:%SZ")
+	return str(date)
+
+def _stored_date_str(value):
+	"""
+	Validity date read from a stored layer, as a date string: File drivers may read ISO 8601 strings as date-times
+	"""
+	if ( pd.isnull(value) ):
+		return np.nan
+	date = pd.Timestamp(value)
+	if (date.tzinfo is not None):
+		date = date.tz_convert('UTC')
+	return _date_str(date)
+
+def _empty_versions():
+	"""
+	Empty versions of a layer
+	"""
+	return gpd.GeoDataFrame( { column:np.array([], dtype=object) for column in _history_columns + ["geometry"] }, crs={'init': 'epsg:4326'} )
+
+def _snapshot_versions(df_osm):
+	"""
+	Versions of the features retrieved at a date: OSM identifier, version digest, retained tags and geometry
+	"""
+	# Null-data placeholders (empty layers) are not features
+	df_osm = df_osm[ df_osm.index > 0 ]
+	# Digest of the tags and geometry: Same columns and types whatever the date
+	tags = df_osm.reindex( columns=sorted(features_tags) ).astype(object)
+	tags = tags.where( tags.notnull(), '' )
+	digest_columns = tags.assign( geometry=df_osm.geometry.apply(lambda geometry: geometry.wkb_hex) )
+	versions = gpd.GeoDataFrame( df_osm[ [ column for column in df_osm.columns if column in features_tags ] + ["geometry"] ], crs=df_osm.crs )
+	versions.insert( 0, "osm_id", df_osm.index.values )
+	versions.insert( 1, "version", [ '{:016x}'.format(digest) for digest in pd.util.hash_pandas_object(digest_columns, index=False).values ] )
+	return versions.reset_index(drop=True)
+
+def _add_snapshot(versions, date, snapshot):
+	"""
+	Add the features retrieved at a date to the versions of a layer, retrieved at earlier dates
+	Versions not found anymore are closed, new versions are added
+	"""
+	keys = snapshot.osm_id.astype(str) + ':' + snapshot.version
+	versions_keys = versions.osm_id.astype(np.int64).astype(str) + ':' + versions.version
+	is_open = versions.valid_to.isnull()
+
+	# Closed versions: Modified or deleted features
+	versions["valid_to"] = versions.valid_to.where( ~ ( is_open & ~ versions_keys.isin(keys) ), date )
+	# New versions: Created or modified features
+	new_versions = snapshot[ ~ keys.isin( versions_keys[is_open] ) ].copy()
+	new_versions["valid_from"] = date
+	new_versions["valid_to"] = np.nan
+	return gpd.GeoDataFrame( pd.concat( [versions, new_versions], ignore_index=True, sort=False ), crs={'init': 'epsg:4326'} )
+
+def _retrieve_snapshot(date, polygon, north, south, east, west):
+	"""
+	Retrieve the versions of the features of each layer at a date
+	"""
+	start_time = time.time()
+	layers = create_osm_features_gdfs(date='[date:"'+date+'"]', polygon=polygon, north=north, south=south, east=east, west=west)
+	snapshot = [ _snapshot_versions(df_osm) for df_osm in layers ]
+	log("Retrieved OSM data at time-stamp " + date + ". Elapsed time (H:M:S): " + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
+	return snapshot
+
+#######################################################################
+### Storage
+#######################################################################
+
+def load_osm_history(city_ref):
+	"""
+	Load the stored history of input city
+
+	Parameters
+	----------
+	city_ref : str
+		Name of input city / region
+
+	Returns
+	----------
+	[ list, dict ]
+		retrieved dates (sorted), and versions of each layer ('buildings', 'building_parts', 'landuse', 'points')
+	"""
+	dates_file, layers_files = get_history_filenames(city_ref)
+	if not ( os.path.isfile(dates_file) ):
+		return [], { layer:_empty_versions() for layer in _layers }
+
+	with open(dates_file, 'r') as f:
+		dates = json.load(f)["dates"]
+	versions = {}
+	for layer in _layers:
+		if ( os.path.isfile(layers_files[layer]) ):
+			df_versions = gpd.read_file(layers_files[layer])
+			df_versions.fillna(value=np.nan, inplace=True)
+			df_versions.replace('', np.nan, inplace=True)
+			for column in ["valid_from", "valid_to"]:
+				df_versions[column] = df_versions[column].apply(_stored_date_str).astype(object)
+			versions[layer] = df_versions
+		else: # No feature at any date
+			versions[layer] = _empty_versions()
+	return dates, versions
+
+def store_osm_history(city_ref, dates, versions):
+	"""
+	Store the history of input city
+
+	Parameters
+	----------
+	city_ref : str
+		Name of input city / region
+	dates : list
+		retrieved dates
+	versions : dict
+		versions of each layer
+
+	Returns
+	----------
+
+	"""
+	dates_file, layers_files = get_history_filenames(city_ref)
+	if not ( os.path.isdir(settings.storage_folder) ):
+		os.makedirs(settings.storage_folder)
+	for layer in _layers:
+		if ( len(versions[layer]) ):
+			versions[layer].to_file(layers_files[layer], driver=geo_driver)
+		elif ( os.path.isfile(layers_files[layer]) ):
+			os.remove(layers_files[layer])
+	with open(dates_file, 'w') as f:
+		json.dump( {"dates":dates}, f )
+
+#######################################################################
+### Multi-date retrieval
+#######################################################################
+
+def get_osm_history(city_ref, dates, region_args={"polygon":None, "place":None, "which_result":1, "point":None, "address":None, "distance":None, "north":None, "south":None, "east":None, "west":None}, max_workers=None):
+	"""
+	Retrieve the OpenStreetMap features of input city at several dates, and store their distinct versions
+	The queries of the dates are sent in parallel. Dates already stored are not retrieved again
+	Storage grows with the number of changes between dates, rather than with the number of dates
+
+	Parameters
+	----------
+	city_ref : str
+		Name of input city / region
+	dates : list
+		datetime.datetime time-stamps to query the database at
+	region_args : dict
+		region of interest (see `get_processed_osm_data`)
+	max_workers : int
+		maximum number of dates retrieved at the same time (default: `settings.overpass_max_workers`)
+		the Overpass requests in flight of all dates remain bounded by `settings.overpass_max_workers`
+
+	Returns
+	----------
+	[ list, dict ]
+		retrieved dates (sorted), and versions of each layer ('buildings', 'building_parts', 'landuse', 'points')
+	"""
+	start_time = time.time()
+	stored_dates, versions = load_osm_history(city_ref)
+	dates = sorted( set( _date_str(date) for date in dates ) )
+	new_dates = [ date for date in dates if date not in stored_dates ]
+	if not (new_dates):
+		log("Found stored history for city " + str(city_ref))
+		return stored_dates, versions
+
+	if ( stored_dates ) and ( new_dates[0] < stored_dates[-1] ):
+		# Validity intervals are built in date order: Retrieve all dates again (responses are served from the Overpass cache)
+		log("Dates prior to the last stored date of city " + str(city_ref) + ": Its history is rebuilt", level=lg.WARNING)
+		new_dates = sorted( set(stored_dates) | set(new_dates) )
+		stored_dates, versions = [], { layer:_empty_versions() for layer in _layers }
+
+	polygon, place, which_result, point, address, distance, north, south, east, west = region_args.get("polygon"), region_args.get("place"), region_args.get("which_result"), region_args.get("point"), region_args.get("address"), region_args.get("distance"), region_args.get("north"), region_args.get("south"), region_args.get("east"), region_args.get("west")
+	polygon, north, south, east, west = get_region_of_interest(polygon=polygon, place=place, which_result=which_result, point=point, address=address, distance=distance, north=north, south=south, east=east, west=west)
+
+	if (max_workers is None):
+		max_workers = settings.overpass_max_workers
+	log("Requesting OSM data of city " + str(city_ref) + " at " + str(len(new_dates)) + " time-stamp(s) using " + str(max_workers) + " concurrent workers")
+
+	with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+		futures = [ executor.submit(_retrieve_snapshot, date, polygon, north, south, east, west) for date in new_dates ]
+		# Snapshots are added in date order, as soon as retrieved
+		for date, future in zip(new_dates, futures):
+			for layer, snapshot in zip(_layers, future.result()):
+				versions[layer] = _add_snapshot(versions[layer], date, snapshot)
+
+	stored_dates = stored_dates + new_dates
+	store_osm_history(city_ref, stored_dates, versions)
+
+	log("Done: OSM history of city " + str(city_ref) + ", " + str(len(stored_dates)) + " time-stamps and " + str( sum( len(versions[layer]) for layer in _layers ) ) + " feature versions. Elapsed time (H:M:S): " + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
+	return stored_dates, versions
+
+def materialize_osm_data(city_ref, date, kwargs={"default_height":3, "meters_per_level":3, "associate_landuses_m2":True, "mixed_building_first_floor_activity":True, "minimum_m2_building_area":9}):
+	"""
+	Materialize the buildings, building parts, and Points of Interest of input city at a date, from its stored history (see `get_osm_history`)
+	The latest retrieved date prior or equal to the input date is used. Features are then processed as `get_processed_osm_data` does
+
+	Parameters
+	----------
+	city_ref : str
+		Name of input city / region
+	date : datetime.datetime
+		time-stamp to materialize the data at
+	kwargs : dict
+		additional arguments to drive the process (see `get_processed_osm_data`)
+
+	Returns
+	----------
+	[ gpd.GeoDataFrame, gpd.GeoDataFrame, gpd.GeoDataFrame ]
+		returns the output geo dataframe containing all buildings, building parts, and points associated to a residential or activity land usage
+	"""
+	dates, versions = load_osm_history(city_ref)
+	date = _date_str(date)
+	retrieved = [ retrieved_date for retrieved_date in dates if retrieved_date <= date ]
+	if not (retrieved):
+		log("Error: No stored history of city " + str(city_ref) + " prior to " + date, level=lg.ERROR)
+		return None, None, None
+	date = retrieved[-1]
+	log("Materializing OSM data of city " + str(city_ref) + " at time-stamp " + date)
+
+	layers = []
+	for layer in _layers:
+		df_versions = versions[layer]
+		valid = ( df_versions.valid_from <= date ) & ( df_versions.valid_to.isnull() | (df_versions.valid_to > date) )
+		df_osm = df_versions[valid].drop( ["version", "valid_from", "valid_to"], axis=1 )
+		df_osm.index = df_osm.pop("osm_id").astype(np.int64).values
+		layers.append( gpd.GeoDataFrame(df_osm, crs=df_versions.crs) )
+	df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois = layers
+	if ( len(df_osm_built) == 0 ):
+		log("Error: No buildings of city " + str(city_ref) + " at time-stamp " + date, level=lg.ERROR)
+		return None, None, None
+
+	# Empty building parts and POIs: Null-data point, as retrieved. The region is given by the features of all layers
+	bounds = np.array( [ df_osm.total_bounds for df_osm in layers if len(df_osm) ] ).reshape(-1, 4)
+	region = box( *bounds[:,:2].min(axis=0), *bounds[:,2:].max(axis=0) )
+	if ( len(df_osm_building_parts) == 0 ):
+		df_osm_building_parts = null_data_gdf( {"osm_id":[0], "building:part":["yes"], "height":[""]}, region )
+	if ( len(df_osm_pois) == 0 ):
+		df_osm_pois = null_data_gdf( {"osm_id":[0]}, region )
+
+	df_osm_built, df_osm_building_parts, df_osm_pois, _, _ = process_osm_features(df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois, city_ref, kwargs)
+	return df_osm_built, df_osm_building_parts, df_osm_pois
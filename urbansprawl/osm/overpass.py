@@ -3,16 +3,164 @@
 # MIT License
 ###################################################################################################
 
-import time
+import os.path
+import numpy as np
 import geopandas as gpd
 from shapely.geometry import Point
 from shapely.geometry import Polygon
+from shapely.geometry import LineString
 from shapely.geometry import MultiPolygon
+from shapely.prepared import prep
 
 from osmnx import log
 import logging as lg
 import osmnx as ox
 
+from .cache import cached_overpass_request, merge_response_jsons
+from .elements import OSMElements, overpass_elements_request, merge_elements, ways_to_gdf, nodes_to_gdf, concat_gdfs, null_data_gdf, filter_features_gdfs
+from .scheduler import run_tile_queries
+from .tags import buildings_key, building_parts_key, landuse_key, pois_keys, features_tags
+from .pbf import pbf_net_download
+from .tiles import get_region_polygon, get_tiles_polygons, clip_elements
+from .graph import CSRGraph
+from .region import geocode_place, get_query_regions
+from .. import settings
+
+#######################################################################
+### Region sub-queries
+#######################################################################
+
+def _region_query_strs(query_template, date="", polygon=None, north=None, south=None, east=None, west=None,
+					   timeout=180, memory=None, max_query_area_size=50*1000*50*1000, **template_args):
+	"""
+	Build the Overpass query of each sub-region of the region of interest
+	Sub-queries are aligned to the fixed tile grid if `settings.overpass_tile_zoom` is set. Otherwise, bounding boxes
+	(subdivided if exceeding the max area size) or polygons (area of a geocoded place, or simplified polygon) are queried
+	Parameters
+	----------
+	query_template : string
+		query statements, with a `{region}` filter placeholder (plus any placeholder in `template_args`)
+	date : string
+		query the database at a certain timestamp
+	polygon : shapely Polygon or MultiPolygon
+		geographic shape to fetch the data within
+	north : float
+		northern latitude of bounding box
+	south : float
+		southern latitude of bounding box
+	east : float
+		eastern longitude of bounding box
+	west : float
+		western longitude of bounding box
+	timeout : int
+		the timeout interval for requests and to pass to API
+	memory : int
+		server memory allocation size for the query, in bytes. If none, server
+		will use its default allocation size
+	max_query_area_size : float
+		max area for any part of the geometry, in the units the geometry is in:
+		any polygon bigger will get divided up for multiple queries to API
+	template_args : dict
+		additional values of the query template placeholders
+	Returns
+	-------
+	list, shapely Polygon or MultiPolygon
+		query strings, and region the features are to be clipped to client-side (None: the queries select the region exactly)
+	"""
+	# check if we're querying by polygon or by bounding box based on which
+	# argument(s) where passed into this function
+	by_poly = polygon is not None
+	by_bbox = not (north is None or south is None or east is None or west is None)
+	if not (by_poly or by_bbox):
+		raise ValueError('You must pass a polygon or north, south, east, and west')
+	# align the sub-queries to the fixed tile grid (see `settings.overpass_tile_zoom`)
+	by_tiles = settings.overpass_tile_zoom is not None
+
+	# region the features are clipped to, client-side (None: the queries select the region exactly)
+	clip_region = None
+
+	# pass server memory allocation in bytes for the query to the API
+	# if None, pass nothing so the server will use its default allocation size
+	# otherwise, define the query's maxsize parameter value as whatever the
+	# caller passed in
+	if memory is None:
+		maxsize = ''
+	else:
+		maxsize = '[maxsize:{}]'.format(memory)
+
+	if by_tiles:
+		# tiles of the grid covering the region: their query strings (hence their
+		# cached responses) are shared by all the regions overlapping them
+		clip_region = get_region_polygon(polygon, north, south, east, west)
+		geometry = get_tiles_polygons(clip_region)
+
+	elif by_bbox:
+		# turn bbox into a polygon and project to local UTM
+		polygon = Polygon([(west, south), (east, south), (east, north), (west, north)])
+		geometry_proj, crs_proj = ox.project_geometry(polygon)
+
+		# subdivide it if it exceeds the max area size (in meters), then project
+		# back to lat-long
+		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
+		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
+
+	if by_tiles or by_bbox:
+		# represent each polygon rectangle as south,west,north,east and round lat-longs to 8
+		# decimal places (ie, within 1 mm) so URL strings aren't different
+		# due to float rounding issues (for consistent caching)
+		region_strs = [ '({south:.8f},{west:.8f},{north:.8f},{east:.8f})'.format(west=poly.bounds[0], south=poly.bounds[1], east=poly.bounds[2], north=poly.bounds[3]) for poly in geometry ]
+
+	else:
+		# project to utm, divide polygon up into sub-polygons if area exceeds a
+		# max size (in meters), project back to lat-long, then get the region filter
+		# of each sub-polygon (area of a geocoded place, or simplified polygon)
+		geometry_proj, crs_proj = ox.project_geometry(polygon)
+		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
+		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
+		region_strs = get_query_regions(polygon, geometry, date)
+		clip_region = polygon
+
+	# build the query of each region filter in the list
+	query_strs = [ date + '[out:json][timeout:{timeout}]{maxsize};'.format(timeout=timeout, maxsize=maxsize) + query_template.format(region=region_str, **template_args) for region_str in region_strs ]
+	return query_strs, clip_region
+
+def _run_elements_queries(query_strs, clip_region, description, timeout=180, consume=None):
+	"""
+	Send the sub-queries of a region in parallel, under the shared rate limit, each tile parsed into its own container
+	and processed as soon as it is retrieved, while the remaining tiles download
+	Parameters
+	----------
+	query_strs : list
+		query string of each sub-region (see `_region_query_strs`)
+	clip_region : shapely Polygon or MultiPolygon
+		region the features are clipped to, client-side (None: not clipped)
+	description : string
+		retrieved data, for logging purposes
+	timeout : int
+		the timeout interval for requests
+	consume : function
+		processes the (clipped) elements of each tile as soon as they are retrieved
+		(e.g. assembles a partial GeoDataFrame). If None, the elements of all tiles are merged
+	Returns
+	-------
+	OSMElements or list
+		parsed elements of all responses, or processed elements of each tile (if `consume` is given)
+	"""
+	def parse_tile(tile_elements):
+		""" Keep the features of the region of interest only, then process the tile elements """
+		if (clip_region is not None):
+			tile_elements = clip_elements(tile_elements, clip_region)
+		return tile_elements if (consume is None) else consume(tile_elements)
+
+	tiles_results = run_tile_queries(query_strs, lambda query_str: overpass_elements_request(data={'data':query_str}, elements=OSMElements(keep_tags=features_tags), timeout=timeout), description=description, consume=parse_tile, merge=merge_elements)
+	if (consume is not None):
+		return tiles_results
+
+	elements = OSMElements()
+	for tile_elements in tiles_results:
+		elements.merge(tile_elements)
+	return elements
+
 #######################################################################
 ### Buildings
 #######################################################################
@@ -81,7 +229,7 @@ def create_buildings_gdf_from_input(date="", polygon=None, place=None, which_res
 		if (which_result is None): which_result = 1
 		df_osm_built = buildings_from_place(date, place, which_result=which_result)
 		# Get encompassing polygon
-		poly_gdf = ox.gdf_from_place(place, which_result=which_result)
+		poly_gdf = geocode_place(place, which_result=which_result)
 		polygon = poly_gdf.geometry[0]
 	
 	elif ( all( [north,south,east,west] ) ): # Bounding box
@@ -98,8 +246,74 @@ def create_buildings_gdf_from_input(date="", polygon=None, place=None, which_res
 		return
 	return df_osm_built, polygon, north, south, east, west
 
+def get_region_of_interest(polygon=None, place=None, which_result=1, point=None, address=None, distance=None, north=None, south=None, east=None, west=None):
+	"""
+	Resolve the region of interest according to input data, without querying any OSM feature
+	Allows to send the different Overpass queries of a region at the same time
+	Point/address and distance inputs are resolved to the bounding box around the central point
+
+	Parameters
+	----------
+	polygon : shapely Polygon or MultiPolygon
+		geographic shape of the region of interest
+	place : string or dict
+		query string or structured query dict to geocode/download
+	which_result : int
+		result number to retrieve from geocode/download when using query string
+	point : tuple
+		the (lat, lon) central point of the region
+	address : string
+		the address to geocode and use as the central point of the region
+	distance : int
+		distance in meters around the central point
+	north : float
+		northern latitude of bounding box
+	south : float
+		southern latitude of bounding box
+	east : float
+		eastern longitude of bounding box
+	west : float
+		western longitude of bounding box
+
+	Returns
+	----------
+	[ shapely.Polygon, float, float, float, float ]
+		region of interest polygon, and region of interest bounding box
+	"""
+	if (not polygon is None):  # Polygon
+		log("Input type: Polygon")
+		# If input geo data frame, extract polygon shape
+		if ( type(polygon) is gpd.GeoDataFrame ):
+			assert( polygon.shape[0] == 1 )
+			polygon = polygon.geometry[0]
+
+	elif ( all( [point,distance] ) ):  # Point + distance
+		log("Input type: Point")
+		north, south, east, west = ox.bbox_from_point(point=point, distance=distance)
+
+	elif ( all( [address,distance] ) ):  # Address
+		log("Input type: Address")
+		# geocode the address string to a (lat, lon) point
+		point = ox.geocode(query=address)
+		north, south, east, west = ox.bbox_from_point(point=point, distance=distance)
+
+	elif (place):  # Place
+		log("Input type: Place")
+		if (which_result is None): which_result = 1
+		# Get encompassing polygon
+		poly_gdf = geocode_place(place, which_result=which_result)
+		polygon = poly_gdf.geometry[0]
+
+	elif ( all( [north,south,east,west] ) ): # Bounding box
+		log("Input type: Bounding box")
+		polygon = Polygon( [(east,north), (west,north), (west,south), (east,south)] )
+	else:
+		log("Error: Must provide at least one input")
+		return
+	return polygon, north, south, east, west
+
 def osm_bldg_download(date="", polygon=None, north=None, south=None, east=None, west=None,
-					  timeout=180, memory=None, max_query_area_size=50*1000*50*1000):
+					  timeout=180, memory=None, max_query_area_size=50*1000*50*1000, consume=None):
 	"""
 	Download OpenStreetMap building footprint data.
 	Parameters
@@ -126,85 +340,19 @@ def osm_bldg_download(date="", polygon=None, north=None, south=None, east=None,
 		any polygon bigger will get divided up for multiple queries to API
 		(default is 50,000 * 50,000 units (ie, 50km x 50km in area, if units are
 		meters))
+	consume : function
+		processes the (clipped) elements of each tile as soon as they are retrieved
+		(e.g. assembles a partial GeoDataFrame). If None, the elements of all tiles are merged
 	Returns
 	-------
-	list
-		list of response_json dicts
+	OSMElements or list
+		parsed elements of all responses, or processed elements of each tile (if `consume` is given)
 	"""
 
-	# check if we're querying by polygon or by bounding box based on which
-	# argument(s) where passed into this function
-	by_poly = polygon is not None
-	by_bbox = not (north is None or south is None or east is None or west is None)
-	if not (by_poly or by_bbox):
-		raise ValueError('You must pass a polygon or north, south, east, and west')
-
-	response_jsons = []
-
-	# pass server memory allocation in bytes for the query to the API
-	# if None, pass nothing so the server will use its default allocation size
-	# otherwise, define the query's maxsize parameter value as whatever the
-	# caller passed in
-	if memory is None:
-		maxsize = ''
-	else:
-		maxsize = '[maxsize:{}]'.format(memory)
-
-	# define the query to send the API
-	if by_bbox:
-		# turn bbox into a polygon and project to local UTM
-		polygon = Polygon([(west, south), (east, south), (east, north), (west, north)])
-		geometry_proj, crs_proj = ox.project_geometry(polygon)
-
-		# subdivide it if it exceeds the max area size (in meters), then project
-		# back to lat-long
-		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
-		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
-		log('Requesting building footprints data within bounding box from API in {:,} request(s)'.format(len(geometry)))
-		start_time = time.time()
-
-		# loop through each polygon rectangle in the geometry (there will only
-		# be one if original bbox didn't exceed max area size)
-		for poly in geometry:
-			# represent bbox as south,west,north,east and round lat-longs to 8
-			# decimal places (ie, within 1 mm) so URL strings aren't different
-			# due to float rounding issues (for consistent caching)
-			west, south, east, north = poly.bounds
-			query_template = (date+'[out:json][timeout:{timeout}]{maxsize};((way["building"]({south:.8f},'
-							  '{west:.8f},{north:.8f},{east:.8f});(._;>;););(relation["building"]'
-							  '({south:.8f},{west:.8f},{north:.8f},{east:.8f});(._;>;);););out;')
-			query_str = query_template.format(north=north, south=south, east=east, west=west, timeout=timeout, maxsize=maxsize)
-			response_json = ox.overpass_request(data={'data':query_str}, timeout=timeout)
-			response_jsons.append(response_json)
-		msg = ('Got all building footprints data within bounding box from '
-			   'API in {:,} request(s) and {:,.2f} seconds')
-		log(msg.format(len(geometry), time.time()-start_time))
-
-	elif by_poly:
-		# project to utm, divide polygon up into sub-polygons if area exceeds a
-		# max size (in meters), project back to lat-long, then get a list of polygon(s) exterior coordinates
-		geometry_proj, crs_proj = ox.project_geometry(polygon)
-		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
-		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
-		polygon_coord_strs = ox.get_polygons_coordinates(geometry)
-		log('Requesting building footprints data within polygon from API in {:,} request(s)'.format(len(polygon_coord_strs)))
-		start_time = time.time()
-
-		# pass each polygon exterior coordinates in the list to the API, one at
-		# a time
-		for polygon_coord_str in polygon_coord_strs:
-			query_template = (date+'[out:json][timeout:{timeout}]{maxsize};(way'
-							  '(poly:"{polygon}")["building"];(._;>;);relation'
-							  '(poly:"{polygon}")["building"];(._;>;););out;')
-			query_str = query_template.format(polygon=polygon_coord_str, timeout=timeout, maxsize=maxsize)
-			response_json = ox.overpass_request(data={'data':query_str}, timeout=timeout)
-			response_jsons.append(response_json)
-		msg = ('Got all building footprints data within polygon from API in '
-			   '{:,} request(s) and {:,.2f} seconds')
-		log(msg.format(len(polygon_coord_strs), time.time()-start_time))
-
-	return response_jsons
-
+	# define the query to send the API: the relations (members only) and ways of the region, with their coordinates inlined
+	query_template = 'relation["building"]{region}->.relations;.relations out body;(way["building"]{region};way(r.relations););out geom;'
+	query_strs, clip_region = _region_query_strs(query_template, date, polygon, north, south, east, west, timeout=timeout, memory=memory, max_query_area_size=max_query_area_size)
+	return _run_elements_queries(query_strs, clip_region, 'building footprints data', timeout=timeout, consume=consume)
 
 def create_buildings_gdf(date="", polygon=None, north=None, south=None, east=None,
 						 west=None, retain_invalid=False):
@@ -231,35 +379,8 @@ def create_buildings_gdf(date="", polygon=None, north=None, south=None, east=Non
 	GeoDataFrame
 	"""
 
-	responses = osm_bldg_download(date, polygon, north, south, east, west)
-
-	vertices = {}
-	for response in responses:
-		for result in response['elements']:
-			if 'type' in result and result['type']=='node':
-				vertices[result['id']] = {'lat' : result['lat'],
-										  'lon' : result['lon']}
-
-	buildings = {}
-	for response in responses:
-		for result in response['elements']:
-			if 'type' in result and result['type']=='way':
-				nodes = result['nodes']
-				try:
-					polygon = Polygon([(vertices[node]['lon'], vertices[node]['lat']) for node in nodes])
-				except Exception:
-					log('Polygon has invalid geometry: {}'.format(nodes))
-				building = {'nodes' : nodes,
-							'geometry' : polygon}
-
-				if 'tags' in result:
-					for tag in result['tags']:
-						building[tag] = result['tags'][tag]
-
-				buildings[result['id']] = building
-
-	gdf = gpd.GeoDataFrame(buildings).T
-	gdf.crs = {'init':'epsg:4326'}
+	# partial GeoDataFrames assembled while the remaining tiles download
+	gdf = concat_gdfs( osm_bldg_download(date, polygon, north, south, east, west, consume=ways_to_gdf) )
 
 	if not retain_invalid:
 		# drop all invalid geometries
@@ -353,7 +474,7 @@ def buildings_from_place(date, place, which_result=1, retain_invalid=False):
 	-------
 	GeoDataFrame
 	"""
-	city = ox.gdf_from_place(place, which_result=which_result)
+	city = geocode_place(place, which_result=which_result)
 	polygon = city['geometry'].iloc[0]
 	return create_buildings_gdf(date=date, polygon=polygon, retain_invalid=retain_invalid)
 
@@ -361,7 +482,7 @@ def buildings_from_place(date, place, which_result=1, retain_invalid=False):
 ### Street network graph
 #######################################################################
 
-def retrieve_route_graph(city_ref, date="", polygon=None, north=None, south=None, east=None, west=None, force_crs=None):
+def retrieve_route_graph(city_ref, date="", polygon=None, north=None, south=None, east=None, west=None, force_crs=None, pbf_file=None, compact=False):
 	""" 
 	Retrieves street network graph for given `city_ref`
 	Loads the data if stored locally
@@ -386,44 +507,223 @@ def retrieve_route_graph(city_ref, date="", polygon=None, north=None, south=None
 		western longitude of bounding box
 	force_crs : dict
 		graph will be projected to input crs
+	pbf_file : string
+		path to a local .osm.pbf extract to read the street network from, instead of querying the Overpass API
+	compact : bool
+		if True, return a compact CSRGraph. Downloaded networks are then built straight from the responses, without an intermediate osmnx graph
 
 	Returns
 	----------
-	networkx.multidigraph
+	networkx.multidigraph or CSRGraph
 		projected graph
 	"""
+	graph_folder = get_route_graph_folder( os.path.join(ox.settings.data_folder, city_ref+'_network.graphml') )
+	G_compact = load_route_csr_graph(graph_folder)
+	if ( compact and G_compact is not None ):
+		log( "Found graph for `"+city_ref+"` stored locally (binary)" )
+		return G_compact
+
 	try:
 		G = ox.load_graphml(city_ref+'_network.graphml')
 		log( "Found graph for `"+city_ref+"` stored locally" )
+		if ( G_compact is None ): # Stored before the binary graphs, or with an older binary format
+			CSRGraph.from_networkx(G).save(graph_folder)
 	except:
 		try:
-			if (not polygon is None):
-				G = graph_from_polygon(polygon, network_type='drive_service', date=date)
-			elif ( all( [north,south,east,west] ) ):
-				G = graph_from_bbox(north, south, east, west, network_type='drive_service', date=date)
-			else: # No inputs
-				log("Need an input to retrieve graph")
-				assert(False)
-
-			# Set graph name
-			G.graph['name'] = str(city_ref) + '_street_network' if not city_ref is None else 'street_network'
-
-			# Project graph
-			G = ox.project_graph(G, to_crs=force_crs)
-			
-			# Save street network as GraphML file
-			ox.save_graphml(G, filename=city_ref+'_network.graphml')
-			log( "Graph for `"+city_ref+"` has been retrieved and stored" )
+			if (compact):
+				G = download_route_csr_graph(city_ref, date, polygon, north, south, east, west, pbf_file).to_networkx()
+			else:
+				G = download_route_graph(city_ref, date, polygon, north, south, east, west, pbf_file)
+			G = store_route_graph(G, city_ref, force_crs)
 		except Exception as e:
 			log( "Osmnx graph could not be retrieved."+str(e), level=lg.ERROR )
 			return None
+	if (compact):
+		return CSRGraph.load(graph_folder)
+	return G
+
+def download_route_graph(city_ref, date="", polygon=None, north=None, south=None, east=None, west=None, pbf_file=None):
+	""" 
+	Retrieves the street network graph for given `city_ref` from OpenStreetMap, in latitude-longitude coordinates
+	Input polygon or bounding box coordinates determine the region of interest
+
+	Parameters
+	----------
+	city_ref : string
+		name of the city
+	date : string
+		query the database at a certain timestamp
+	polygon : shapely.Polygon
+		polygon shape of input city
+	north : float
+		northern latitude of bounding box
+	south : float
+		southern latitude of bounding box
+	east : float
+		eastern longitude of bounding box
+	west : float
+		western longitude of bounding box
+	pbf_file : string
+		path to a local .osm.pbf extract to read the street network from, instead of querying the Overpass API
+
+	Returns
+	----------
+	networkx.multidigraph
+		unprojected graph
+	"""
+	if (not polygon is None):
+		G = graph_from_polygon(polygon, network_type='drive_service', date=date, pbf_file=pbf_file)
+	elif ( all( [north,south,east,west] ) ):
+		G = graph_from_bbox(north, south, east, west, network_type='drive_service', date=date, pbf_file=pbf_file)
+	else: # No inputs
+		log("Need an input to retrieve graph")
+		assert(False)
+
+	# Set graph name
+	G.graph['name'] = str(city_ref) + '_street_network' if not city_ref is None else 'street_network'
 	return G
 
+def download_route_csr_graph(city_ref, date="", polygon=None, north=None, south=None, east=None, west=None, pbf_file=None):
+	""" 
+	Retrieves the street network graph for given `city_ref` from OpenStreetMap as a compact CSRGraph, in latitude-longitude coordinates
+	The graph is built straight from the responses and simplified (intersections and dead-ends only), then truncated to the region of interest
+	As osmnx `clean_periphery`, the network is retrieved within a 0.5km buffer around the region of interest: Nodes near its border keep their intersection status once truncated
+
+	Parameters
+	----------
+	city_ref : string
+		name of the city
+	date : string
+		query the database at a certain timestamp
+	polygon : shapely.Polygon
+		polygon shape of input city
+	north : float
+		northern latitude of bounding box
+	south : float
+		southern latitude of bounding box
+	east : float
+		eastern longitude of bounding box
+	west : float
+		western longitude of bounding box
+	pbf_file : string
+		path to a local .osm.pbf extract to read the street network from, instead of querying the Overpass API
+
+	Returns
+	----------
+	CSRGraph
+		unprojected graph
+	"""
+	if (polygon is None):
+		if not ( all( [north,south,east,west] ) ): # No inputs
+			log("Need an input to retrieve graph")
+			assert(False)
+		polygon = Polygon([(west, south), (east, south), (east, north), (west, north)])
+
+	# Buffered region of interest (see `graph_from_polygon`)
+	polygon_utm, crs_utm = ox.project_geometry(geometry=polygon)
+	polygon_buffered, _ = ox.project_geometry(geometry=polygon_utm.buffer(500), crs=crs_utm, to_latlong=True)
+
+	if (pbf_file is not None):
+		response_jsons = pbf_net_download(pbf_file, polygon=polygon_buffered, network_type='drive_service')
+	else:
+		response_jsons = osm_net_download(polygon=polygon_buffered, network_type='drive_service', date=date)
+
+	G = CSRGraph.from_overpass(response_jsons, network_type='drive_service', name=str(city_ref) + '_street_network' if not city_ref is None else 'street_network')
+	return G.truncate(polygon).largest_component()
+
+def store_route_graph(G, city_ref, force_crs=None):
+	""" 
+	Projects the street network graph of `city_ref` and stores it as a GraphML file
+
+	Parameters
+	----------
+	G : networkx.multidigraph
+		unprojected graph
+	city_ref : string
+		name of the city
+	force_crs : dict
+		graph will be projected to input crs
+
+	Returns
+	----------
+	networkx.multidigraph
+		projected graph
+	"""
+	# Project graph
+	G = ox.project_graph(G, to_crs=force_crs)
+	
+	# Save street network as GraphML file, and its binary (memory mapped) version
+	ox.save_graphml(G, filename=city_ref+'_network.graphml')
+	CSRGraph.from_networkx(G).save( get_route_graph_folder( os.path.join(ox.settings.data_folder, city_ref+'_network.graphml') ) )
+	log( "Graph for `"+city_ref+"` has been retrieved and stored" )
+	return G
+
+def get_route_graph_folder(graphml_file):
+	"""
+	Get the folder of the binary graph stored along a GraphML file (see `CSRGraph.save`)
+
+	Parameters
+	----------
+	graphml_file : string
+		GraphML file name
+
+	Returns
+	----------
+	string
+		binary graph folder name
+	"""
+	return os.path.splitext(graphml_file)[0] + '.csr'
+
+def load_route_csr_graph(graph_folder):
+	"""
+	Load a binary street network graph (see `CSRGraph.save`), memory mapped
+
+	Parameters
+	----------
+	graph_folder : string
+		binary graph folder
+
+	Returns
+	----------
+	CSRGraph
+		stored graph, or None if it does not exist or was stored with an older format (without edge attributes and geometries)
+	"""
+	if not ( os.path.isdir(graph_folder) ):
+		return None
+	try:
+		return CSRGraph.load(graph_folder)
+	except ValueError as e:
+		log( "Binary graph `"+graph_folder+"` ignored: "+str(e), level=lg.WARNING )
+		return None
+
+def load_route_graph(graphml_file, compact=False):
+	"""
+	Load a stored street network graph. Its binary version is memory mapped if available, otherwise the GraphML file is parsed
+	Graphs loaded from their binary version hold node coordinates, and edge length, osmid, oneway, highway, name and geometry
+
+	Parameters
+	----------
+	graphml_file : string
+		GraphML file name
+	compact : bool
+		if True, return a CSRGraph
+
+	Returns
+	----------
+	networkx.multidigraph or CSRGraph
+		stored graph
+	"""
+	G = load_route_csr_graph( get_route_graph_folder(graphml_file) )
+	if ( G is not None ):
+		return G if compact else G.to_networkx()
+	G = ox.load_graphml(graphml_file, folder="")
+	return CSRGraph.from_networkx(G) if compact else G
+
 def graph_from_polygon(polygon, network_type='all_private', simplify=True,
 					   retain_all=False, truncate_by_edge=False, name='unnamed',
 					   timeout=180, memory=None, date="",
 					   max_query_area_size=50*1000*50*1000,
-					   clean_periphery=True, infrastructure='way["highway"]'):
+					   clean_periphery=True, infrastructure='way["highway"]', pbf_file=None):
 	"""
 	Create a networkx graph from OSM data within the spatial boundaries of the
 	passed-in shapely polygon.
@@ -459,6 +759,8 @@ def graph_from_polygon(polygon, network_type='all_private', simplify=True,
 	infrastructure : string
 		download infrastructure of given type (default is streets (ie, 'way["highway"]') but other
 		infrastructures may be selected like power grids (ie, 'way["power"~"line"]'))
+	pbf_file : string
+		path to a local .osm.pbf extract to read the network data from, instead of querying the Overpass API
 	Returns
 	-------
 	networkx multidigraph
@@ -480,10 +782,13 @@ def graph_from_polygon(polygon, network_type='all_private', simplify=True,
 
 		# get the network data from OSM,  create the buffered graph, then
 		# truncate it to the buffered polygon
-		response_jsons = osm_net_download(polygon=polygon_buffered, network_type=network_type,
-										  timeout=timeout, memory=memory,
-										  max_query_area_size=max_query_area_size,
-										  infrastructure=infrastructure)
+		if (pbf_file is not None):
+			response_jsons = pbf_net_download(pbf_file, polygon=polygon_buffered, network_type=network_type, infrastructure=infrastructure)
+		else:
+			response_jsons = osm_net_download(polygon=polygon_buffered, network_type=network_type,
+											  timeout=timeout, memory=memory,
+											  max_query_area_size=max_query_area_size,
+											  infrastructure=infrastructure)
 		G_buffered = ox.create_graph(response_jsons, name=name, retain_all=True, network_type=network_type)
 		G_buffered = ox.truncate_graph_polygon(G_buffered, polygon_buffered, retain_all=True, truncate_by_edge=truncate_by_edge)
 
@@ -504,10 +809,13 @@ def graph_from_polygon(polygon, network_type='all_private', simplify=True,
 
 	else:
 		# download a list of API responses for the polygon/multipolygon
-		response_jsons = osm_net_download(polygon=polygon, network_type=network_type,
-										  timeout=timeout, memory=memory,
-										  max_query_area_size=max_query_area_size,
-										  infrastructure=infrastructure)
+		if (pbf_file is not None):
+			response_jsons = pbf_net_download(pbf_file, polygon=polygon, network_type=network_type, infrastructure=infrastructure)
+		else:
+			response_jsons = osm_net_download(polygon=polygon, network_type=network_type,
+											  timeout=timeout, memory=memory,
+											  max_query_area_size=max_query_area_size,
+											  infrastructure=infrastructure)
 
 		# create the graph from the downloaded data
 		G = ox.create_graph(response_jsons, name=name, retain_all=True, network_type=network_type)
@@ -529,7 +837,7 @@ def graph_from_bbox(north, south, east, west, network_type='all_private',
 					simplify=True, retain_all=False, truncate_by_edge=False,
 					name='unnamed', timeout=180, memory=None, date="",
 					max_query_area_size=50*1000*50*1000, clean_periphery=True,
-					infrastructure='way["highway"]'):
+					infrastructure='way["highway"]', pbf_file=None):
 	"""
 	Create a networkx graph from OSM data within some bounding box.
 	Parameters
@@ -569,6 +877,8 @@ def graph_from_bbox(north, south, east, west, network_type='all_private',
 	infrastructure : string
 		download infrastructure of given type (default is streets (ie, 'way["highway"]') but other
 		infrastructures may be selected like power grids (ie, 'way["power"~"line"]'))
+	pbf_file : string
+		path to a local .osm.pbf extract to read the network data from, instead of querying the Overpass API
 	Returns
 	-------
 	networkx multidigraph
@@ -584,12 +894,15 @@ def graph_from_bbox(north, south, east, west, network_type='all_private',
 		west_buffered, south_buffered, east_buffered, north_buffered = polygon_buff.bounds
 
 		# get the network data from OSM then create the graph
-		response_jsons = osm_net_download(north=north_buffered, south=south_buffered,
-										  east=east_buffered, west=west_buffered,
-										  network_type=network_type, timeout=timeout,
-										  memory=memory, date=date,
-										  max_query_area_size=max_query_area_size,
-										  infrastructure=infrastructure)
+		if (pbf_file is not None):
+			response_jsons = pbf_net_download(pbf_file, north=north_buffered, south=south_buffered, east=east_buffered, west=west_buffered, network_type=network_type, infrastructure=infrastructure)
+		else:
+			response_jsons = osm_net_download(north=north_buffered, south=south_buffered,
+											  east=east_buffered, west=west_buffered,
+											  network_type=network_type, timeout=timeout,
+											  memory=memory, date=date,
+											  max_query_area_size=max_query_area_size,
+											  infrastructure=infrastructure)
 		G_buffered = ox.create_graph(response_jsons, name=name, retain_all=retain_all, network_type=network_type)
 		G = ox.truncate_graph_bbox(G_buffered, north, south, east, west, retain_all=True, truncate_by_edge=truncate_by_edge)
 
@@ -607,11 +920,14 @@ def graph_from_bbox(north, south, east, west, network_type='all_private',
 
 	else:
 		# get the network data from OSM
-		response_jsons = osm_net_download(north=north, south=south, east=east,
-										  west=west, network_type=network_type,
-										  timeout=timeout, memory=memory, date=date,
-										  max_query_area_size=max_query_area_size,
-										  infrastructure=infrastructure)
+		if (pbf_file is not None):
+			response_jsons = pbf_net_download(pbf_file, north=north, south=south, east=east, west=west, network_type=network_type, infrastructure=infrastructure)
+		else:
+			response_jsons = osm_net_download(north=north, south=south, east=east,
+											  west=west, network_type=network_type,
+											  timeout=timeout, memory=memory, date=date,
+											  max_query_area_size=max_query_area_size,
+											  infrastructure=infrastructure)
 
 		# create the graph, then truncate to the bounding box
 		G = ox.create_graph(response_jsons, name=name, retain_all=retain_all, network_type=network_type)
@@ -668,79 +984,21 @@ def osm_net_download(polygon=None, north=None, south=None, east=None, west=None,
 	response_jsons : list
 	"""
 
-	# check if we're querying by polygon or by bounding box based on which
-	# argument(s) where passed into this function
-	by_poly = polygon is not None
-	by_bbox = not (north is None or south is None or east is None or west is None)
-	if not (by_poly or by_bbox):
-		raise ValueError('You must pass a polygon or north, south, east, and west')
-
 	# create a filter to exclude certain kinds of ways based on the requested
 	# network_type
 	osm_filter = ox.get_osm_filter(network_type)
-	response_jsons = []
-
-	# pass server memory allocation in bytes for the query to the API
-	# if None, pass nothing so the server will use its default allocation size
-	# otherwise, define the query's maxsize parameter value as whatever the
-	# caller passed in
-	if memory is None:
-		maxsize = ''
-	else:
-		maxsize = '[maxsize:{}]'.format(memory)
 
 	# define the query to send the API
 	# specifying way["highway"] means that all ways returned must have a highway
 	# key. the {filters} then remove ways by key/value. the '>' makes it recurse
-	# so we get ways and way nodes. maxsize is in bytes.
-	if by_bbox:
-		# turn bbox into a polygon and project to local UTM
-		polygon = Polygon([(west, south), (east, south), (east, north), (west, north)])
-		geometry_proj, crs_proj = ox.project_geometry(polygon)
+	# so we get ways and way nodes: way nodes are output as skeletons (coordinates
+	# only, the graph does not use their tags). maxsize is in bytes.
+	# the graph is truncated to the region of interest: tiles features are not clipped
+	query_template = '{infrastructure}{filters}{region};out body;>;out skel qt;'
+	query_strs, _ = _region_query_strs(query_template, date, polygon, north, south, east, west, timeout=timeout, memory=memory, max_query_area_size=max_query_area_size, infrastructure=infrastructure, filters=osm_filter)
 
-		# subdivide it if it exceeds the max area size (in meters), then project
-		# back to lat-long
-		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
-		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
-		log('Requesting network data within bounding box from API in {:,} request(s)'.format(len(geometry)))
-		start_time = time.time()
-
-		# loop through each polygon rectangle in the geometry (there will only
-		# be one if original bbox didn't exceed max area size)
-		for poly in geometry:
-			# represent bbox as south,west,north,east and round lat-longs to 8
-			# decimal places (ie, within 1 mm) so URL strings aren't different
-			# due to float rounding issues (for consistent caching)
-			west, south, east, north = poly.bounds
-			query_template = date+'[out:json][timeout:{timeout}]{maxsize};({infrastructure}{filters}({south:.8f},{west:.8f},{north:.8f},{east:.8f});>;);out;'
-			query_str = query_template.format(north=north, south=south,
-											  east=east, west=west,
-											  infrastructure=infrastructure,
-											  filters=osm_filter,
-											  timeout=timeout, maxsize=maxsize)
-			response_json = ox.overpass_request(data={'data':query_str}, timeout=timeout)
-			response_jsons.append(response_json)
-		log('Got all network data within bounding box from API in {:,} request(s) and {:,.2f} seconds'.format(len(geometry), time.time()-start_time))
-
-	elif by_poly:
-		# project to utm, divide polygon up into sub-polygons if area exceeds a
-		# max size (in meters), project back to lat-long, then get a list of
-		# polygon(s) exterior coordinates
-		geometry_proj, crs_proj = ox.project_geometry(polygon)
-		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
-		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
-		polygon_coord_strs = ox.get_polygons_coordinates(geometry)
-		log('Requesting network data within polygon from API in {:,} request(s)'.format(len(polygon_coord_strs)))
-		start_time = time.time()
-
-		# pass each polygon exterior coordinates in the list to the API, one at
-		# a time
-		for polygon_coord_str in polygon_coord_strs:
-			query_template = date+'[out:json][timeout:{timeout}]{maxsize};({infrastructure}{filters}(poly:"{polygon}");>;);out;'
-			query_str = query_template.format(polygon=polygon_coord_str, infrastructure=infrastructure, filters=osm_filter, timeout=timeout, maxsize=maxsize)
-			response_json = ox.overpass_request(data={'data':query_str}, timeout=timeout)
-			response_jsons.append(response_json)
-		log('Got all network data within polygon from API in {:,} request(s) and {:,.2f} seconds'.format(len(polygon_coord_strs), time.time()-start_time))
+	# send the sub-queries in parallel, under the shared rate limit
+	response_jsons = run_tile_queries(query_strs, lambda query_str: cached_overpass_request(data={'data':query_str}, timeout=timeout), description='network data', merge=merge_response_jsons)
 
 	return response_jsons
 
@@ -749,7 +1007,7 @@ def osm_net_download(polygon=None, north=None, south=None, east=None, west=None,
 #######################################################################
 
 def osm_landuse_download(date="", polygon=None, north=None, south=None, east=None, west=None,
-					  timeout=180, memory=None, max_query_area_size=50*1000*50*1000):
+					  timeout=180, memory=None, max_query_area_size=50*1000*50*1000, consume=None):
 	"""
 	Download OpenStreetMap landuse footprint data.
 	Parameters
@@ -776,84 +1034,19 @@ def osm_landuse_download(date="", polygon=None, north=None, south=None, east=Non
 		any polygon bigger will get divided up for multiple queries to API
 		(default is 50,000 * 50,000 units (ie, 50km x 50km in area, if units are
 		meters))
+	consume : function
+		processes the (clipped) elements of each tile as soon as they are retrieved
+		(e.g. assembles a partial GeoDataFrame). If None, the elements of all tiles are merged
 	Returns
 	-------
-	list
-		list of response_json dicts
+	OSMElements or list
+		parsed elements of all responses, or processed elements of each tile (if `consume` is given)
 	"""
 
-	# check if we're querying by polygon or by bounding box based on which
-	# argument(s) where passed into this function
-	by_poly = polygon is not None
-	by_bbox = not (north is None or south is None or east is None or west is None)
-	if not (by_poly or by_bbox):
-		raise ValueError('You must pass a polygon or north, south, east, and west')
-
-	response_jsons = []
-
-	# pass server memory allocation in bytes for the query to the API
-	# if None, pass nothing so the server will use its default allocation size
-	# otherwise, define the query's maxsize parameter value as whatever the
-	# caller passed in
-	if memory is None:
-		maxsize = ''
-	else:
-		maxsize = '[maxsize:{}]'.format(memory)
-
-	# define the query to send the API
-	if by_bbox:
-		# turn bbox into a polygon and project to local UTM
-		polygon = Polygon([(west, south), (east, south), (east, north), (west, north)])
-		geometry_proj, crs_proj = ox.project_geometry(polygon)
-
-		# subdivide it if it exceeds the max area size (in meters), then project
-		# back to lat-long
-		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
-		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
-		log('Requesting landuse footprints data within bounding box from API in {:,} request(s)'.format(len(geometry)))
-		start_time = time.time()
-
-		# loop through each polygon rectangle in the geometry (there will only
-		# be one if original bbox didn't exceed max area size)
-		for poly in geometry:
-			# represent bbox as south,west,north,east and round lat-longs to 8
-			# decimal places (ie, within 1 mm) so URL strings aren't different
-			# due to float rounding issues (for consistent caching)
-			west, south, east, north = poly.bounds
-			query_template = (date+'[out:json][timeout:{timeout}]{maxsize};((way["landuse"]({south:.8f},'
-							  '{west:.8f},{north:.8f},{east:.8f});(._;>;););(relation["landuse"]'
-							  '({south:.8f},{west:.8f},{north:.8f},{east:.8f});(._;>;);););out;')
-			query_str = query_template.format(north=north, south=south, east=east, west=west, timeout=timeout, maxsize=maxsize)
-			response_json = ox.overpass_request(data={'data':query_str}, timeout=timeout)
-			response_jsons.append(response_json)
-		msg = ('Got all landuse footprints data within bounding box from '
-			   'API in {:,} request(s) and {:,.2f} seconds')
-		log(msg.format(len(geometry), time.time()-start_time))
-
-	elif by_poly:
-		# project to utm, divide polygon up into sub-polygons if area exceeds a
-		# max size (in meters), project back to lat-long, then get a list of polygon(s) exterior coordinates
-		geometry_proj, crs_proj = ox.project_geometry(polygon)
-		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
-		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
-		polygon_coord_strs = ox.get_polygons_coordinates(geometry)
-		log('Requesting landuse footprints data within polygon from API in {:,} request(s)'.format(len(polygon_coord_strs)))
-		start_time = time.time()
-
-		# pass each polygon exterior coordinates in the list to the API, one at
-		# a time
-		for polygon_coord_str in polygon_coord_strs:
-			query_template = (date+'[out:json][timeout:{timeout}]{maxsize};(way'
-							  '(poly:"{polygon}")["landuse"];(._;>;);relation'
-							  '(poly:"{polygon}")["landuse"];(._;>;););out;')
-			query_str = query_template.format(polygon=polygon_coord_str, timeout=timeout, maxsize=maxsize)
-			response_json = ox.overpass_request(data={'data':query_str}, timeout=timeout)
-			response_jsons.append(response_json)
-		msg = ('Got all landuse footprints data within polygon from API in '
-			   '{:,} request(s) and {:,.2f} seconds')
-		log(msg.format(len(polygon_coord_strs), time.time()-start_time))
-
-	return response_jsons
+	# define the query to send the API: the relations (members only) and ways of the region, with their coordinates inlined
+	query_template = 'relation["landuse"]{region}->.relations;.relations out body;(way["landuse"]{region};way(r.relations););out geom;'
+	query_strs, clip_region = _region_query_strs(query_template, date, polygon, north, south, east, west, timeout=timeout, memory=memory, max_query_area_size=max_query_area_size)
+	return _run_elements_queries(query_strs, clip_region, 'landuse footprints data', timeout=timeout, consume=consume)
 
 def create_landuse_gdf(date="", polygon=None, north=None, south=None, east=None,
 						 west=None, retain_invalid=False):
@@ -880,35 +1073,8 @@ def create_landuse_gdf(date="", polygon=None, north=None, south=None, east=None,
 	GeoDataFrame
 	"""
 
-	responses = osm_landuse_download(date, polygon, north, south, east, west)
-
-	vertices = {}
-	for response in responses:
-		for result in response['elements']:
-			if 'type' in result and result['type']=='node':
-				vertices[result['id']] = {'lat' : result['lat'],
-										  'lon' : result['lon']}
-
-	landuses = {}
-	for response in responses:
-		for result in response['elements']:
-			if 'type' in result and result['type']=='way':
-				nodes = result['nodes']
-				try:
-					polygon = Polygon([(vertices[node]['lon'], vertices[node]['lat']) for node in nodes])
-				except Exception:
-					log('Polygon has invalid geometry: {}'.format(nodes))
-				landuse = {'nodes' : nodes,
-							'geometry' : polygon}
-
-				if 'tags' in result:
-					for tag in result['tags']:
-						landuse[tag] = result['tags'][tag]
-
-				landuses[result['id']] = landuse
-
-	gdf = gpd.GeoDataFrame(landuses).T
-	gdf.crs = {'init':'epsg:4326'}
+	# partial GeoDataFrames assembled while the remaining tiles download
+	gdf = concat_gdfs( osm_landuse_download(date, polygon, north, south, east, west, consume=ways_to_gdf) )
 
 	if not retain_invalid:
 		# drop all invalid geometries
@@ -921,7 +1087,7 @@ def create_landuse_gdf(date="", polygon=None, north=None, south=None, east=None,
 #######################################################################
 
 def osm_pois_download(date="", polygon=None, north=None, south=None, east=None, west=None,
-					  timeout=180, memory=None, max_query_area_size=50*1000*50*1000):
+					  timeout=180, memory=None, max_query_area_size=50*1000*50*1000, consume=None):
 	"""
 	Download OpenStreetMap POIs footprint data.
 	Parameters
@@ -948,92 +1114,20 @@ def osm_pois_download(date="", polygon=None, north=None, south=None, east=None,
 		any polygon bigger will get divided up for multiple queries to API
 		(default is 50,000 * 50,000 units (ie, 50km x 50km in area, if units are
 		meters))
+	consume : function
+		processes the (clipped) elements of each tile as soon as they are retrieved
+		(e.g. assembles a partial GeoDataFrame). If None, the elements of all tiles are merged
 	Returns
 	-------
-	list
-		list of response_json dicts
+	OSMElements or list
+		parsed elements of all responses, or processed elements of each tile (if `consume` is given)
 	"""
 
-	# check if we're querying by polygon or by bounding box based on which
-	# argument(s) where passed into this function
-	by_poly = polygon is not None
-	by_bbox = not (north is None or south is None or east is None or west is None)
-	if not (by_poly or by_bbox):
-		raise ValueError('You must pass a polygon or north, south, east, and west')
-
-	response_jsons = []
-
-	# pass server memory allocation in bytes for the query to the API
-	# if None, pass nothing so the server will use its default allocation size
-	# otherwise, define the query's maxsize parameter value as whatever the
-	# caller passed in
-	if memory is None:
-		maxsize = ''
-	else:
-		maxsize = '[maxsize:{}]'.format(memory)
-
-	# define the query to send the API
-	if by_bbox:
-		# turn bbox into a polygon and project to local UTM
-		polygon = Polygon([(west, south), (east, south), (east, north), (west, north)])
-		geometry_proj, crs_proj = ox.project_geometry(polygon)
-
-		# subdivide it if it exceeds the max area size (in meters), then project
-		# back to lat-long
-		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
-		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
-		log('Requesting POIs footprints data within bounding box from API in {:,} request(s)'.format(len(geometry)))
-		start_time = time.time()
-
-		# loop through each polygon rectangle in the geometry (there will only
-		# be one if original bbox didn't exceed max area size)
-		for poly in geometry:
-			# represent bbox as south,west,north,east and round lat-longs to 8
-			# decimal places (ie, within 1 mm) so URL strings aren't different
-			# due to float rounding issues (for consistent caching)
-			west, south, east, north = poly.bounds
-			query_template = (date+'[out:json][timeout:{timeout}]{maxsize};((node["amenity"]({south:.8f},'
-				'{west:.8f},{north:.8f},{east:.8f}););(node["leisure"]({south:.8f},'
-				'{west:.8f},{north:.8f},{east:.8f}););(node["office"]({south:.8f},'
-				'{west:.8f},{north:.8f},{east:.8f}););(node["shop"]({south:.8f},'
-				'{west:.8f},{north:.8f},{east:.8f}););(node["sport"]({south:.8f},'
-				'{west:.8f},{north:.8f},{east:.8f}););(node["building"]({south:.8f},'
-				'{west:.8f},{north:.8f},{east:.8f});););out;')
-			query_str = query_template.format(north=north, south=south, east=east, west=west, timeout=timeout, maxsize=maxsize)
-			response_json = ox.overpass_request(data={'data':query_str}, timeout=timeout)
-			response_jsons.append(response_json)
-		msg = ('Got all POIs footprints data within bounding box from '
-			   'API in {:,} request(s) and {:,.2f} seconds')
-		log(msg.format(len(geometry), time.time()-start_time))
-
-	elif by_poly:
-		# project to utm, divide polygon up into sub-polygons if area exceeds a
-		# max size (in meters), project back to lat-long, then get a list of polygon(s) exterior coordinates
-		geometry_proj, crs_proj = ox.project_geometry(polygon)
-		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
-		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
-		polygon_coord_strs = ox.get_polygons_coordinates(geometry)
-		log('Requesting POIs footprints data within polygon from API in {:,} request(s)'.format(len(polygon_coord_strs)))
-		start_time = time.time()
-
-		# pass each polygon exterior coordinates in the list to the API, one at
-		# a time
-		for polygon_coord_str in polygon_coord_strs:
-			query_template = (date+'[out:json][timeout:{timeout}]{maxsize};('
-				'(node["amenity"](poly:"{polygon}"););'
-				'(node["leisure"](poly:"{polygon}"););'
-				'(node["office"](poly:"{polygon}"););'
-				'(node["shop"](poly:"{polygon}"););'
-				'(node["sport"](poly:"{polygon}"););'
-				'(node["building"](poly:"{polygon}");););out;')
-			query_str = query_template.format(polygon=polygon_coord_str, timeout=timeout, maxsize=maxsize)
-			response_json = ox.overpass_request(data={'data':query_str}, timeout=timeout)
-			response_jsons.append(response_json)
-		msg = ('Got all POIs footprints data within polygon from API in '
-			   '{:,} request(s) and {:,.2f} seconds')
-		log(msg.format(len(polygon_coord_strs), time.time()-start_time))
-
-	return response_jsons
+	# define the query to send the API: the nodes of the region
+	query_template = ('((node["amenity"]{region};);(node["leisure"]{region};);(node["office"]{region};);'
+					  '(node["shop"]{region};);(node["sport"]{region};);(node["building"]{region};););out;')
+	query_strs, clip_region = _region_query_strs(query_template, date, polygon, north, south, east, west, timeout=timeout, memory=memory, max_query_area_size=max_query_area_size)
+	return _run_elements_queries(query_strs, clip_region, 'POIs footprints data', timeout=timeout, consume=consume)
 
 def create_pois_gdf(date="", polygon=None, north=None, south=None, east=None,
 						 west=None, retain_invalid=False):
@@ -1060,38 +1154,15 @@ def create_pois_gdf(date="", polygon=None, north=None, south=None, east=None,
 	GeoDataFrame
 	"""
 
-	responses = osm_pois_download(date, polygon, north, south, east, west)
-
-	vertices = {}
-	for response in responses:
-		for result in response['elements']:
-			if 'type' in result and result['type']=='node':
-
-				point = Point( result['lon'], result['lat'] )
-
-				POI = {'geometry' : point}
-
-				if 'tags' in result:
-					for tag in result['tags']:
-						POI[tag] = result['tags'][tag]
-
-				vertices[result['id']] = POI
-
-	gdf = gpd.GeoDataFrame(vertices).T
-	gdf.crs = {'init':'epsg:4326'}
+	# partial GeoDataFrames assembled while the remaining tiles download
+	gdf = concat_gdfs( osm_pois_download(date, polygon, north, south, east, west, consume=nodes_to_gdf) )
 
 	if not retain_invalid:
 		try:
 			# drop all invalid geometries
 			gdf = gdf[gdf['geometry'].is_valid]
 		except: # Empty data frame
-			# Create a one-row data frame with null information (avoid later Spatial-Join crash)
-			if (polygon is not None): # Polygon given
-				point = polygon.centroid
-			else: # Bounding box
-				point = Point( (east+west)/2. , (north+south)/2. )
-			data = {"geometry":[point], "osm_id":[0]}
-			gdf = gpd.GeoDataFrame(data, crs={'init': 'epsg:4326'})
+			gdf = null_data_gdf( {"osm_id":[0]}, polygon, north, south, east, west )
 
 	return gdf
 
@@ -1100,7 +1171,7 @@ def create_pois_gdf(date="", polygon=None, north=None, south=None, east=None,
 #######################################################################
 
 def osm_bldg_part_download(date="", polygon=None, north=None, south=None, east=None, west=None,
-					  timeout=180, memory=None, max_query_area_size=50*1000*50*1000):
+					  timeout=180, memory=None, max_query_area_size=50*1000*50*1000, consume=None):
 	"""
 	Download OpenStreetMap building parts footprint data.
 	Parameters
@@ -1127,86 +1198,19 @@ def osm_bldg_part_download(date="", polygon=None, north=None, south=None, east=N
 		any polygon bigger will get divided up for multiple queries to API
 		(default is 50,000 * 50,000 units (ie, 50km x 50km in area, if units are
 		meters))
+	consume : function
+		processes the (clipped) elements of each tile as soon as they are retrieved
+		(e.g. assembles a partial GeoDataFrame). If None, the elements of all tiles are merged
 	Returns
 	-------
-	list
-		list of response_json dicts
+	OSMElements or list
+		parsed elements of all responses, or processed elements of each tile (if `consume` is given)
 	"""
 
-	# check if we're querying by polygon or by bounding box based on which
-	# argument(s) where passed into this function
-	by_poly = polygon is not None
-	by_bbox = not (north is None or south is None or east is None or west is None)
-	if not (by_poly or by_bbox):
-		raise ValueError('You must pass a polygon or north, south, east, and west')
-
-	response_jsons = []
-
-	# pass server memory allocation in bytes for the query to the API
-	# if None, pass nothing so the server will use its default allocation size
-	# otherwise, define the query's maxsize parameter value as whatever the
-	# caller passed in
-	if memory is None:
-		maxsize = ''
-	else:
-		maxsize = '[maxsize:{}]'.format(memory)
-
-	# define the query to send the API
-	if by_bbox:
-		# turn bbox into a polygon and project to local UTM
-		polygon = Polygon([(west, south), (east, south), (east, north), (west, north)])
-		geometry_proj, crs_proj = ox.project_geometry(polygon)
-
-		# subdivide it if it exceeds the max area size (in meters), then project
-		# back to lat-long
-		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
-		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
-		log('Requesting building part footprints data within bounding box from API in {:,} request(s)'.format(len(geometry)))
-		start_time = time.time()
-
-		# loop through each polygon rectangle in the geometry (there will only
-		# be one if original bbox didn't exceed max area size)
-		for poly in geometry:
-			# represent bbox as south,west,north,east and round lat-longs to 8
-			# decimal places (ie, within 1 mm) so URL strings aren't different
-			# due to float rounding issues (for consistent caching)
-			west, south, east, north = poly.bounds
-			query_template = (date+'[out:json][timeout:{timeout}]{maxsize};((way["building:part"]({south:.8f},'
-							  '{west:.8f},{north:.8f},{east:.8f});(._;>;););(relation["building:part"]'
-							  '({south:.8f},{west:.8f},{north:.8f},{east:.8f});(._;>;);););out;')
-			query_str = query_template.format(north=north, south=south, east=east, west=west, timeout=timeout, maxsize=maxsize)
-			response_json = ox.overpass_request(data={'data':query_str}, timeout=timeout)
-			response_jsons.append(response_json)
-		msg = ('Got all building part footprints data within bounding box from '
-			   'API in {:,} request(s) and {:,.2f} seconds')
-		log(msg.format(len(geometry), time.time()-start_time))
-
-	elif by_poly:
-		# project to utm, divide polygon up into sub-polygons if area exceeds a
-		# max size (in meters), project back to lat-long, then get a list of polygon(s) exterior coordinates
-		geometry_proj, crs_proj = ox.project_geometry(polygon)
-		geometry_proj_consolidated_subdivided = ox.consolidate_subdivide_geometry(geometry_proj, max_query_area_size=max_query_area_size)
-		geometry, _ = ox.project_geometry(geometry_proj_consolidated_subdivided, crs=crs_proj, to_latlong=True)
-		polygon_coord_strs = ox.get_polygons_coordinates(geometry)
-		log('Requesting building part footprints data within polygon from API in {:,} request(s)'.format(len(polygon_coord_strs)))
-		start_time = time.time()
-
-		# pass each polygon exterior coordinates in the list to the API, one at
-		# a time
-		for polygon_coord_str in polygon_coord_strs:
-			query_template = (date+'[out:json][timeout:{timeout}]{maxsize};(way'
-							  '(poly:"{polygon}")["building:part"];(._;>;);relation'
-							  '(poly:"{polygon}")["building:part"];(._;>;););out;')
-			query_str = query_template.format(polygon=polygon_coord_str, timeout=timeout, maxsize=maxsize)
-			response_json = ox.overpass_request(data={'data':query_str}, timeout=timeout)
-			response_jsons.append(response_json)
-		msg = ('Got all building part footprints data within polygon from API in '
-			   '{:,} request(s) and {:,.2f} seconds')
-		log(msg.format(len(polygon_coord_strs), time.time()-start_time))
-
-	return response_jsons
-
-
+	# define the query to send the API: the relations (members only) and ways of the region, with their coordinates inlined
+	query_template = 'relation["building:part"]{region}->.relations;.relations out body;(way["building:part"]{region};way(r.relations););out geom;'
+	query_strs, clip_region = _region_query_strs(query_template, date, polygon, north, south, east, west, timeout=timeout, memory=memory, max_query_area_size=max_query_area_size)
+	return _run_elements_queries(query_strs, clip_region, 'building part footprints data', timeout=timeout, consume=consume)
 
 def create_building_parts_gdf(date="", polygon=None, north=None, south=None, east=None,
 						 west=None, retain_invalid=False):
@@ -1235,48 +1239,165 @@ def create_building_parts_gdf(date="", polygon=None, north=None, south=None, eas
 	GeoDataFrame
 	"""
 
-	responses = osm_bldg_part_download(date, polygon, north, south, east, west)
-
-	vertices = {}
-	for response in responses:
-		for result in response['elements']:
-			if 'type' in result and result['type']=='node':
-				vertices[result['id']] = {'lat' : result['lat'],
-										  'lon' : result['lon']}
-
-	buildings = {}
-	for response in responses:
-		for result in response['elements']:
-			if 'type' in result and result['type']=='way':
-				nodes = result['nodes']
-				try:
-					polygon = Polygon([(vertices[node]['lon'], vertices[node]['lat']) for node in nodes])
-				except Exception:
-					log('Polygon has invalid geometry: {}'.format(nodes))
-				building = {'nodes' : nodes,
-							'geometry' : polygon}
-
-				if 'tags' in result:
-					for tag in result['tags']:
-						building[tag] = result['tags'][tag]
-
-				buildings[result['id']] = building
-
-	gdf = gpd.GeoDataFrame(buildings).T
-	gdf.crs = {'init':'epsg:4326'}
+	# partial GeoDataFrames assembled while the remaining tiles download
+	gdf = concat_gdfs( osm_bldg_part_download(date, polygon, north, south, east, west, consume=ways_to_gdf) )
 
 	if not retain_invalid:
 		try:
 			# drop all invalid geometries
 			gdf = gdf[gdf['geometry'].is_valid]
 		except: # Empty data frame
-			# Create a one-row data frame with null information (avoid later Spatial-Join crash)
-			if (polygon is not None): # Polygon given
-				point = polygon.centroid
-			else: # Bounding box
-				point = Point( (east+west)/2. , (north+south)/2. )
-			# Data as records
-			data = {"geometry":[point], "osm_id":[0], "building:part":["yes"], "height":[""]}
-			gdf = gpd.GeoDataFrame(data, crs={'init': 'epsg:4326'})
-
-	return gdf
\ No newline at end of file
+			gdf = null_data_gdf( {"osm_id":[0], "building:part":["yes"], "height":[""]}, polygon, north, south, east, west )
+
+	return gdf
+
+#######################################################################
+### Combined query: Buildings, building parts, land use and POIs
+#######################################################################
+
+def osm_features_download(date="", polygon=None, north=None, south=None, east=None, west=None,
+					  timeout=180, memory=None, max_query_area_size=50*1000*50*1000, consume=None):
+	"""
+	Download OpenStreetMap buildings, building parts, land use and POIs footprint data using a single union query per (sub-)region.
+	Parameters
+	----------
+	date : string
+		query the database at a certain timestamp
+	polygon : shapely Polygon or MultiPolygon
+		geographic shape to fetch the footprints within
+	north : float
+		northern latitude of bounding box
+	south : float
+		southern latitude of bounding box
+	east : float
+		eastern longitude of bounding box
+	west : float
+		western longitude of bounding box
+	timeout : int
+		the timeout interval for requests and to pass to API
+	memory : int
+		server memory allocation size for the query, in bytes. If none, server
+		will use its default allocation size
+	max_query_area_size : float
+		max area for any part of the geometry, in the units the geometry is in:
+		any polygon bigger will get divided up for multiple queries to API
+		(default is 50,000 * 50,000 units (ie, 50km x 50km in area, if units are
+		meters))
+	consume : function
+		processes the (clipped) elements of each tile as soon as they are retrieved
+		(e.g. assembles a partial GeoDataFrame). If None, the elements of all tiles are merged
+	Returns
+	-------
+	OSMElements or list
+		parsed elements of all responses, or processed elements of each tile (if `consume` is given)
+	"""
+
+	# union of the relations statements for buildings, building parts and land use (members only), then of the ways statements
+	# plus the relation member ways, with their coordinates inlined (no node recursion), then of the POIs nodes statements
+	relation_statements = [ 'relation["{key}"]{{region}};'.format(key=key) for key in [buildings_key, building_parts_key, landuse_key] ]
+	way_statements = [ 'way["{key}"]{{region}};'.format(key=key) for key in [buildings_key, building_parts_key, landuse_key] ]
+	node_statements = [ 'node["{key}"]{{region}};'.format(key=key) for key in pois_keys ]
+	query_template = ( '(' + ''.join(relation_statements) + ')->.relations;.relations out body;('
+					   + ''.join(way_statements) + 'way(r.relations););out geom;(' + ''.join(node_statements) + ');out body;' )
+
+	query_strs, clip_region = _region_query_strs(query_template, date, polygon, north, south, east, west, timeout=timeout, memory=memory, max_query_area_size=max_query_area_size)
+	return _run_elements_queries(query_strs, clip_region, 'OSM features data', timeout=timeout, consume=consume)
+
+def split_osm_features(elements, region):
+	"""
+	Split the elements of a combined query response into buildings, building parts, land use and POIs GeoDataFrames:
+		a way belongs to a feature class if it is tagged with its key (and lies within the region), or if it is a member of a relation tagged with its key
+		a node is a POI if it is tagged with one of the POIs keys and lies within the region
+
+	Parameters
+	----------
+	elements : OSMElements
+		parsed elements of a response
+	region : shapely PreparedGeometry
+		region of interest
+
+	Returns
+	-------
+	[ GeoDataFrame, GeoDataFrame, GeoDataFrame, GeoDataFrame ]
+		buildings, building parts, land use and POIs
+	"""
+	# Member ways of the relations tagged with each feature class key
+	feature_keys = [buildings_key, building_parts_key, landuse_key]
+	relation_members = { key:set() for key in feature_keys }
+	for members, tags in elements.relations.values():
+		for key in feature_keys:
+			if key in tags:
+				relation_members[key].update( [ ref for type_, ref, _ in members if type_=='way' ] )
+	all_relation_members = set().union( *relation_members.values() )
+
+	def ways_in_feature_class(key):
+		""" Ways of the response belonging to the feature class defined by `key` """
+		selection = []
+		for id_, (nodes, tags) in elements.ways.items():
+			if id_ in relation_members[key]:
+				selection.append(id_)
+			elif key in tags:
+				if (id_ in all_relation_members): # Retrieved as member of another feature class relation: Check it lies within the region
+					nodes = np.frombuffer(nodes, dtype=np.int64)
+					coords = elements.coordinates( nodes[ elements.contains_nodes(nodes) ] )
+					if ( len(coords) < 2 ) or ( not region.intersects( LineString(coords) ) ):
+						continue
+				selection.append(id_)
+		return selection
+
+	df_osm_built = ways_to_gdf( elements, ways_in_feature_class(buildings_key) )
+	df_osm_building_parts = ways_to_gdf( elements, ways_in_feature_class(building_parts_key) )
+	df_osm_lu = ways_to_gdf( elements, ways_in_feature_class(landuse_key) )
+
+	# Points of interest: Tagged nodes lying within the region
+	candidates = [ id_ for id_, tags in elements.node_tags.items() if any( key in tags for key in pois_keys ) ]
+	coords = elements.coordinates(candidates) if candidates else []
+	pois = [ id_ for id_, coord in zip(candidates, coords) if region.intersects( Point(coord) ) ]
+	df_osm_pois = nodes_to_gdf(elements, pois)
+
+	return df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois
+
+def create_osm_features_gdfs(date="", polygon=None, north=None, south=None, east=None,
+						 west=None, retain_invalid=False):
+	"""
+	Get buildings, building parts, land use and POIs footprint data from OSM with a single combined query per (sub-)region
+	The response is split client-side into the GeoDataFrames returned by `create_buildings_gdf`, `create_building_parts_gdf`, `create_landuse_gdf` and `create_pois_gdf`:
+		a way belongs to a feature class if it is tagged with its key (and lies within the region), or if it is a member of a relation tagged with its key
+		a node is a POI if it is tagged with one of the POIs keys and lies within the region
+
+	Parameters
+	----------
+	date : string
+		query the database at a certain timestamp
+	polygon : shapely Polygon or MultiPolygon
+		geographic shape to fetch the footprints within
+	north : float
+		northern latitude of bounding box
+	south : float
+		southern latitude of bounding box
+	east : float
+		eastern longitude of bounding box
+	west : float
+		western longitude of bounding box
+	retain_invalid : bool
+		if False discard any footprints with an invalid geometry
+	Returns
+	-------
+	[ GeoDataFrame, GeoDataFrame, GeoDataFrame, GeoDataFrame ]
+		buildings, building parts, land use and POIs
+	"""
+
+	# Region of interest, to filter elements retrieved through the recursion only
+	if (polygon is not None):
+		region = prep(polygon)
+	else:
+		region = prep( Polygon([(west, south), (east, south), (east, north), (west, north)]) )
+
+	# Each tile is split into partial GeoDataFrames while the remaining tiles download
+	tiles_gdfs = osm_features_download(date, polygon, north, south, east, west, consume=lambda elements: split_osm_features(elements, region))
+	df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois = [ concat_gdfs(gdfs) for gdfs in zip(*tiles_gdfs) ]
+
+	df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois = filter_features_gdfs(df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois, retain_invalid, polygon, north, south, east, west)
+
+	log('Split OSM features into {:,} buildings, {:,} building parts, {:,} land use polygons and {:,} POIs'.format(len(df_osm_built), len(df_osm_building_parts), len(df_osm_lu), len(df_osm_pois)))
+	return df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois
@@ -0,0 +1,361 @@
+###################################################################################################
+# Repository: https://github.com/lgervasoni/urbansprawl
+# MIT License
+###################################################################################################
+
+import re
+import time
+import numpy as np
+import osmnx as ox
+from shapely.geometry import Point
+from shapely.geometry import Polygon
+from shapely.geometry import LineString
+from shapely.prepared import prep
+from osmnx import log
+
+from .. import settings
+from .elements import OSMElements, ways_to_gdf, nodes_to_gdf, filter_features_gdfs
+from .tags import buildings_key, building_parts_key, landuse_key, pois_keys
+
+# Offline retrieval of OpenStreetMap data from a local .osm.pbf extract, using pyosmium
+# The features selected follow the Overpass queries of `overpass.py`:
+#	ways tagged with a feature class key and intersecting the region of interest, plus the member ways of the relations tagged with it and intersecting the region
+#	POIs nodes tagged with one of the POIs keys and lying within the region
+#	street network ways matching the infrastructure and the osmnx filter of the network type, and intersecting the region
+# Elements are stored into OSMElements containers, so that GeoDataFrames and graphs are assembled as for Overpass responses
+
+# Clauses of an osmnx filter, e.g.: ["highway"!~"cycleway|footway"]["service"!~"parking"]
+_filter_clause = re.compile(r'\["([^"]+)"(?:(!?~|!?=)"([^"]*)")?\]')
+# Infrastructure selector, e.g.: way["highway"] or way["power"~"line"]
+_infrastructure = re.compile(r'^way(.*)$')
+
+# Street network read along with the features of a region, until the graph retrieval which follows: (pbf_file, network_type, infrastructure) -> (region polygon, OSMElements)
+_shared_networks = {}
+
+#######################################################################
+### Tag filters
+#######################################################################
+
+def parse_osm_filter(osm_filter):
+	"""
+	Parse an Overpass tags filter (as returned by `osmnx.get_osm_filter`), to evaluate it client-side
+
+	Parameters
+	----------
+	osm_filter : string
+		Overpass tags filter
+
+	Returns
+	----------
+	list
+		(key, operator, compiled value) clauses. Operator is None for a key existence clause
+	"""
+	clauses = []
+	for key, operator, value in _filter_clause.findall(osm_filter):
+		if (operator in ['~','!~']):
+			clauses.append( (key, operator, re.compile(value)) )
+		elif (operator in ['=','!=']):
+			clauses.append( (key, operator, value) )
+		else:
+			clauses.append( (key, None, None) )
+	return clauses
+
+def match_osm_filter(tags, clauses):
+	"""
+	Evaluate parsed filter clauses over the tags of an element, as the Overpass API does
+	Negated clauses are satisfied by elements lacking the key
+
+	Parameters
+	----------
+	tags : dict
+		element tags
+	clauses : list
+		parsed filter clauses (see `parse_osm_filter`)
+
+	Returns
+	----------
+	bool
+		True if all the clauses are satisfied
+	"""
+	for key, operator, value in clauses:
+		tag = tags.get(key)
+		if (operator is None):
+			if (tag is None): return False
+		elif (operator == '~'):
+			if (tag is None) or (value.search(tag) is None): return False
+		elif (operator == '!~'):
+			if (tag is not None) and (value.search(tag) is not None): return False
+		elif (operator == '='):
+			if (tag != value): return False
+		elif (operator == '!='):
+			if (tag == value): return False
+	return True
+
+#######################################################################
+### Reading
+#######################################################################
+
+def _get_region(polygon=None, north=None, south=None, east=None, west=None):
+	"""
+	Region of interest: Input polygon, or polygon of the bounding box
+	"""
+	if (polygon is None):
+		polygon = Polygon([(west, south), (east, south), (east, north), (west, north)])
+	return polygon
+
+def _buffered_region(polygon, buffer_dist):
+	"""
+	Region buffered by a distance in meters (mitred: A buffered bounding box remains a bounding box)
+	"""
+	polygon_utm, crs_utm = ox.project_geometry(geometry=polygon)
+	polygon_buffered, _ = ox.project_geometry(geometry=polygon_utm.buffer(buffer_dist, join_style=2), crs=crs_utm, to_latlong=True)
+	return polygon_buffered
+
+class _Region():
+	"""
+	Prepared region of interest, with its bounds to discard distant geometries at once
+	"""
+	def __init__(self, polygon):
+		self.polygon = polygon
+		self.prepared = prep(polygon)
+		self.bounds = polygon.bounds
+
+	def intersects(self, coords):
+		"""
+		Determine if the geometry given by (lon, lat) coordinates intersects the region
+		"""
+		if ( len(coords) == 0 ):
+			return False
+		west, south, east, north = self.bounds
+		lons, lats = [ lon for lon, _ in coords ], [ lat for _, lat in coords ]
+		if ( max(lons) < west ) or ( min(lons) > east ) or ( max(lats) < south ) or ( min(lats) > north ):
+			return False
+		if ( len(coords) == 1 ):
+			return self.prepared.intersects( Point(coords[0]) )
+		return self.prepared.intersects( LineString(coords) )
+
+def _way_record(way):
+	"""
+	Node references, (lon, lat) coordinates of located nodes, and tags of a pyosmium way
+	"""
+	refs, coords = [], []
+	for node in way.nodes:
+		refs.append(node.ref)
+		if node.location.valid():
+			coords.append( (node.ref, node.location.lon, node.location.lat) )
+	return refs, coords, { tag.k:tag.v for tag in way.tags }
+
+def _add_way(elements, id_, refs, coords, tags):
+	"""
+	Add a way and its located nodes to the container
+	"""
+	for ref, lon, lat in coords:
+		elements.add( {'type':'node', 'id':ref, 'lon':lon, 'lat':lat} )
+	elements.add( {'type':'way', 'id':id_, 'nodes':refs, 'tags':tags} )
+
+def read_pbf_elements(pbf_file, polygon=None, north=None, south=None, east=None, west=None, network_type=None, infrastructure='way["highway"]', network_polygon=None):
+	"""
+	Read the buildings, building parts, land use, POIs and (optionally) street network elements of the region of interest from a local .osm.pbf extract
+	Elements are read within a single streaming pass, with node locations resolved by the pyosmium location index (`settings.pbf_location_index`)
+	Relations are stored after the ways in .osm.pbf files: The ways intersecting the region are kept during the pass, so that the member ways of the tagged relations are resolved once it ends
+	Unlike the Overpass `way(r.relations)` statement, member ways lying entirely out of the region are therefore not retrieved
+
+	Parameters
+	----------
+	pbf_file : string
+		path to the .osm.pbf extract
+	polygon : shapely Polygon or MultiPolygon
+		geographic shape to fetch the features within
+	north : float
+		northern latitude of bounding box
+	south : float
+		southern latitude of bounding box
+	east : float
+		eastern longitude of bounding box
+	west : float
+		western longitude of bounding box
+	network_type : string
+		street network type, as defined by osmnx (None: street network not read)
+	infrastructure : string
+		street network infrastructure selector
+	network_polygon : shapely Polygon or MultiPolygon
+		geographic shape to fetch the street network within (default: the region of interest)
+
+	Returns
+	----------
+	dict
+		OSMElements container of each feature class: buildings, building_parts, landuse, pois, and network (if requested)
+	"""
+	import osmium
+
+	region = _Region( _get_region(polygon, north, south, east, west) )
+	way_keys = [buildings_key, building_parts_key, landuse_key]
+	layers = { key:OSMElements() for key in way_keys }
+	layers["pois"] = OSMElements()
+
+	if (network_type is not None):
+		layers["network"] = OSMElements()
+		network_clauses = parse_osm_filter( _infrastructure.match(infrastructure).group(1) + ox.get_osm_filter(network_type) )
+		network_region = _Region(network_polygon) if (network_polygon is not None) else region
+	else:
+		network_clauses = None
+
+	# Ways intersecting the region (candidate relation members), and relations tagged with a feature class key
+	region_ways = {}
+	relations = {}
+
+	class ElementsHandler(osmium.SimpleHandler):
+		""" Tagged nodes of the region, ways of the region and of the street network, tagged relations """
+		def node(self, node):
+			if not any( key in node.tags for key in pois_keys ):
+				return
+			if not node.location.valid():
+				return
+			lon, lat = node.location.lon, node.location.lat
+			if not region.intersects( [ (lon, lat) ] ):
+				return
+			layers["pois"].add( {'type':'node', 'id':node.id, 'lon':lon, 'lat':lat, 'tags':{ tag.k:tag.v for tag in node.tags }} )
+
+		def way(self, way):
+			refs, coords, tags = _way_record(way)
+			lon_lat = [ coord[1:] for coord in coords ]
+			if (network_clauses is not None) and match_osm_filter(tags, network_clauses) and network_region.intersects(lon_lat):
+				_add_way(layers["network"], way.id, refs, coords, tags)
+			if not region.intersects(lon_lat):
+				return
+			region_ways[way.id] = (refs, coords, tags)
+			for key in way_keys:
+				if (key in tags):
+					_add_way(layers[key], way.id, refs, coords, tags)
+
+		def relation(self, relation):
+			keys = [ key for key in way_keys if key in relation.tags ]
+			if not (keys):
+				return
+			members = [ (member.type, member.ref, member.role) for member in relation.members ]
+			relations[relation.id] = ( members, { tag.k:tag.v for tag in relation.tags }, keys )
+
+	start_time = time.time()
+	ElementsHandler().apply_file(pbf_file, locations=True, idx=settings.pbf_location_index)
+	log('Read {} in {:,.2f} seconds'.format(pbf_file, time.time()-start_time))
+
+	# Tagged relations within the region: At least one member way intersecting it
+	for id_, (members, tags, keys) in relations.items():
+		ways = [ ref for type_, ref, _ in members if (type_ == 'w') and (ref in region_ways) ]
+		if not (ways):
+			continue
+		for key in keys:
+			for ref in ways:
+				_add_way(layers[key], ref, *region_ways[ref])
+			layers[key].add( {'type':'relation', 'id':id_, 'tags':tags,
+							  'members':[ {'type':{'n':'node','w':'way','r':'relation'}[type_], 'ref':ref, 'role':role} for type_, ref, role in members ]} )
+
+	return layers
+
+#######################################################################
+### GeoDataFrames and graphs
+#######################################################################
+
+def create_osm_features_gdfs_from_pbf(pbf_file, polygon=None, north=None, south=None, east=None, west=None, retain_invalid=False, network_type=None, infrastructure='way["highway"]', network_buffer=600):
+	"""
+	Get buildings, building parts, land use and POIs footprint data from a local .osm.pbf extract
+	The GeoDataFrames returned match the ones of `create_buildings_gdf`, `create_building_parts_gdf`, `create_landuse_gdf` and `create_pois_gdf`
+	If a street network type is given, the street network is read within the same pass and kept for the following `pbf_net_download` call over the region (e.g. its graph retrieval)
+
+	Parameters
+	----------
+	pbf_file : string
+		path to the .osm.pbf extract
+	polygon : shapely Polygon or MultiPolygon
+		geographic shape to fetch the footprints within
+	north : float
+		northern latitude of bounding box
+	south : float
+		southern latitude of bounding box
+	east : float
+		eastern longitude of bounding box
+	west : float
+		western longitude of bounding box
+	retain_invalid : bool
+		if False discard any footprints with an invalid geometry
+	network_type : string
+		street network type, as defined by osmnx (None: street network not read)
+	infrastructure : string
+		street network infrastructure selector
+	network_buffer : float
+		the street network is read within this distance in meters around the region (graphs are retrieved within a 500m buffer, see `graph_from_polygon`)
+
+	Returns
+	----------
+	[ GeoDataFrame, GeoDataFrame, GeoDataFrame, GeoDataFrame ]
+		buildings, building parts, land use and POIs
+	"""
+	if (network_type is not None):
+		network_polygon = _buffered_region( _get_region(polygon, north, south, east, west), network_buffer )
+		layers = read_pbf_elements(pbf_file, polygon, north, south, east, west, network_type=network_type, infrastructure=infrastructure, network_polygon=network_polygon)
+		_shared_networks[ (pbf_file, network_type, infrastructure) ] = ( network_polygon, layers.pop("network") )
+	else:
+		layers = read_pbf_elements(pbf_file, polygon, north, south, east, west)
+
+	df_osm_built = ways_to_gdf( layers[buildings_key] )
+	df_osm_building_parts = ways_to_gdf( layers[building_parts_key] )
+	df_osm_lu = ways_to_gdf( layers[landuse_key] )
+	df_osm_pois = nodes_to_gdf( layers["pois"] )
+
+	df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois = filter_features_gdfs(df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois, retain_invalid, polygon, north, south, east, west)
+
+	log('Read OSM features from {}: {:,} buildings, {:,} building parts, {:,} land use polygons and {:,} POIs'.format(pbf_file, len(df_osm_built), len(df_osm_building_parts), len(df_osm_lu), len(df_osm_pois)))
+	return df_osm_built, df_osm_building_parts, df_osm_lu, df_osm_pois
+
+def pbf_net_download(pbf_file, polygon=None, north=None, south=None, east=None, west=None, network_type='all_private', infrastructure='way["highway"]'):
+	"""
+	Read the street network ways and nodes of the region of interest from a local .osm.pbf extract
+	Returns them in the format of the Overpass API responses, as `osm_net_download` does
+	The street network read along with the features of an enclosing region is used instead of reading the extract again (see `create_osm_features_gdfs_from_pbf`)
+
+	Parameters
+	----------
+	pbf_file : string
+		path to the .osm.pbf extract
+	polygon : shapely Polygon or MultiPolygon
+		geographic shape to fetch the street network within
+	north : float
+		northern latitude of bounding box
+	south : float
+		southern latitude of bounding box
+	east : float
+		eastern longitude of bounding box
+	west : float
+		western longitude of bounding box
+	network_type : string
+		{'walk', 'bike', 'drive', 'drive_service', 'all', 'all_private'} what
+		type of street network to get
+	infrastructure : string
+		street network infrastructure selector
+
+	Returns
+	----------
+	response_jsons : list
+	"""
+	region_polygon = _get_region(polygon, north, south, east, west)
+	shared_polygon, network = _shared_networks.pop( (pbf_file, network_type, infrastructure), (None, None) )
+
+	if (network is not None) and shared_polygon.contains(region_polygon):
+		# Ways of the shared network intersecting the region
+		region = _Region(region_polygon)
+		ways = {}
+		for id_, (nodes, tags) in network.ways.items():
+			nodes = np.frombuffer(nodes, dtype=np.int64)
+			if region.intersects( network.coordinates( nodes[ network.contains_nodes(nodes) ] ) ):
+				ways[id_] = (nodes, tags)
+		ids = np.unique( np.concatenate( [ nodes for nodes, _ in ways.values() ] + [ np.zeros(0, dtype=np.int64) ] ) )
+		ids = ids[ network.contains_nodes(ids) ]
+		lon, lat = network.coordinates(ids).T
+	else:
+		network = read_pbf_elements(pbf_file, polygon, north, south, east, west, network_type=network_type, infrastructure=infrastructure)["network"]
+		ways = { id_:(np.frombuffer(nodes, dtype=np.int64), tags) for id_, (nodes, tags) in network.ways.items() }
+		ids, lon, lat = network.node_arrays()
+
+	elements = [ {'type':'node', 'id':id_, 'lon':x, 'lat':y} for id_, x, y in zip(ids.tolist(), lon.tolist(), lat.tolist()) ]
+	elements += [ {'type':'way', 'id':id_, 'nodes':nodes.tolist(), 'tags':tags} for id_, (nodes, tags) in ways.items() ]
+	return [ {'elements':elements} ]
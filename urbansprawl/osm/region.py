@@ -0,0 +1,151 @@
+###################################################################################################
+# Repository: https://github.com/lgervasoni/urbansprawl
+# MIT License
+###################################################################################################
+
+import osmnx as ox
+import threading
+from osmnx import log
+import logging as lg
+
+from .. import settings
+
+# Region filters of the Overpass polygon queries
+# Regions geocoded from a place are queried by their Overpass area: The server resolves them from its precomputed areas
+# Other polygons are simplified to a bounded number of vertices, with an outward buffer: The exact region is clipped client-side
+
+# Overpass area identifiers of the geocoded regions, by polygon (WKB)
+_place_areas = {}
+_place_areas_lock = threading.Lock()
+# Overpass area identifiers offset, by OSM element type
+_area_id_offset = { 'relation':3600000000, 'way':2400000000 }
+
+#######################################################################
+### Geocoded regions
+#######################################################################
+
+def geocode_place(place, which_result=1):
+	"""
+	Geocode a place to its boundary polygon, as `osmnx.gdf_from_place` does
+	The Overpass area identifier of the boundary is kept, to be used by the queries within the polygon
+
+	Parameters
+	----------
+	place : string or dict
+		query string or structured query dict to geocode/download
+	which_result : int
+		result number to retrieve from geocode/download when using query string
+
+	Returns
+	----------
+	geopandas.GeoDataFrame
+		place boundary
+	"""
+	poly_gdf = ox.gdf_from_place(place, which_result=which_result)
+	try:
+		# Same request as gdf_from_place: Served from the osmnx cache
+		result = ox.osm_polygon_download(place, limit=which_result, polygon_geojson=1)[which_result-1]
+		area_id = _area_id_offset[ result['osm_type'] ] + int( result['osm_id'] )
+	except Exception as e:
+		log("No Overpass area for place " + str(place) + ": " + str(e), level=lg.WARNING)
+	else:
+		with _place_areas_lock:
+			_place_areas[ poly_gdf.geometry.iloc[0].wkb ] = area_id
+	return poly_gdf
+
+def get_place_area_id(polygon):
+	"""
+	Get the Overpass area identifier of a polygon geocoded through `geocode_place`
+
+	Parameters
+	----------
+	polygon : shapely Polygon or MultiPolygon
+		region of interest
+
+	Returns
+	----------
+	int
+		area identifier (None if the polygon was not geocoded)
+	"""
+	with _place_areas_lock:
+		return _place_areas.get(polygon.wkb)
+
+#######################################################################
+### Query polygons simplification
+#######################################################################
+
+def _number_of_vertices(geometry):
+	"""
+	Number of exterior vertices of a Polygon or MultiPolygon
+	"""
+	polygons = geometry.geoms if hasattr(geometry, 'geoms') else [geometry]
+	return sum( len(polygon.exterior.coords) for polygon in polygons )
+
+def simplify_query_polygon(polygon, max_vertices=None, buffer_distance=None):
+	"""
+	Simplify a query polygon to a bounded number of vertices, while containing the input polygon
+	The polygon is buffered outwards then simplified with the same tolerance (simplification moves vertices by at most the tolerance)
+	The tolerance is doubled until the number of vertices is within bounds
+
+	Parameters
+	----------
+	polygon : shapely Polygon or MultiPolygon
+		query polygon, in latitude-longitude coordinates
+	max_vertices : int
+		maximum number of exterior vertices (default: `settings.overpass_polygon_max_vertices`)
+	buffer_distance : float
+		initial tolerance, in meters (default: `settings.overpass_polygon_buffer`)
+
+	Returns
+	----------
+	shapely Polygon or MultiPolygon
+		simplified polygon, containing the input one, in latitude-longitude coordinates
+	"""
+	if (max_vertices is None):
+		max_vertices = settings.overpass_polygon_max_vertices
+	if (buffer_distance is None):
+		buffer_distance = settings.overpass_polygon_buffer
+	if ( _number_of_vertices(polygon) <= max_vertices ):
+		return polygon
+
+	polygon_proj, crs_proj = ox.project_geometry(polygon)
+	tolerance = buffer_distance
+	simplified = polygon_proj.buffer(tolerance).simplify(tolerance)
+	while ( _number_of_vertices(simplified) > max_vertices ):
+		tolerance *= 2
+		simplified = polygon_proj.buffer(tolerance).simplify(tolerance)
+	log('Query polygon simplified from {:,} to {:,} vertices ({:,.0f} meters tolerance)'.format(_number_of_vertices(polygon), _number_of_vertices(simplified), tolerance))
+
+	simplified, _ = ox.project_geometry(simplified, crs=crs_proj, to_latlong=True)
+	return simplified
+
+def get_query_regions(polygon, geometry, date=""):
+	"""
+	Get the Overpass region filter of each sub-polygon of a polygon query
+	The Overpass area of a geocoded polygon is used if the polygon was not subdivided (areas are not available for queries at a past date)
+	Otherwise, each sub-polygon is simplified (see `simplify_query_polygon`)
+
+	Parameters
+	----------
+	polygon : shapely Polygon or MultiPolygon
+		region of interest, in latitude-longitude coordinates
+	geometry : shapely MultiPolygon
+		consolidated and subdivided region of interest, in latitude-longitude coordinates
+	date : string
+		query date setting
+
+	Returns
+	----------
+	list
+		region filters, e.g. '(area:3600007444)' or '(poly:"lat lon lat lon ...")'
+	"""
+	area_id = get_place_area_id(polygon)
+	sub_polygons = list( geometry.geoms if hasattr(geometry, 'geoms') else [geometry] )
+	if ( (area_id is not None) and (not date) and (len(sub_polygons) == 1) ):
+		return [ '(area:{})'.format(area_id) ]
+
+	regions = []
+	for sub_polygon in sub_polygons:
+		for polygon_coord_str in ox.get_polygons_coordinates( simplify_query_polygon(sub_polygon) ):
+			regions.append( '(poly:"{}")'.format(polygon_coord_str) )
+	return regions
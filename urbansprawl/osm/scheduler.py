@@ -0,0 +1,179 @@
+###################################################################################################
+# Repository: https://github.com/lgervasoni/urbansprawl
+# MIT License
+###################################################################################################
+
+import time
+import random
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from osmnx import log
+import logging as lg
+
+from .cache import OverpassResourceError
+from .split import split_query, is_learned_split, learn_split
+from .. import settings
+
+#######################################################################
+### Rate limiting
+#######################################################################
+
+class TokenBucket():
+	"""
+	Thread-safe token bucket rate limiter
+	Tokens are refilled at `rate` per second, up to `capacity`. Each request consumes one token
+
+	Parameters
+	----------
+	rate : float
+		tokens refilled per second
+	capacity : int
+		maximum number of tokens (burst size)
+	"""
+	def __init__(self, rate, capacity):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.last_refill = time.monotonic()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		"""
+		Consume a token, waiting until one is available
+		"""
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min( self.capacity, self.tokens + (now - self.last_refill) * self.rate )
+				self.last_refill = now
+				if (self.tokens >= 1):
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
+
+# Limiter shared by all the Overpass sub-queries of the process
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+	"""
+	Get the token bucket shared by all the Overpass sub-queries, created from the current settings
+
+	Returns
+	----------
+	TokenBucket
+		shared rate limiter
+	"""
+	global _rate_limiter
+	with _rate_limiter_lock:
+		if (_rate_limiter is None) or (_rate_limiter.rate, _rate_limiter.capacity) != (settings.overpass_requests_per_second, settings.overpass_burst):
+			_rate_limiter = TokenBucket(settings.overpass_requests_per_second, settings.overpass_burst)
+		return _rate_limiter
+
+#######################################################################
+### Tile scheduler
+#######################################################################
+
+def _is_resource_error(e):
+	"""
+	Check whether a failed sub-query was aborted for lack of resources (server runtime error, or client read timeout)
+	"""
+	return isinstance(e, (OverpassResourceError, requests.exceptions.Timeout))
+
+def _run_split_query(request, sub_queries, label, description, merge, depth):
+	"""
+	Send the sub-queries of a split query, and merge their results
+	"""
+	return merge( [ _run_tile_query(request, sub_query, '{}.{}'.format(label, quadrant+1), description, merge, depth+1) for quadrant, sub_query in enumerate(sub_queries) ] )
+
+def _run_tile_query(request, query_str, label, description, merge=None, depth=0):
+	"""
+	Send the sub-query of a tile, retrying with exponential backoff on failure
+	If a `merge` function is given, queries aborted for lack of resources are split into quadrants, recursively (see `split.py`)
+	"""
+	can_split = (merge is not None) and (depth < settings.overpass_max_split_depth)
+	if ( can_split ) and ( is_learned_split(query_str) ):
+		sub_queries = split_query(query_str)
+		if (sub_queries):
+			return _run_split_query(request, sub_queries, label, description, merge, depth)
+
+	max_retries = settings.overpass_max_retries
+	for attempt in range(max_retries + 1):
+		get_rate_limiter().acquire()
+		start_time = time.time()
+		try:
+			result = request(query_str)
+		except Exception as e:
+			sub_queries = split_query(query_str) if ( can_split and _is_resource_error(e) ) else None
+			if (sub_queries):
+				log('Tile {} of {} aborted for lack of resources ({}). Splitting it into {} sub-queries'.format(label, description, e, len(sub_queries)), level=lg.WARNING)
+				learn_split(query_str)
+				return _run_split_query(request, sub_queries, label, description, merge, depth)
+			if (attempt == max_retries):
+				log('Tile {} of {} failed after {} attempt(s): {}'.format(label, description, attempt+1, e), level=lg.ERROR)
+				raise
+			backoff = settings.overpass_retry_backoff * 2**attempt * random.uniform(1, 1.5)
+			log('Tile {} of {} failed ({}). Retrying in {:,.1f} seconds'.format(label, description, e, backoff), level=lg.WARNING)
+			time.sleep(backoff)
+			continue
+		log('Tile {} of {} retrieved in {:,.2f} seconds'.format(label, description, time.time()-start_time))
+		return result
+
+def run_tile_queries(query_strs, request, description='data', max_workers=None, consume=None, merge=None):
+	"""
+	Send the sub-queries of a subdivided region in parallel, under the shared rate limit
+	Failed sub-queries are retried with exponential backoff (`settings.overpass_max_retries`, `settings.overpass_retry_backoff`)
+	If a `consume` function is given, each result is handed to a parser worker as soon as its sub-query completes: Results are processed while the remaining tiles download
+	If a `merge` function is given, sub-queries aborted by the server for lack of resources are split into quadrants, recursively up to `settings.overpass_max_split_depth`
+
+	Parameters
+	----------
+	query_strs : list
+		Overpass QL query of each tile
+	request : function
+		sends a query string, returns its result
+	description : string
+		retrieved data, for logging purposes
+	max_workers : int
+		maximum number of concurrent sub-queries (default: `settings.overpass_max_workers`)
+		requests in flight remain bounded by the request slots shared by all the queries (see `endpoints.get_request_slots`)
+	consume : function
+		processes the result of a tile (e.g. assembles its partial GeoDataFrame), returns the processed result
+	merge : function
+		merges the list of results of a split sub-query into a single result
+
+	Returns
+	----------
+	list
+		result of each tile (processed, if `consume` is given), in the order of the input queries
+	"""
+	if (max_workers is None):
+		max_workers = settings.overpass_max_workers
+	max_workers = max( 1, min(max_workers, len(query_strs)) )
+
+	log('Requesting {} from API in {:,} request(s) using {} worker(s)'.format(description, len(query_strs), max_workers))
+	start_time = time.time()
+
+	if (consume is not None):
+		# Producer-consumer pipeline: Downloading workers, and a single parser worker fed in completion order
+		with ThreadPoolExecutor(max_workers=max_workers) as executor, ThreadPoolExecutor(max_workers=1) as parser:
+			futures = { executor.submit(_run_tile_query, request, query_str, '{}/{}'.format(tile+1, len(query_strs)), description, merge):tile for tile, query_str in enumerate(query_strs) }
+			parsed = [None] * len(query_strs)
+			for future in as_completed(futures):
+				parsed[ futures[future] ] = parser.submit(consume, future.result())
+			log('Got all {} from API in {:,} request(s) and {:,.2f} seconds'.format(description, len(query_strs), time.time()-start_time))
+			results = [ future.result() for future in parsed ]
+		log('Processed all {} in {:,.2f} seconds'.format(description, time.time()-start_time))
+		return results
+
+	if (max_workers == 1):
+		results = [ _run_tile_query(request, query_str, '{}/{}'.format(tile+1, len(query_strs)), description, merge) for tile, query_str in enumerate(query_strs) ]
+	else:
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			futures = [ executor.submit(_run_tile_query, request, query_str, '{}/{}'.format(tile+1, len(query_strs)), description, merge) for tile, query_str in enumerate(query_strs) ]
+			results = [ future.result() for future in futures ]
+
+	log('Got all {} from API in {:,} request(s) and {:,.2f} seconds'.format(description, len(query_strs), time.time()-start_time))
+	return results
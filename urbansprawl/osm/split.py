@@ -0,0 +1,164 @@
+###################################################################################################
+# Repository: https://github.com/lgervasoni/urbansprawl
+# MIT License
+###################################################################################################
+
+import os
+import re
+import json
+import threading
+from shapely.geometry import Polygon
+from shapely.geometry import box
+from osmnx import log
+import logging as lg
+
+from .cache import get_cache_key
+from .. import settings
+
+# Adaptive splitting of the Overpass sub-queries the server aborts for lack of resources (query timed out, or run out of memory)
+# The region filter of the query, a bounding box or a polygon, is split into quadrants, each one queried separately (recursively)
+# Split queries are learned (`settings.overpass_split_file`): Later runs split them upfront, without sending the failing query first
+
+# Region filters of a query
+_bbox_filter = re.compile(r'\((-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)\)')
+_poly_filter = re.compile(r'\(poly:"([^"]*)"\)')
+# Date setting of a query: Dense regions are split whatever the date
+_query_date = re.compile(r'\[date:\s*["\'][^"\']+["\']\s*\]')
+
+# Learned split queries (cache keys), loaded on first use
+_learned_splits = None
+_learned_splits_lock = threading.Lock()
+
+#######################################################################
+### Region filters splitting
+#######################################################################
+
+def _quadrants(west, south, east, north):
+	"""
+	Split a bounding box into its four quadrants, as (west, south, east, north) tuples
+	"""
+	lon, lat = (west + east) / 2., (south + north) / 2.
+	return [ (west, south, lon, lat), (lon, south, east, lat), (west, lat, lon, north), (lon, lat, east, north) ]
+
+def _split_bbox_filter(query_str):
+	"""
+	Sub-queries of a query restricted to a bounding box: One per quadrant
+	"""
+	south, west, north, east = [ float(coord) for coord in _bbox_filter.search(query_str).groups() ]
+	sub_queries = []
+	for q_west, q_south, q_east, q_north in _quadrants(west, south, east, north):
+		bbox_str = '({:.8f},{:.8f},{:.8f},{:.8f})'.format(q_south, q_west, q_north, q_east)
+		sub_queries.append( _bbox_filter.sub(bbox_str, query_str) )
+	return sub_queries
+
+def _split_poly_filter(query_str, poly_str):
+	"""
+	Sub-queries of a query restricted to a polygon: One per polygon of the intersection with each quadrant of its bounding box
+	"""
+	coords = [ float(coord) for coord in poly_str.split() ]
+	polygon = Polygon( list( zip(coords[1::2], coords[0::2]) ) )
+	if (not polygon.is_valid):
+		polygon = polygon.buffer(0)
+	sub_queries = []
+	for quadrant in _quadrants(*polygon.bounds):
+		piece = polygon.intersection( box(*quadrant) )
+		for part in getattr(piece, 'geoms', [piece]):
+			if ( part.geom_type != 'Polygon' ) or (part.is_empty) or (part.area == 0):
+				continue
+			part_str = '(poly:"{}")'.format( ' '.join( '{:.6f} {:.6f}'.format(lat, lon) for lon, lat in part.exterior.coords[:-1] ) )
+			sub_queries.append( _poly_filter.sub(lambda m: part_str, query_str) )
+	return sub_queries
+
+def split_query(query_str):
+	"""
+	Split a query restricted to a bounding box or a polygon into the queries of its quadrants
+	Queries restricted to an Overpass area, or to several distinct regions, can not be split
+
+	Parameters
+	----------
+	query_str : string
+		Overpass QL query
+
+	Returns
+	----------
+	list
+		sub-queries (None if the query can not be split)
+	"""
+	bbox_strs = set( _bbox_filter.findall(query_str) )
+	poly_strs = list( set( _poly_filter.findall(query_str) ) )
+	if ( len(bbox_strs) == 1 ) and ( len(poly_strs) == 0 ):
+		return _split_bbox_filter(query_str)
+	if ( len(poly_strs) == 1 ) and ( len(bbox_strs) == 0 ):
+		return _split_poly_filter(query_str, poly_strs[0]) or None
+	return None
+
+#######################################################################
+### Learned splits
+#######################################################################
+
+def _split_key(query_str):
+	"""
+	Key of a query in the learned splits, regardless of its date
+	"""
+	return get_cache_key( _query_date.sub('', query_str) )
+
+def _get_learned_splits():
+	"""
+	Load the learned split queries (to be called holding the lock)
+	"""
+	global _learned_splits
+	if (_learned_splits is None):
+		_learned_splits = set()
+		if ( settings.overpass_split_file is not None ) and ( os.path.exists(settings.overpass_split_file) ):
+			try:
+				with open(settings.overpass_split_file, 'r') as f:
+					_learned_splits = set( json.load(f) )
+			except Exception as e:
+				log('Could not load learned Overpass splits: ' + str(e), level=lg.WARNING)
+	return _learned_splits
+
+def is_learned_split(query_str):
+	"""
+	Check whether a query was previously aborted by the server for lack of resources
+
+	Parameters
+	----------
+	query_str : string
+		Overpass QL query
+
+	Returns
+	----------
+	bool
+		True if the query is to be split upfront
+	"""
+	with _learned_splits_lock:
+		return _split_key(query_str) in _get_learned_splits()
+
+def learn_split(query_str):
+	"""
+	Record a query aborted by the server for lack of resources, to be split upfront by later runs
+
+	Parameters
+	----------
+	query_str : string
+		Overpass QL query
+
+	Returns
+	----------
+
+	"""
+	with _learned_splits_lock:
+		learned_splits = _get_learned_splits()
+		learned_splits.add( _split_key(query_str) )
+		if (settings.overpass_split_file is None):
+			return
+		try:
+			folder = os.path.dirname(settings.overpass_split_file)
+			if ( folder ) and ( not os.path.exists(folder) ):
+				os.makedirs(folder)
+			temporary_filename = settings.overpass_split_file + '.tmp'
+			with open(temporary_filename, 'w') as f:
+				json.dump( sorted(learned_splits), f )
+			os.replace(temporary_filename, settings.overpass_split_file)
+		except Exception as e:
+			log('Could not store learned Overpass splits: ' + str(e), level=lg.WARNING)
@@ -7,171 +7,194 @@ import osmnx as ox
 import pandas as pd
 import geopandas as gpd
 import numpy as np
-from shapely.geometry import Polygon
 
 from osmnx import log
 
 from .tags import height_tags, activity_classification
-from .classification import aggregate_classification
+from .utils import landuses_m2_keys, landuses_m2_column
 
 ############################################
 ### Land uses surface association
 ############################################
 
-def get_composed_classification(building, df_pois):
-	""" 
-	Retrieve the composed classification given the building's containing Points of Interest
+# Activity categories, and their bit in the categories masks
+_activity_categories = list( activity_classification.keys() )
+_category_bit = { category:1 << i for i, category in enumerate(_activity_categories) }
 
-	Parameters
-	----------
-	building : geopandas.GeoSeries
-		input building
-	df_pois : geopandas.GeoDataFrame
-		Points of Interest contained in the building
+def _categories_mask(activity_categories):
+	""" 
+	Bit mask of the activity categories of each row (-1 if not a list)
+	"""
+	mask = np.zeros( len(activity_categories), dtype=np.int64 )
+	for i, categories in enumerate(activity_categories):
+		if isinstance(categories, list):
+			for category in categories:
+				mask[i] |= _category_bit[category]
+		else:
+			mask[i] = -1
+	return mask
 
-	Returns
-	----------
-	geopandas.GeoSeries
-		returns a composed classification building
+def _aggregate_classifications(has):
+	""" 
+	Aggregated classification of each row, given whether each classification is found among its classifications (see `aggregate_classification`)
 	"""
-	# POIs aggregated classification
-	pois_classification = aggregate_classification( df_pois.classification.values )
-	# Composed building-POIs classification
-	composed_classification = aggregate_classification( [building.classification, pois_classification] )
-	# Composed activity categories
-	try:
-		composed_activity_category = list( set( [element for list_ in df_pois.activity_category for element in list_] + building.activity_category ) )
-	except: # df_pois.activity_category.isnull().all() Returns True
-		composed_activity_category = building.activity_category
-	# Create a Series for a new row with composed classification
-	composed_row = pd.Series( [building.geometry,composed_classification,composed_activity_category,building.building_levels], index=["geometry","classification","activity_category","building_levels"])
-	return composed_row
-
-def sum_landuses(x, landuses_m2, default_classification = None, mixed_building_first_floor_activity=True):
+	classification = np.full( len(has["activity"]), None, dtype=object )
+	# Lowest precedence first
+	classification[ has["infer"] ] = "infer"
+	classification[ has["residential"] ] = "residential"
+	classification[ has["activity"] ] = "activity"
+	classification[ has["mixed"] | ( has["activity"] & has["residential"] ) ] = "mixed"
+	classification[ has["other"] ] = None
+	return classification
+
+def _composed_classification(df_osm_built, df_osm_pois, pois_indptr, pois_indices):
 	""" 
-	Associate to each land use its correspondent surface use for input building
+	Composed classification and activity categories mask of each building, given its containing Points of Interest (see `aggregate_classification`)
+	"""
+	owner = np.repeat( np.arange( len(df_osm_built) ), np.diff(pois_indptr) )
+	built_classification = df_osm_built.classification.values
+	pois_classification = df_osm_pois.classification.values[pois_indices]
+
+	# POIs aggregated classification, then composed building-POIs classification
+	has_pois = { name:np.bincount( owner, weights=(pois_classification == name), minlength=len(df_osm_built) ) > 0 for name in ["other", "activity", "residential", "mixed", "infer"] }
+	aggregated_pois = _aggregate_classifications(has_pois)
+	composed = _aggregate_classifications( { name:(built_classification == name) | (aggregated_pois == name) for name in has_pois } )
+
+	# Composed activity categories: The building's only if any of them is not a list
+	built_mask = _categories_mask(df_osm_built.activity_category.values)
+	pois_mask = _categories_mask(df_osm_pois.activity_category.values)[pois_indices]
+	pois_invalid = np.bincount( owner, weights=(pois_mask < 0), minlength=len(df_osm_built) ) > 0
+	pois_union = np.zeros( len(df_osm_built), dtype=np.int64 )
+	for bit in _category_bit.values():
+		pois_union |= np.where( np.bincount( owner, weights=( (pois_mask >= 0) & (pois_mask & bit > 0) ), minlength=len(df_osm_built) ) > 0, bit, 0 )
+	composed_mask = np.where( pois_invalid | (built_mask < 0), built_mask, built_mask | pois_union )
+	return composed, composed_mask
+
+def _min_level_difference(df_osm_built, df_osm_building_parts, parts_indptr, parts_indices):
+	""" 
+	Buildings geometry, removing the building parts starting from a specific level or height: Avoid duplicating first level surface
+	The building parts are merged per building with a grouped cascaded union, then removed from all the footprints at once
+	"""
+	geometries = gpd.GeoSeries( df_osm_built.geometry.values, crs=df_osm_built.crs )
+	tagged = min_level_tagged(df_osm_building_parts)
+
+	# Building parts with a min. level associated, and their building
+	parts_owner = np.repeat( np.arange( len(df_osm_built) ), np.diff(parts_indptr) )
+	is_tagged = tagged[parts_indices]
+	if not ( is_tagged.any() ):
+		return geometries
+	df_parts = gpd.GeoDataFrame( { "owner":parts_owner[is_tagged], "geometry":df_osm_building_parts.geometry.values[ parts_indices[is_tagged] ] }, crs=df_osm_built.crs )
+
+	# Union of the building parts of each building
+	unions = df_parts.dissolve(by="owner").geometry
+	owners = unions.index.values
+	geometries.iloc[owners] = geometries.iloc[owners].reset_index(drop=True).difference( unions.reset_index(drop=True) ).values
+	return geometries
+
+def sum_landuses(owner, number_owners, area, levels, classification, categories_mask, mixed_building_first_floor_activity=True):
+	""" 
+	Sum, for each owner building, the surface associated to each land use of the input structures
 	Mixed-uses building Option 1:
 		First floor: Activity use
 		Rest: residential use
 	Mixed-uses building Option 2:
 		Half used for Activity uses, the other half Residential use
-
+	Structures are accumulated in input order for each building
 
 	Parameters
 	----------
-	x : geopandas.GeoSeries
-		input building
-	landuses_m2 : dict
-		squared meter surface associated to each land use
-	default_classification : pandas.Series
-		main building land use classification and included activity types
+	owner : np.array
+		owner building position of each structure
+	number_owners : int
+		number of buildings
+	area : np.array
+		surface of each structure (0 for empty geometries)
+	levels : np.array
+		number of levels of each structure
+	classification : np.array
+		land use classification of each structure
+	categories_mask : np.array
+		activity categories mask of each structure
 	mixed_building_first_floor_activity : Boolean
 		if True: Associates building's first floor to activity uses and the rest to residential uses
 		if False: Associates half of the building's area to each land use (Activity and Residential)
 
 	Returns
 	----------
+	dict
+		total surface associated to each land use key, per building
+	"""
+	categories_mask = np.maximum(categories_mask, 0)
+	number_categories = sum( ( categories_mask & bit > 0 ).astype(int) for bit in _category_bit.values() )
+	number_categories = np.where(number_categories > 0, number_categories, 1)
+
+	is_activity = (classification == "activity")
+	is_residential = (classification == "residential")
+	# Mixed building assumption: First level for activity uses, the rest residential use
+	first_floor = (classification == "mixed") & (levels > 1) & mixed_building_first_floor_activity
+	half = (classification == "mixed") & ~ first_floor
+
+	residential = np.select( [first_floor, half, is_residential], [ area * (levels - 1), area * levels / 2., area * levels ], 0. )
+	activity = np.select( [is_activity, first_floor, half], [ area * levels, area, area * levels / 2. ], 0. )
+	area_per_activity_category = np.select( [is_activity, first_floor, half], [ area * levels / number_categories, area, ( area * levels / 2. ) / number_categories ], 0. )
+
+	landuses_m2 = { "activity":np.bincount(owner, weights=activity, minlength=number_owners), "residential":np.bincount(owner, weights=residential, minlength=number_owners) }
+	for activity_type, bit in _category_bit.items():
+		landuses_m2[activity_type] = np.bincount( owner, weights=np.where( categories_mask & bit > 0, area_per_activity_category, 0. ), minlength=number_owners )
+	return landuses_m2
+
+def height_tags_values(df_osm, tag):
+	""" 
+	Numeric values of a height tag, NaN if not available
+	Height tags given as a dict per row (`height_tags` column, as stored by earlier versions) are read as well
 
+	Parameters
+	----------
+	df_osm : geopandas.GeoDataFrame
+		input data frame
+	tag : string
+		height tag
+
+	Returns
+	----------
+	np.array
+		tag values
 	"""
-	# Empty
-	if ( not x.get("geometry")): return
-	# Mixed building assumption: First level for activity uses, the rest residential use	
-	if (x["classification"] is "activity"): # Sum activity use
-		landuses_m2["activity"] += x["geometry"].area * x["building_levels"]
-		# Sum activity category m2
-		area_per_activity_category = x["geometry"].area * x["building_levels"] / len( x["activity_category"] )
-		for activity_type in x["activity_category"]:
-			landuses_m2[activity_type] += area_per_activity_category		
-	elif (x["classification"] is "mixed"): # Sum activity and residential use
-
-		if (x["building_levels"] > 1) and (mixed_building_first_floor_activity): # More than one level
-			# First floor
-			landuses_m2["residential"] += x["geometry"].area * ( x["building_levels"] - 1 )
-			# Rest of the building
-			landuses_m2["activity"] += x["geometry"].area
-			area_per_activity_category = x["geometry"].area
-		
-		else: # One level building
-			landuses_m2["residential"] += x["geometry"].area * x["building_levels"] / 2.
-			landuses_m2["activity"] += x["geometry"].area * x["building_levels"] / 2.
-			area_per_activity_category = ( x["geometry"].area * x["building_levels"] / 2. ) / len( x["activity_category"] )
-		
-		# Sum activity category m2		
-		for activity_type in x["activity_category"]:
-			landuses_m2[activity_type] += area_per_activity_category			
-	elif (x["classification"] == "residential"): # Sum residential use
-		landuses_m2["residential"] += x["geometry"].area * x["building_levels"]
-	else: 
-		# Row does not contain a classification, use given default classification creating a new dict
-		dict_x = {"classification":default_classification.classification, "geometry":x.geometry, "building_levels":x.building_levels, "activity_category":default_classification.activity_category}
-		# Recursive call
-		sum_landuses(dict_x, landuses_m2, mixed_building_first_floor_activity=mixed_building_first_floor_activity)
-
-
-def calculate_landuse_m2(building, mixed_building_first_floor_activity=True):
+	if (tag in df_osm.columns):
+		values = pd.to_numeric(df_osm[tag], errors='coerce').values.astype(float)
+	else:
+		values = np.full( len(df_osm), np.nan )
+	if ("height_tags" in df_osm.columns):
+		dict_values = pd.to_numeric( df_osm.height_tags.apply(lambda x: x.get(tag) if isinstance(x, dict) else np.nan), errors='coerce' ).values.astype(float)
+		values = np.where( np.isnan(values), dict_values, values )
+	return values
+
+def min_level_tagged(df_osm):
 	""" 
-	Calculate the total squared meters associated to residential and activity uses for input building
-	In addition, surface usage for each activity types is performed
+	Buildings (or building parts) starting from a specific level or height
 
 	Parameters
 	----------
-	building : geopandas.GeoSeries
-		input building
-	mixed_building_first_floor_activity : Boolean
-		if True: Associates building's first floor to activity uses and the rest to residential uses
-		if False: Associates half of the building's area to each land use (Activity and Residential)
+	df_osm : geopandas.GeoDataFrame
+		input data frame
 
 	Returns
 	----------
-	dict
-		contains the total associated surface to each land use key
+	np.array
+		boolean mask
 	"""
-	# Initialize
-	landuse_m2 = {}
-	landuse_m2["activity"] = 0
-	landuse_m2["residential"] = 0
-	for activity_type in list( activity_classification.keys() ):
-		landuse_m2[activity_type] = 0
-	
-	# Get the composed classification from input building + containing POIs
-	building_composed_classification = get_composed_classification(building, building.pois_full_parts)
-	
-	def no_min_level_geometry(building_parts):
-		"""
-		Returns building parts with no min. level associated
-		"""
-		def no_min_level_tag(x): # Buildings starts from a specific num level?
-			if ( x.get("building:min_level") or x.get("min_level") or x.get("building:min_height") or x.get("min_height") ):
-				return True
-			else:
-				return False
-		# Get the geometries of the contained buildings with no height/level tags available
-		geometries = building_parts.loc[ building_parts.height_tags.apply(lambda x: no_min_level_tag(x) ) ].geometry
-		
-		# Create the union of those geometries
-		no_min_level_geom = Polygon()
-		for shape in geometries.values:
-			no_min_level_geom = no_min_level_geom.union(shape)
-
-		# Return the final shape
-		return no_min_level_geom
-	
-	# Remove from the main building geometry, those building parts geometries that do not contain a minimum level/height: Avoid duplicating first level surface
-	building_composed_classification.geometry = building_composed_classification.geometry.difference( no_min_level_geometry(building.full_parts) )
-
-	# Sum land uses for main building
-	sum_landuses(building_composed_classification, landuse_m2, mixed_building_first_floor_activity=mixed_building_first_floor_activity)
-	
-	# Sum land uses for building parts. If no classification given, use the building's land use
-	building.full_parts.apply(lambda x: sum_landuses(x, landuse_m2, building_composed_classification[["classification","activity_category"]], mixed_building_first_floor_activity=mixed_building_first_floor_activity), axis=1)
-	
-	return landuse_m2
+	tagged = np.zeros( len(df_osm), dtype=bool )
+	for tag in ["building:min_level", "min_level", "building:min_height", "min_height"]:
+		values = height_tags_values(df_osm, tag)
+		tagged |= ~ np.isnan(values) & (values != 0)
+	return tagged
 
 def associate_levels(df_osm, default_height, meters_per_level):
 	""" 
 	Calculate the effective number of levels for each input building
 	Under missing tag data, default values are used
 	A column ['building_levels'] is added to the data frame
+	Levels are computed for all buildings at once, from the numeric height tags columns
 
 	Parameters
 	----------
@@ -186,87 +209,33 @@ def associate_levels(df_osm, default_height, meters_per_level):
 	----------
 
 	"""
-	def levels_from_height(height, meters_per_level):
-		"""
-		Returns estimated number of levels given input height (meters)
+	def levels_from_height(height):
 		"""
-		levels = abs( round( height / meters_per_level ) )
-		if (levels >= 1):
-			return levels
-		else: # By default: 1 level
-			assert( height > 0 )
-			return 1
-
-	def associate_level(x):
+		Returns estimated number of levels given input height (meters). By default: 1 level
+		NaN for non-positive heights below one level
 		"""
-		Associates the number of levels to input building given its height tags information
-		Returns the absolute value in order to consider the cases of underground levels
-		"""
-		
-		# No height tags available
-		if not ( type(x) == dict ): 
-			# Default values
-			number_levels = levels_from_height(default_height, meters_per_level)
-			return number_levels
-
-		# Buildings starts from a specific num level?
-		if ( x.get("building:min_level") ): # building:min_level
-			min_level = x["building:min_level"]
-		elif ( x.get("min_level") ): # min_level
-			min_level = x["min_level"]
-		######################### Height based
-		elif ( x.get("building:min_height") ): # min_level
-			min_level = levels_from_height( x["building:min_height"], meters_per_level )
-		elif ( x.get("min_height") ): # min_level
-			min_level = levels_from_height( x["min_height"], meters_per_level )
-		else:
-			min_level = 0
-
-		######################### Levels based
-		if ( x.get("building:levels") ): # Number of building:levels given
-			number_levels = abs( x["building:levels"] - min_level )
-		elif ( x.get("levels") ): # Number of levels given
-			number_levels = abs( x["levels"] - min_level )
-		######################### Height based
-		elif ( x.get("building:height") ): # building:height given
-			number_levels = abs( levels_from_height( x["building:height"], meters_per_level ) - min_level )
-		elif ( x.get("height") ): # height given
-			number_levels = abs( levels_from_height( x["height"], meters_per_level ) - min_level )
-		else: # No information given
-			number_levels = levels_from_height(default_height, meters_per_level)
-
-		assert( number_levels >= 0 )
-		if (number_levels == 0): # By default at least 1 level 
-			number_levels = 1
-		return number_levels
-
-	df_osm["building_levels"] = df_osm.height_tags.apply( lambda x: associate_level(x) )
-
-def classification_sanity_check(building):
-	"""
-	Performs a sanity check in order to achieve coherence between the building's classification and the amount of M^2 associated to each land use
-	Example: A building's classification could be 'residential', but contains its building parts (occupying 100% of the area, then all land uses M^2 associated to this land use) contain an acitivty use
-	This would impose a problem of coherence between the classification and its surface land use
+		levels = np.abs( np.round( height / meters_per_level ) )
+		return np.where( levels >= 1, levels, np.where( height > 0, 1, np.nan ) )
 
-	Parameters
-	----------
-	building : geopandas.GeoSeries
-		one row denoting the building's information
+	# Tag values, and whether each one is given (non-null, non-zero)
+	tags = { tag:height_tags_values(df_osm, tag) for tag in height_tags }
+	given = { tag:( ~ np.isnan(values) & (values != 0) ) for tag, values in tags.items() }
 
-	Returns
-	----------
-	string
-		returns the coherent classification
-	"""
-	if ( building.landuses_m2["residential"] > 0 ):
-		if ( building.landuses_m2["activity"] > 0 ): # Mixed use
-			return "mixed" 
-		else: # Residential use
-			return "residential"
-	else: # Activity use
-		return "activity"
-
-def compute_landuses_m2(df_osm_built, df_osm_building_parts, df_osm_pois, default_height=6, meters_per_level=3, mixed_building_first_floor_activity=True):
+	# Buildings starts from a specific num level? Levels, then height based
+	min_level = np.select( [ given["building:min_level"], given["min_level"], given["building:min_height"], given["min_height"] ],
+						  [ tags["building:min_level"], tags["min_level"], levels_from_height(tags["building:min_height"]), levels_from_height(tags["min_height"]) ], default=0 )
+	assert( not np.isnan(min_level).any() )
+
+	# Number of levels: Levels, then height based. Otherwise, default values
+	number_levels = np.select( [ given["building:levels"], given["levels"], given["building:height"], given["height"] ],
+							  [ np.abs( tags["building:levels"] - min_level ), np.abs( tags["levels"] - min_level ), np.abs( levels_from_height(tags["building:height"]) - min_level ), np.abs( levels_from_height(tags["height"]) - min_level ) ],
+							  default=levels_from_height( np.float64(default_height) ) )
+	assert( not np.isnan(number_levels).any() )
+
+	# Returns the absolute value in order to consider the cases of underground levels. By default at least 1 level
+	df_osm["building_levels"] = np.where( number_levels == 0, 1, number_levels )
+
+def compute_landuses_m2(df_osm_built, df_osm_building_parts, df_osm_pois, containing_parts, containing_poi, default_height=6, meters_per_level=3, mixed_building_first_floor_activity=True):
 	"""
 	Determine the effective number of levels per building or building parts
 	Calculate the amount of squared meters associated to residential and activity uses per building
@@ -280,6 +249,10 @@ def compute_landuses_m2(df_osm_built, df_osm_building_parts, df_osm_pois, defaul
 		OSM building parts
 	df_osm_pois : geopandas.GeoDataFrame
 		OSM Points of interest
+	containing_parts : [ np.array, np.array ]
+		building parts of each building, in CSR form (see `associate_structures`)
+	containing_poi : [ np.array, np.array ]
+		Points of interest of each building, in CSR form (see `associate_structures`)
 	default_height : float
 		default building height in meters
 	meters_per_level : float
@@ -299,21 +272,38 @@ def compute_landuses_m2(df_osm_built, df_osm_building_parts, df_osm_pois, defaul
 	##################
 	# Calculate for each building, the M^2 associated to each land usage considering building parts (area calculated given UTM coordinates projection assumption)
 	##################
-	
-	# Associate the complete data frame of containing building parts
-	col_interest = ["geometry","activity_category", "classification", "key_value", "height_tags", "building_levels"]
-	df_osm_built["full_parts"] = df_osm_built.containing_parts.apply(lambda x: df_osm_building_parts.loc[x, col_interest ] if isinstance(x, list) else df_osm_building_parts.loc[ [], col_interest ] )
-	
-	# Associate the complete POIs contained in buildings
-	col_interest = ["geometry","activity_category", "classification", "key_value"]
-	df_osm_built["pois_full_parts"] = df_osm_built.containing_poi.apply(lambda x: df_osm_pois.loc[x, col_interest] if isinstance(x, list) else df_osm_pois.loc[ [], col_interest] )
-
-	# Calculate m2's for each land use, plus for each activity category
-	df_osm_built["landuses_m2"] = df_osm_built.apply(lambda x: calculate_landuse_m2(x, mixed_building_first_floor_activity=mixed_building_first_floor_activity), axis=1 )
-
-	# Drop added full parts
-	df_osm_built.drop( ["full_parts"], axis=1, inplace=True )
-	df_osm_built.drop( ["pois_full_parts"], axis=1, inplace=True )
+	parts_indptr, parts_indices = containing_parts
+	pois_indptr, pois_indices = containing_poi
+	number_buildings = len(df_osm_built)
+
+	# Composed classification given building + containing POIs, and building geometry without the parts starting from a specific level
+	composed, composed_mask = _composed_classification(df_osm_built, df_osm_pois, pois_indptr, pois_indices)
+	built_geometries = _min_level_difference(df_osm_built, df_osm_building_parts, parts_indptr, parts_indices)
+
+	# Building parts: If no classification given, use the building's land use
+	parts_owner = np.repeat( np.arange(number_buildings), np.diff(parts_indptr) )
+	parts_classification = df_osm_building_parts.classification.values[parts_indices]
+	parts_mask = _categories_mask(df_osm_building_parts.activity_category.values)[parts_indices]
+	use_default = ~ np.isin( parts_classification, ["activity", "mixed", "residential"] )
+	parts_classification = np.where( use_default, composed[parts_owner], parts_classification )
+	parts_mask = np.where( use_default, composed_mask[parts_owner], parts_mask )
+
+	def non_empty_area(geometries):
+		""" Surface of each geometry, 0 for empty geometries """
+		return np.where( geometries.isnull().values | geometries.is_empty.values, 0., geometries.area.values )
+
+	# Structures: Main building first, then its building parts
+	landuses_m2 = sum_landuses( np.concatenate( ( np.arange(number_buildings), parts_owner ) ), number_buildings,
+							   np.concatenate( ( non_empty_area(built_geometries), non_empty_area(df_osm_building_parts.geometry)[parts_indices] ) ),
+							   np.concatenate( ( df_osm_built.building_levels.values.astype(float), df_osm_building_parts.building_levels.values.astype(float)[parts_indices] ) ),
+							   np.concatenate( ( composed, parts_classification ) ),
+							   np.concatenate( ( composed_mask, parts_mask ) ),
+							   mixed_building_first_floor_activity=mixed_building_first_floor_activity )
+
+	# Calculate m2's for each land use, plus for each activity category: One column per key
+	for key in landuses_m2_keys:
+		df_osm_built[ landuses_m2_column(key) ] = landuses_m2[key].astype(np.float64)
 
 	# Sanity check: For each building land use classification, its M^2 associated to these land uses must be greater than 1
-	df_osm_built["classification"] = df_osm_built.apply(lambda x: classification_sanity_check(x), axis=1 )
+	# Example: A building's classification could be 'residential', but its building parts (occupying 100% of the area) contain an activity use
+	df_osm_built["classification"] = np.where( landuses_m2["residential"] > 0, np.where( landuses_m2["activity"] > 0, "mixed", "residential" ), "activity" )
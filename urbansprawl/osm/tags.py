@@ -12,6 +12,14 @@ columns_osm_tag = [ "amenity", "landuse", "leisure", "shop", "man_made", "buildi
 # Building parts which need to be filtered
 building_parts_to_filter = ["no", "roof"]
 
+# OSM keys defining each retrieved feature class
+buildings_key = "building"
+building_parts_key = "building:part"
+landuse_key = "landuse"
+pois_keys = ["amenity", "leisure", "office", "shop", "sport", "building"]
+# Tag keys retained when parsing features: Classification columns, height tags and feature class keys. Other tags are dropped
+features_tags = set( columns_osm_tag + height_tags + pois_keys + [buildings_key, building_parts_key, landuse_key] )
+
 #################################################################
 ### Classify uses according to OpenStreetMap wiki
 #################################################################
@@ -0,0 +1,177 @@
+###################################################################################################
+# Repository: https://github.com/lgervasoni/urbansprawl
+# MIT License
+###################################################################################################
+
+import math
+import numpy as np
+import shapely
+from shapely.geometry import Point
+from shapely.geometry import Polygon
+from shapely.geometry import LineString
+from shapely.prepared import prep
+
+from .. import settings
+
+# Fixed grid of Web Mercator tiles (as used by slippy maps) the Overpass sub-queries are aligned to
+# A tile query string only depends on the tile and the date: It is cached once (see `cache.py`), and shared by all the regions overlapping it
+# Features of the tiles are clipped client-side to the region of interest
+
+# Latitude limit of the Web Mercator projection
+_max_latitude = 85.0511287798
+
+#######################################################################
+### Tile grid
+#######################################################################
+
+def tile_index(lon, lat, zoom):
+	"""
+	Get the (x, y) index of the tile containing a (lon, lat) coordinate
+
+	Parameters
+	----------
+	lon : float
+		longitude
+	lat : float
+		latitude
+	zoom : int
+		zoom level of the tile grid
+
+	Returns
+	----------
+	[ int, int ]
+		tile column and row (rows increase southwards)
+	"""
+	n = 2 ** zoom
+	lat = math.radians( min( max(lat, -_max_latitude), _max_latitude ) )
+	x = int( (lon + 180.) / 360. * n )
+	y = int( ( 1. - math.log( math.tan(lat) + 1. / math.cos(lat) ) / math.pi ) / 2. * n )
+	return min( max(x, 0), n-1 ), min( max(y, 0), n-1 )
+
+def tile_bounds(x, y, zoom):
+	"""
+	Get the bounding box of a tile
+
+	Parameters
+	----------
+	x : int
+		tile column
+	y : int
+		tile row
+	zoom : int
+		zoom level of the tile grid
+
+	Returns
+	----------
+	[ float, float, float, float ]
+		west, south, east, north
+	"""
+	n = 2 ** zoom
+	def latitude(row):
+		return math.degrees( math.atan( math.sinh( math.pi * (1. - 2. * row / n) ) ) )
+	return x / n * 360. - 180., latitude(y+1), (x+1) / n * 360. - 180., latitude(y)
+
+def get_region_polygon(polygon=None, north=None, south=None, east=None, west=None):
+	"""
+	Get the region of interest as a polygon, given either a polygon or a bounding box
+	"""
+	if (polygon is not None):
+		return polygon
+	return Polygon([(west, south), (east, south), (east, north), (west, north)])
+
+def get_tiles_polygons(region, zoom=None):
+	"""
+	Get the tiles of the grid intersecting the region of interest
+
+	Parameters
+	----------
+	region : shapely Polygon or MultiPolygon
+		region of interest
+	zoom : int
+		zoom level of the tile grid (default: `settings.overpass_tile_zoom`)
+
+	Returns
+	----------
+	list
+		tiles bounding box polygons
+	"""
+	if (zoom is None):
+		zoom = settings.overpass_tile_zoom
+	west, south, east, north = region.bounds
+	x_min, y_min = tile_index(west, north, zoom)
+	x_max, y_max = tile_index(east, south, zoom)
+
+	prepared = prep(region)
+	tiles = []
+	for x in range(x_min, x_max+1):
+		for y in range(y_min, y_max+1):
+			tile_west, tile_south, tile_east, tile_north = tile_bounds(x, y, zoom)
+			tile = Polygon([(tile_west, tile_south), (tile_east, tile_south), (tile_east, tile_north), (tile_west, tile_north)])
+			if prepared.intersects(tile):
+				tiles.append(tile)
+	return tiles
+
+#######################################################################
+### Client-side clipping
+#######################################################################
+
+def _intersects_xy(region, prepared, lon, lat):
+	"""
+	Boolean mask of the (lon, lat) coordinates intersecting the region
+	A single vectorized call is used if available (shapely >= 2.0)
+	"""
+	if hasattr(shapely, 'intersects_xy'):
+		return shapely.intersects_xy(region, lon, lat)
+	return np.array( [ prepared.intersects( Point(x, y) ) for x, y in zip(lon, lat) ], dtype=bool )
+
+def clip_elements(elements, region):
+	"""
+	Keep the features of a container intersecting the region of interest, as a query restricted to the region would return them:
+		ways with at least one node within the region, or crossing it
+		relations with at least one member way intersecting the region, and all their member ways
+		tags of the nodes within the region
+	Nodes coordinates are kept as they are. The container is modified in place
+
+	Parameters
+	----------
+	elements : OSMElements
+		elements retrieved for the tiles covering the region
+	region : shapely Polygon or MultiPolygon
+		region of interest
+
+	Returns
+	----------
+	OSMElements
+		clipped elements
+	"""
+	prepared = prep(region)
+	region_west, region_south, region_east, region_north = region.bounds
+	ids, lon, lat = elements.node_arrays()
+	inside = _intersects_xy(region, prepared, lon, lat)
+
+	def way_intersects(nodes):
+		positions, found = elements.lookup( np.frombuffer(nodes, dtype=np.int64) )
+		positions = positions[found]
+		if ( len(positions) == 0 ):
+			return False
+		if inside[positions].any():
+			return True
+		# No node within the region: The way may still cross it
+		way_lon, way_lat = lon[positions], lat[positions]
+		if ( len(positions) < 2 ) or (way_lon.max() < region_west) or (way_lon.min() > region_east) or (way_lat.max() < region_south) or (way_lat.min() > region_north):
+			return False
+		return prepared.intersects( LineString( np.column_stack( (way_lon, way_lat) ) ) )
+
+	intersecting = { id_ for id_, (nodes, _) in elements.ways.items() if way_intersects(nodes) }
+
+	relations = { id_:relation for id_, relation in elements.relations.items()
+				 if any( (type_ == 'way') and (ref in intersecting) for type_, ref, _ in relation[0] ) }
+	members = { ref for members, _ in relations.values() for type_, ref, _ in members if type_ == 'way' }
+
+	elements.ways = { id_:way for id_, way in elements.ways.items() if (id_ in intersecting) or (id_ in members) }
+	elements.relations = relations
+	if (elements.node_tags):
+		tagged = np.fromiter(elements.node_tags.keys(), dtype=np.int64)
+		positions, found = elements.lookup(tagged)
+		elements.node_tags = { id_:elements.node_tags[id_] for id_ in tagged[ found & inside[positions] ].tolist() }
+	return elements
@@ -0,0 +1,449 @@
+###################################################################################################
+# Repository: https://github.com/lgervasoni/urbansprawl
+# MIT License
+###################################################################################################
+
+import osmnx as ox
+import pandas as pd
+import geopandas as gpd
+import numpy as np
+import ast
+import gzip
+import json
+import time
+import datetime
+import os.path
+import xml.etree.ElementTree as ET
+from osmnx import log
+import logging as lg
+
+from .elements import OSMElements, overpass_elements_request, ways_to_gdf, nodes_to_gdf
+from .scheduler import run_tile_queries
+from .overpass import create_landuse_gdf
+from .core import prepare_osm_gdf
+from .tags import buildings_key, building_parts_key, landuse_key, pois_keys
+from .classification import compute_landuse_inference, classify_activity_categories
+from .surface import compute_landuses_m2
+from .utils import load_geodataframe, store_geodataframe, get_dataframes_filenames, get_landuse_filename, get_relations_filename, store_relations, load_relations, compute_relations, relations_structures, associate_structures, relations_operations, relation_rows, update_relation
+
+# Maximum number of identifiers per Overpass query when completing a change
+_max_ids_per_query = 5000
+
+#######################################################################
+### Change files
+#######################################################################
+
+class OSMChange():
+	"""
+	Elements created, modified and deleted by an OpenStreetMap change
+
+	Attributes
+	----------
+	elements : OSMElements
+		new version of the created and modified elements, plus the coordinates of the nodes they reference (when available)
+	changed : dict
+		identifiers of the created or modified elements, by type ('node', 'way', 'relation')
+	deleted : dict
+		identifiers of the deleted elements, by type ('node', 'way', 'relation')
+	former_members : dict
+		member ways of the former version of the changed and deleted relations, by relation identifier (when known)
+	"""
+	def __init__(self):
+		self.elements = OSMElements()
+		self.changed = { 'node':set(), 'way':set(), 'relation':set() }
+		self.deleted = { 'node':set(), 'way':set(), 'relation':set() }
+		self.former_members = {}
+
+def _member_ways(element):
+	"""
+	Member ways of a relation, in the Overpass json format
+	"""
+	return { member['ref'] for member in element.get('members', []) if member['type'] == 'way' }
+
+def _element_from_xml(xml_element):
+	"""
+	Convert an OSM XML element into the Overpass json format
+	Coordinates of way nodes (augmented diffs using `out geom`) are returned separately
+	"""
+	tags = { tag.get('k'):tag.get('v') for tag in xml_element.iter('tag') }
+	element = {'type':xml_element.tag, 'id':int(xml_element.get('id')), 'tags':tags}
+	nodes_coordinates = []
+
+	if (xml_element.tag == 'node'):
+		if (xml_element.get('lat') is not None):
+			element['lat'], element['lon'] = float(xml_element.get('lat')), float(xml_element.get('lon'))
+	elif (xml_element.tag == 'way'):
+		element['nodes'] = []
+		for nd in xml_element.iter('nd'):
+			element['nodes'].append( int(nd.get('ref')) )
+			if (nd.get('lat') is not None):
+				nodes_coordinates.append( {'type':'node', 'id':int(nd.get('ref')), 'lat':float(nd.get('lat')), 'lon':float(nd.get('lon'))} )
+	elif (xml_element.tag == 'relation'):
+		element['members'] = [ {'type':member.get('type'), 'ref':int(member.get('ref')), 'role':member.get('role','')} for member in xml_element.iter('member') ]
+	return element, nodes_coordinates
+
+def parse_osm_change(change_file):
+	"""
+	Parse an OpenStreetMap change: osmChange file (.osc, optionally gzip compressed) or Overpass augmented diff ([adiff:...] query result)
+	The file is parsed incrementally. Members of the former version of relations are kept when available (augmented diffs, or deleted relations listing their members)
+
+	Parameters
+	----------
+	change_file : string
+		path to the change file
+
+	Returns
+	----------
+	OSMChange
+		created, modified and deleted elements
+	"""
+	change = OSMChange()
+	open_file = gzip.open if change_file.endswith('.gz') else open
+
+	# Current action: create, modify or delete. Augmented diffs hold the old and new versions of each element
+	action, within_old = None, False
+	with open_file(change_file, 'rb') as f:
+		for event, xml_element in ET.iterparse(f, events=('start','end')):
+			if (event == 'start'):
+				if (xml_element.tag in ['create','modify','delete']): # osmChange
+					action = xml_element.tag
+				elif (xml_element.tag == 'action'): # Augmented diff
+					action = xml_element.get('type')
+				elif (xml_element.tag == 'old'):
+					within_old = True
+				continue
+
+			if (xml_element.tag in ['create','modify','delete','action']):
+				action = None
+				xml_element.clear()
+			elif (xml_element.tag == 'old'):
+				within_old = False
+				xml_element.clear()
+			elif (xml_element.tag == 'relation') and (action is not None) and (within_old):
+				element, _ = _element_from_xml(xml_element)
+				change.former_members[element['id']] = _member_ways(element)
+				xml_element.clear()
+			elif (xml_element.tag in ['node','way','relation']) and (action is not None) and (not within_old):
+				element, nodes_coordinates = _element_from_xml(xml_element)
+				if (action == 'delete') or (xml_element.get('visible') == 'false'):
+					change.deleted[element['type']].add(element['id'])
+					if (element['type'] == 'relation') and (element['members']) and (element['id'] not in change.former_members):
+						change.former_members[element['id']] = _member_ways(element)
+				else:
+					change.changed[element['type']].add(element['id'])
+					if ( (element['type'] != 'node') or ('lat' in element) ):
+						change.elements.add(element)
+				for node in nodes_coordinates:
+					change.elements.add(node)
+				xml_element.clear()
+
+	log('Parsed OSM change {}: {:,} created or modified and {:,} deleted elements'.format(change_file, sum( len(ids) for ids in change.changed.values() ), sum( len(ids) for ids in change.deleted.values() )))
+	return change
+
+def complete_osm_change(change, date="", former_date=""):
+	"""
+	Retrieve from the Overpass API the data needed to rebuild the geometries of a change:
+		coordinates of the nodes referenced by the changed ways, but not part of the change (osmChange files only hold modified nodes)
+		buildings, building parts and land use ways using a modified node (their geometry changed, while the way itself did not), including the untagged members of buildings, building parts and land use relations
+		former and current member ways of the changed and deleted relations (e.g. multipolygon buildings and land use): They are rebuilt as changed ways
+		relations of the changed ways, which determine the feature class of their untagged members
+
+	Parameters
+	----------
+	change : OSMChange
+		parsed change
+	date : string
+		query the database at a certain timestamp (the time-stamp of the change)
+	former_date : string
+		query the database just before the change, to retrieve the former members of the changed relations unknown to the change (osmChange files)
+
+	Returns
+	----------
+	OSMChange
+		completed change
+	"""
+	def run_queries(query_strs, description):
+		""" Elements retrieved by each query """
+		if not (query_strs):
+			return []
+		return run_tile_queries(query_strs, lambda query_str: overpass_elements_request(data={'data':query_str}, elements=OSMElements(), timeout=180), description=description)
+
+	def ids_queries(ids, statement, date):
+		""" Queries of a statement over a set of identifiers, by chunks of identifiers """
+		ids = sorted(ids)
+		return [ date+'[out:json];'+statement.format( ','.join( str(id_) for id_ in ids[i:i+_max_ids_per_query] ) ) for i in range(0, len(ids), _max_ids_per_query) ]
+
+	# Former members of the changed and deleted relations, unless held by the change
+	relations = change.changed['relation'] | change.deleted['relation']
+	unknown = relations - set(change.former_members)
+	if (unknown and former_date):
+		for tile_elements in run_queries( ids_queries(unknown, 'relation(id:{});out body;', former_date), 'OSM change former relations' ):
+			for id_, (members, _) in tile_elements.relations.items():
+				change.former_members[id_] = { ref for type_, ref, _ in members if type_ == 'way' }
+	elif (unknown):
+		log('Former members of {:,} changed relations are unknown (no time-stamp given for the change): Ways removed from these relations keep their stored version'.format( len(unknown) ), level=lg.WARNING)
+
+	# Ways of the changed and deleted relations: Former and current members
+	relation_ways = set().union( *[ change.former_members.get(id_, set()) for id_ in relations ] )
+	relation_ways.update( ref for id_ in change.changed['relation'] if id_ in change.elements.relations for type_, ref, _ in change.elements.relations[id_][0] if type_ == 'way' )
+	relation_ways -= change.deleted['way']
+	change_ways = set( change.elements.ways.keys() )
+	change.changed['way'].update(relation_ways)
+	query_strs = ids_queries( relation_ways - change_ways, 'way(id:{});(._;>;);out;', date )
+
+	# Nodes referenced by changed ways, whose coordinates are unknown
+	referenced = np.unique( np.concatenate( [ np.frombuffer(change.elements.ways[id_][0], dtype=np.int64) for id_ in change.changed['way'] if id_ in change.elements.ways ] + [ np.zeros(0, dtype=np.int64) ] ) )
+	missing = referenced[ ~ change.elements.contains_nodes(referenced) ].tolist()
+	query_strs += ids_queries( missing, 'node(id:{});out;', date )
+
+	# Ways whose geometry changed through their nodes: Tagged ways, and untagged members of tagged relations (e.g. multipolygon buildings), along with their relations
+	keys = [buildings_key, building_parts_key, landuse_key]
+	tagged_ways = ''.join( 'way.n["{}"];'.format(key) for key in keys )
+	tagged_relations = ''.join( 'rel(bw.n)["{}"];'.format(key) for key in keys )
+	query_strs += ids_queries( change.changed['node'], 'node(id:{});way(bn)->.n;(' + tagged_relations + ')->.r;(' + tagged_ways + 'way.n(r.r);)->.w;(.w;.w >;);out;rel(bw.w);out body;', date )
+
+	# Relations of the changed ways
+	query_strs += ids_queries( change.changed['way'] - change.deleted['way'], 'way(id:{});rel(bw);out body;', date )
+
+	for tile_elements in run_queries(query_strs, 'OSM change completion data'):
+		# Changed ways and relations keep the version of the change
+		for id_ in list(tile_elements.ways.keys()):
+			if (id_ in change_ways) or (id_ in change.deleted['way']):
+				del tile_elements.ways[id_]
+		for id_ in list(tile_elements.relations.keys()):
+			if (id_ in relations):
+				del tile_elements.relations[id_]
+		# Tags of the completion nodes are not part of the change
+		tile_elements.node_tags = {}
+		change.changed['way'].update( tile_elements.ways.keys() )
+		change.elements.merge(tile_elements)
+	return change
+
+#######################################################################
+### Incremental update
+#######################################################################
+
+def _as_dict(value):
+	"""
+	Dictionary columns may be read as strings from stored files
+	"""
+	if isinstance(value, dict):
+		return value
+	if isinstance(value, str):
+		try:
+			return json.loads(value)
+		except ValueError:
+			return ast.literal_eval(value)
+	return {}
+
+def update_layer(df_osm, removed, df_new, crs):
+	"""
+	Remove the changed features of a stored layer, and add their new version
+
+	Parameters
+	----------
+	df_osm : geopandas.GeoDataFrame
+		stored layer
+	removed : set
+		OSM identifiers of the removed features (deleted, or replaced by their new version)
+	df_new : geopandas.GeoDataFrame
+		new version of the changed features (None if no feature)
+	crs : dict
+		projection of the layer
+
+	Returns
+	----------
+	[ gpd.GeoDataFrame, gpd.GeoDataFrame, np.array ]
+		updated layer, geometries which changed (former and new versions), and new position of each stored feature (-1 if removed)
+	"""
+	is_removed = df_osm.osm_id.isin(removed).values
+	positions = np.full( len(df_osm), -1, dtype=np.int64 )
+	positions[~ is_removed] = np.arange( (~ is_removed).sum() )
+	changed_geometries = [ df_osm.loc[is_removed, ["geometry"]] ]
+	df_osm = df_osm[~ is_removed]
+	if (df_new is not None):
+		changed_geometries.append( df_new[["geometry"]] )
+		df_osm = pd.concat( [df_osm, df_new], ignore_index=True, sort=False )
+	df_osm = gpd.GeoDataFrame( df_osm.reset_index(drop=True), crs=crs )
+	return df_osm, gpd.GeoDataFrame( pd.concat(changed_geometries, ignore_index=True), crs=crs ), positions
+
+def update_processed_osm_data(city_ref, change_file, date=None, kwargs={"default_height":3, "meters_per_level":3, "associate_landuses_m2":True, "mixed_building_first_floor_activity":True, "minimum_m2_building_area":9}):
+	"""
+	Apply an OpenStreetMap change to the stored buildings, building parts, POIs and land use polygons of input city
+	Only the changed features are classified, and the land use inference, structures association and surface computation are performed for the changed buildings and the buildings containing changed structures only
+	Changed relations (multipolygon buildings and land use) are rebuilt from their member ways
+	Stored files are updated in place
+
+	Parameters
+	----------
+	city_ref : str
+		Name of input city / region (its data must have been stored by `get_processed_osm_data`)
+	change_file : string
+		osmChange file (.osc or .osc.gz) or Overpass augmented diff ([adiff:...] query result)
+	date : datetime.datetime
+		time-stamp of the change: the missing data needed to rebuild geometries is queried at this time-stamp, and the former members of changed relations just before it
+	kwargs : dict
+		additional arguments to drive the process:
+			default_height : float
+				height of buildings under missing data
+			meters_per_level : float
+				buildings number of levels assumed under missing data
+			associate_landuses_m2 : boolean
+				compute the total square meter for each land use
+			mixed_building_first_floor_activity : Boolean
+				if True: Associates building's first floor to activity uses and the rest to residential uses
+				if False: Associates half of the building's area to each land use (Activity and Residential)
+			minimum_m2_building_area : float
+				minimum area to be considered a building (otherwise filtered)
+
+	Returns
+	----------
+	[ gpd.GeoDataFrame, gpd.GeoDataFrame, gpd.GeoDataFrame ]
+		returns the updated buildings, building parts, and points associated to a residential or activity land usage
+	"""
+	log("OSM data update requested for city: " + str(city_ref) )
+	start_time = time.time()
+
+	geo_poly_file, geo_poly_parts_file, geo_point_file = get_dataframes_filenames(city_ref)
+	if not ( os.path.isfile(geo_poly_file) ):
+		log("Error: No stored files for city " + str(city_ref), level=lg.ERROR)
+		return None, None, None
+
+	# Load stored data, within the same projection
+	df_osm_built = load_geodataframe(geo_poly_file)
+	crs = df_osm_built.crs
+	df_osm_building_parts = ox.project_gdf( load_geodataframe(geo_poly_parts_file), to_crs=crs )
+	df_osm_pois = ox.project_gdf( load_geodataframe(geo_point_file), to_crs=crs )
+	for df_osm in [df_osm_built, df_osm_building_parts, df_osm_pois]:
+		if ("key_value" in df_osm.columns):
+			df_osm["key_value"] = df_osm["key_value"].apply(_as_dict)
+
+	# Stored structures relations: Updated for the processed buildings only
+	relations = load_relations( get_relations_filename(city_ref), df_osm_built, df_osm_building_parts, df_osm_pois )
+	if (relations is None) or any( name not in relations for name in relations_operations ):
+		log("No stored structures relations for city " + str(city_ref) + ". Computing them")
+		relations = compute_relations(df_osm_built, df_osm_building_parts, df_osm_pois)
+
+	if (date): # Non-null date
+		date_query = '[date:"'+date.strftime("%Y-%m-%dT%H:%M:%SZ")+'"]'
+		former_date_query = '[date:"'+(date - datetime.timedelta(seconds=1)).strftime("%Y-%m-%dT%H:%M:%SZ")+'"]'
+	else:
+		date_query, former_date_query = "", ""
+
+	if ( os.path.isfile( get_landuse_filename(city_ref) ) ):
+		df_osm_lu = ox.project_gdf( load_geodataframe( get_landuse_filename(city_ref) ), to_crs=crs )
+	else: # Stored before land use polygons were kept: Retrieve them for the extent of the buildings
+		log("No stored land use polygons for city " + str(city_ref) + ". Retrieving them")
+		west, south, east, north = ox.project_gdf(df_osm_built, to_latlong=True).total_bounds
+		df_osm_lu = prepare_osm_gdf( create_landuse_gdf(date=date_query, north=north, south=south, east=east, west=west), "landuse", city_ref, to_crs=crs )
+
+	##########################
+	### Changed features
+	##########################
+	change = complete_osm_change( parse_osm_change(change_file), date_query, former_date_query )
+
+	def changed_ways_gdf(key, layer):
+		""" New version of the changed ways tagged with `key`, or members of a relation tagged with `key`, prepared as the stored layer """
+		members = { ref for id_, (relation_members, tags) in change.elements.relations.items() if (key in tags) and (id_ not in change.deleted['relation']) for type_, ref, _ in relation_members if type_ == 'way' }
+		ways = [ id_ for id_ in change.changed['way'] if (id_ in change.elements.ways) and ( (key in change.elements.ways[id_][1]) or (id_ in members) ) ]
+		if not (ways):
+			return None
+		df_osm = ways_to_gdf(change.elements, ways)
+		if ( len(df_osm) == 0 ):
+			return None
+		df_osm = df_osm[df_osm['geometry'].is_valid]
+		return prepare_osm_gdf(df_osm, layer, city_ref, to_crs=crs) if len(df_osm) else None
+
+	new_built = changed_ways_gdf(buildings_key, "buildings")
+	if (new_built is not None):
+		new_built = new_built[ new_built.geometry.area >= kwargs["minimum_m2_building_area"] ]
+	new_parts = changed_ways_gdf(building_parts_key, "building_parts")
+	new_lu = changed_ways_gdf(landuse_key, "landuse")
+	pois = [ id_ for id_ in change.changed['node'] if any( key in change.elements.node_tags.get(id_, {}) for key in pois_keys ) ]
+	new_pois = prepare_osm_gdf( nodes_to_gdf(change.elements, pois), "points", city_ref, to_crs=crs ) if pois else None
+
+	# Activity categories of the new structures
+	for df_osm in [new_parts, new_pois]:
+		if (df_osm is not None) and len(df_osm):
+			df_osm['activity_category'] = classify_activity_categories(df_osm.key_value)
+
+	# Removed features: Deleted, or replaced by their new version
+	removed_ways = change.deleted['way'] | change.changed['way']
+	removed_nodes = change.deleted['node'] | change.changed['node']
+
+	df_osm_lu, changed_lu, _ = update_layer(df_osm_lu, removed_ways, new_lu, crs)
+	df_osm_building_parts, changed_parts, parts_positions = update_layer(df_osm_building_parts, removed_ways, new_parts, crs)
+	df_osm_pois, changed_pois, pois_positions = update_layer(df_osm_pois, removed_nodes, new_pois, crs)
+
+	##########################
+	### Buildings to process: New ones, and stored ones containing changed structures or within changed land use polygons
+	##########################
+	df_osm_built, _, built_positions = update_layer(df_osm_built, removed_ways, None, crs)
+	# Stored position of each building (-1 for new buildings)
+	rows = np.flatnonzero( built_positions >= 0 )
+	df_osm_built["update"] = False
+
+	def intersecting(df_changed):
+		""" Stored buildings intersecting changed geometries """
+		if ( len(df_changed) == 0 ) or ( len(df_osm_built) == 0 ):
+			return []
+		return gpd.sjoin(df_osm_built[["geometry"]], df_changed, op='intersects').index.unique()
+
+	df_osm_built.loc[ intersecting( pd.concat([changed_parts, changed_pois], ignore_index=True) ), "update" ] = True
+
+	# Inferred land use: Infer it again if a land use polygon changed around the building
+	inferred = df_osm_built.key_value.apply(lambda x: "inferred" in x)
+	reinfer = df_osm_built.index.isin( intersecting(changed_lu) ) & inferred
+	df_osm_built.loc[reinfer, "classification"] = "infer"
+	df_osm_built.loc[reinfer, "update"] = True
+
+	if (new_built is not None) and len(new_built):
+		new_built["update"] = True
+		df_osm_built = gpd.GeoDataFrame( pd.concat( [df_osm_built, new_built], ignore_index=True, sort=False ), crs=crs )
+		rows = np.concatenate( ( rows, np.full( len(new_built), -1, dtype=np.int64 ) ) )
+
+	log("Update of city " + str(city_ref) + ": " + str( df_osm_built["update"].sum() ) + " buildings to process")
+
+	##########################
+	### Land use inference, structures association, and land uses surface
+	##########################
+	if ( (df_osm_built.classification == "infer").any() ):
+		compute_landuse_inference(df_osm_built, df_osm_lu)
+
+	to_update = np.flatnonzero( df_osm_built["update"].values.astype(bool) )
+	df_to_update = df_osm_built.iloc[to_update].copy()
+
+	# Structures relations: Associate the structures of the buildings to process, and splice them into the stored relations
+	structures_positions = { "containing_parts":parts_positions, "containing_poi":pois_positions }
+	updated_relations = { "osm_id":df_osm_built.osm_id.values.astype(np.int64) }
+	for name, df_structures in relations_structures(df_osm_building_parts, df_osm_pois).items():
+		updated_relations[name] = update_relation( relations[name], rows, structures_positions[name], to_update, associate_structures(df_to_update, df_structures, operation=relations_operations[name]) )
+		updated_relations[ name + "_osm_id" ] = df_structures.osm_id.values.astype(np.int64)
+	relations = updated_relations
+	df_to_update['activity_category'] = classify_activity_categories(df_to_update.key_value)
+
+	if ( kwargs["associate_landuses_m2"] and len(df_to_update) ):
+		compute_landuses_m2(df_to_update, df_osm_building_parts, df_osm_pois, relation_rows(relations["containing_parts"], to_update), relation_rows(relations["containing_poi"], to_update), default_height=kwargs["default_height"], meters_per_level=kwargs["meters_per_level"], mixed_building_first_floor_activity=kwargs["mixed_building_first_floor_activity"])
+		# Set the composed classification given, for each building, its containing Points of Interest and building parts classification
+		df_to_update.loc[ (df_to_update.m2_activity > 0) & (df_to_update.m2_residential > 0), "classification" ] = "mixed"
+
+	df_to_update.loc[ df_to_update.activity_category.apply(lambda x: len(x)==0 ), "activity_category" ] = np.nan
+	# Splice the processed buildings: Columns are upcast if needed (e.g. stored columns holding no value)
+	is_updated = df_osm_built.index.isin(df_to_update.index)
+	for column in df_to_update.columns:
+		if (column != "geometry"):
+			values = df_to_update[column].reindex(df_osm_built.index)
+			df_osm_built[column] = df_osm_built[column].where( ~ is_updated, values ) if (column in df_osm_built.columns) else values
+	df_osm_built.drop( ["update"], axis=1, inplace=True )
+
+	##########################
+	### Store files
+	##########################
+	store_geodataframe(df_osm_built, geo_poly_file)
+	store_geodataframe(df_osm_building_parts, geo_poly_parts_file)
+	store_geodataframe(df_osm_pois, geo_point_file)
+	store_geodataframe(df_osm_lu, get_landuse_filename(city_ref))
+	store_relations(relations, get_relations_filename(city_ref))
+
+	log("Done: OSM data update for city " + str(city_ref) + ". Elapsed time (H:M:S): " + time.strftime("%H:%M:%S", time.gmtime(time.time()-start_time)) )
+	return df_osm_built, df_osm_building_parts, df_osm_pois
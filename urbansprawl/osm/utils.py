@@ -7,8 +7,12 @@ import osmnx as ox
 import pandas as pd
 import geopandas as gpd
 import numpy as np
+import re
+import ast
+from osmnx import log
+import logging as lg
 
-from .tags import height_tags
+from .tags import height_tags, activity_classification
 
 from ..settings import storage_folder
 
@@ -43,6 +47,62 @@ def get_dataframes_filenames(city_ref_file):
 	geo_point_file = storage_folder+"/"+city_ref_file+"_poi."+geo_format
 	return geo_poly_file, geo_poly_parts_file, geo_point_file
 
+def get_landuse_filename(city_ref_file):
+	"""
+	Get land use polygons file name for input city
+	Land use polygons are stored to allow incremental updates of the buildings land use inference
+
+	Parameters
+	----------
+	city_ref_file : string
+		name of input city
+
+	Returns
+	----------
+	string
+		returns filename for land use polygons
+	
+	"""
+	return storage_folder+"/"+city_ref_file+"_landuse."+geo_format
+
+def get_relations_filename(city_ref_file):
+	"""
+	Get the structures relations file name for input city
+	The building parts and Points of Interest associated to each building are stored as index arrays (see `associate_structures`)
+
+	Parameters
+	----------
+	city_ref_file : string
+		name of input city
+
+	Returns
+	----------
+	string
+		returns filename for the structures relations
+	
+	"""
+	return storage_folder+"/"+city_ref_file+"_relations.npz"
+
+def get_history_filenames(city_ref_file):
+	"""
+	Get the history file names for input city
+	The distinct versions of the features retrieved at several dates are stored once per layer, along with the retrieved dates
+
+	Parameters
+	----------
+	city_ref_file : string
+		name of input city
+
+	Returns
+	----------
+	[ string, dict ]
+		returns filename for the retrieved dates, and filename for the versions of each layer ('buildings', 'building_parts', 'landuse', 'points')
+	
+	"""
+	dates_file = storage_folder+"/"+city_ref_file+"_history.json"
+	layers_files = { layer : storage_folder+"/"+city_ref_file+"_history_"+layer+"."+geo_format for layer in ["buildings", "building_parts", "landuse", "points"] }
+	return dates_file, layers_files
+
 def load_geodataframe(geo_filename):
 	""" 
 	Load input GeoDataFrame
@@ -65,18 +125,17 @@ def load_geodataframe(geo_filename):
 	# Replace empty string (Json NULL sometimes read as '') for NaN
 	df_osm_data.replace('', np.nan, inplace=True)
 	
-	def list_int_from_string(x): # List of integers given input in string format
-		return [ int(id_) for id_ in x.split(",") ]
 	def list_str_from_string(x): # List of strings given input in string format
 		return x.split(",")
 
 	# Recover list
 	if ( "activity_category" in df_osm_data.columns): 
 		df_osm_data[ "activity_category" ] = df_osm_data.activity_category.apply(lambda x: list_str_from_string(x) if pd.notnull(x) else np.nan )
-	if ( "containing_parts" in df_osm_data.columns): 
-		df_osm_data[ "containing_parts" ] = df_osm_data.containing_parts.apply( lambda x: list_int_from_string(x) if pd.notnull(x) else np.nan )
-	if ( "containing_poi" in df_osm_data.columns): 
-		df_osm_data[ "containing_poi" ] = df_osm_data.containing_poi.apply( lambda x: list_int_from_string(x) if pd.notnull(x) else np.nan )
+	# Structures relations are stored separately (see `store_relations`): Drop those stored as strings by earlier versions
+	df_osm_data.drop( [ c for c in ["containing_parts", "containing_poi"] if c in df_osm_data.columns ], axis=1, inplace=True )
+	
+	# Surfaces stored as a dict per building: One column per land use
+	expand_landuses_m2(df_osm_data)
 	
 	# To UTM coordinates
 	return ox.project_gdf( df_osm_data )
@@ -102,23 +161,211 @@ def store_geodataframe(df_osm_data, geo_filename):
 	# Lists to string (needed to save GeoJSON files)
 	if ( "activity_category" in df_osm_data.columns): 
 		df_osm_data.activity_category = df_osm_data.activity_category.apply( lambda x: ','.join(str(e) for e in x) if isinstance(x,list) else np.nan )	
-	if ( "containing_parts" in df_osm_data.columns):
-		df_osm_data.containing_parts = df_osm_data.containing_parts.apply( lambda x: ','.join(str(e) for e in x) if isinstance(x,list) else np.nan )	
-	if ( "containing_poi" in df_osm_data.columns):
-		df_osm_data.containing_poi = df_osm_data.containing_poi.apply( lambda x: ','.join(str(e) for e in x) if isinstance(x,list) else np.nan )	
 	
 	# Save to file
 	df_osm_data.to_file(geo_filename, driver=geo_driver)
 
+def store_relations(relations, relations_filename):
+	""" 
+	Store the structures relations of a set of buildings (see `compute_relations`)
+
+	Parameters
+	----------
+	relations : dict
+		relations, and identifiers of the buildings and structures they refer to
+	relations_filename : string
+		filename for relations storage
+
+	Returns
+	----------
+	
+	"""
+	arrays = {}
+	for key, value in relations.items():
+		if (key in relations_operations):
+			arrays[ key + "_indptr" ], arrays[ key + "_indices" ] = value
+		else: # Identifiers
+			arrays[key] = value
+	np.savez_compressed(relations_filename, **arrays)
+
+def load_relations(relations_filename, df_osm_built, df_osm_building_parts=None, df_osm_pois=None):
+	""" 
+	Load the stored structures relations of input buildings (see `compute_relations`)
+	A relation is only loaded if its structures are given, and identical to the ones it was computed for (same OSM identifiers, in the same order)
+
+	Parameters
+	----------
+	relations_filename : string
+		input relations filename
+	df_osm_built : geopandas.GeoDataFrame
+		buildings the relations refer to, as stored along with them
+	df_osm_building_parts : geopandas.GeoDataFrame
+		building parts of the 'containing_parts' relation
+	df_osm_pois : geopandas.GeoDataFrame
+		points of interest of the 'containing_poi' relation
+
+	Returns
+	----------
+	dict
+		loaded relations, and identifiers of the buildings and structures they refer to. None if not stored, or stored for other buildings
+	"""
+	import os
+	if not ( os.path.isfile(relations_filename) ):
+		return None
+	with np.load(relations_filename) as arrays:
+		if not ( np.array_equal( arrays["osm_id"], _osm_ids(df_osm_built) ) ):
+			return None
+		relations = { "osm_id":arrays["osm_id"] }
+		for name, df_osm_structures in relations_structures(df_osm_building_parts, df_osm_pois).items():
+			if (df_osm_structures is None) or ( name + "_osm_id" not in arrays.files ):
+				continue
+			if not ( np.array_equal( arrays[ name + "_osm_id" ], _osm_ids(df_osm_structures) ) ):
+				log("Stored relation " + name + " refers to other structures: Not loaded", level=lg.WARNING)
+				continue
+			relations[name] = ( arrays[ name + "_indptr" ], arrays[ name + "_indices" ] )
+			relations[ name + "_osm_id" ] = arrays[ name + "_osm_id" ]
+		return relations
+
+def get_structures_relation(df_osm_built, df_osm_structures, name, relations=None):
+	""" 
+	Get a structures relation of input buildings: The given one if it was computed for these buildings and structures (same OSM identifiers, in the same order), otherwise it is computed
+
+	Parameters
+	----------
+	df_osm_built : geopandas.GeoDataFrame
+		input buildings
+	df_osm_structures : geopandas.GeoDataFrame
+		structures of the relation: building parts for 'containing_parts', points of interest for 'containing_poi'
+	name : string
+		relation name
+	relations : dict
+		relations, and identifiers of the buildings and structures they refer to (see `compute_relations`)
+
+	Returns
+	----------
+	[ np.array, np.array ]
+		indptr, and positions of the structures in their data frame
+	"""
+	if (relations is not None) and (name in relations):
+		if ( np.array_equal( relations.get("osm_id"), _osm_ids(df_osm_built) ) and np.array_equal( relations.get( name + "_osm_id" ), _osm_ids(df_osm_structures) ) ):
+			return relations[name]
+		log("Relation " + name + " refers to other buildings or structures: Computing it again", level=lg.WARNING)
+	return associate_structures(df_osm_built, df_osm_structures, operation=relations_operations[name])
+
+###################################################
+### Land uses surface columns
+###################################################
+
+# Surface (m2) associated to each land use and to each activity category: One float column per key, e.g. 'm2_residential', 'm2_shop'
+landuses_m2_keys = ["residential", "activity"] + list( activity_classification.keys() )
+
+def landuses_m2_column(key):
+	""" 
+	Column of the surface associated to a land use or activity category
+
+	Parameters
+	----------
+	key : string
+		land use ('residential', 'activity') or activity category
+
+	Returns
+	----------
+	string
+		column name
+	"""
+	return "m2_" + key
+
+def expand_landuses_m2(df_osm):
+	""" 
+	Expand the surfaces stored as a dict per building (`landuses_m2` column, as stored by earlier versions) to one column per key
+
+	Parameters
+	----------
+	df_osm : geopandas.GeoDataFrame
+		input OSM buildings
+
+	Returns
+	----------
+
+	"""
+	if not ( "landuses_m2" in df_osm.columns ):
+		return
+	# Dicts may be read as strings from stored files
+	dicts = df_osm.pop("landuses_m2").apply( lambda x: ast.literal_eval(x) if isinstance(x, str) else x )
+	for key in landuses_m2_keys:
+		df_osm[ landuses_m2_column(key) ] = dicts.apply( lambda x: x.get(key, 0.) if isinstance(x, dict) else np.nan ).astype(np.float64)
+
+def get_landuses_m2(df_osm, key=None):
+	""" 
+	Surface associated to each land use and activity category of input buildings
+
+	Parameters
+	----------
+	df_osm : geopandas.GeoDataFrame
+		input OSM buildings
+	key : string
+		land use or activity category. If None, all of them are returned
+
+	Returns
+	----------
+	pandas.Series or pandas.DataFrame
+		surface of each building (one column per key if no key is given)
+	"""
+	if ( "landuses_m2" in df_osm.columns ): # Dict per building
+		dicts = df_osm.landuses_m2
+		values = lambda key: dicts.apply( lambda x: x.get(key, 0.) if isinstance(x, dict) else np.nan ).astype(np.float64).rename(key)
+	else:
+		values = lambda key: df_osm[ landuses_m2_column(key) ].rename(key)
+	if (key is not None):
+		return values(key)
+	return pd.concat( [ values(key) for key in landuses_m2_keys ], axis=1 )
+
 ###################################################
 ### GeoDataFrame processing utils
 ###################################################
 
+# Height values parsing: Unit suffixes (meters, levels), and feet/inches values (e.g. 4'7'')
+_height_meters = re.compile('meters|meter|m')
+_height_levels = re.compile('levels|level|l')
+_height_feet_inches = re.compile("^([^']*)'([^']*)")
+
+def parse_height_value(value):
+	""" 
+	Parse a (possibly wrongly-tagged) height tag value
+	Any meter or level related string is removed, and heights using the imperial units are converted to the metric system
+
+	Parameters
+	----------
+	value : string
+		height tag value
+
+	Returns
+	----------
+	float
+		parsed value (None if it can not be parsed)
+	"""
+	try: # Can be read as float?
+		return float(value)
+	except:
+		pass
+	try: # Try removing incorrectly tagged information: meters/levels
+		return float( _height_levels.sub('', _height_meters.sub('', value) ) )
+	except:
+		pass
+	try: # Feet and inch values? e.g.: 4'7''
+		feet, inches = _height_feet_inches.match(value).groups()
+		tot_inches = float(feet)*12 + float(inches or '0')
+		# Return meters equivalent
+		return tot_inches * 0.0254
+	except: # None. Incorrect tag
+		return None
+
 def sanity_check_height_tags(df_osm):
 	""" 
 	Compute a sanity check for all height tags
 	If incorrectly tagged, try to replace with the correct tag
 	Any meter or level related string are replaced, and heights using the imperial units are converted to the metric system
+	Numeric columns are cast at once. Each distinct value of the other columns is parsed once (see `parse_height_value`)
 
 	Parameters
 	----------
@@ -129,37 +376,73 @@ def sanity_check_height_tags(df_osm):
 	----------
 	
 	"""
-	def sanity_check(value):
-		### Sanity check for height tags (sometimes wrongly-tagged)
-		if not( (value is np.nan) or (value is None) ): # Non-null value
-			try: # Can be read as float?
-				return float(value)
-			except: 
-				try: # Try removing incorrectly tagged information: meters/levels 
-					return float( value.replace('meters','').replace('meter','').replace('m','').replace('levels','').replace('level','').replace('l','') )
-				except:					
-					try: # Feet and inch values? e.g.: 4'7''
-						split_value = value.split("'")
-						feet, inches = split_value[0], split_value[1]
-						if (inches is ''): # Non existent inches
-							inches = '0'
-						tot_inches = float(feet)*12 + float(inches)
-						# Return meters equivalent
-						return tot_inches * 0.0254
-					except: # None. Incorrect tag
-						return None
-		return value
-
 	# Available height tags
 	available_height_tags = [ col for col in height_tags if col in df_osm.columns ]
-	# Apply-map sanity check
-	df_osm[ available_height_tags ] = df_osm[ available_height_tags ].applymap(sanity_check)
+	if not (available_height_tags):
+		return
+
+	values = df_osm[ available_height_tags ]
+	to_parse = [ col for col in available_height_tags if not pd.api.types.is_numeric_dtype( values[col] ) ]
 
-def associate_structures(df_osm_encompassing_structures, df_osm_structures, operation='contains', column='containing_'):
+	# Distinct non-null values: Direct numeric cast, then parsing of the remaining values
+	unique_values = pd.Series( pd.unique( values[to_parse].values.ravel() ) if to_parse else [], dtype=object )
+	unique_values = unique_values[ unique_values.notnull() ]
+	parsed = pd.to_numeric(unique_values, errors='coerce')
+	not_numeric = parsed.isnull()
+	parsed[not_numeric] = np.array( [ parse_height_value(value) for value in unique_values[not_numeric] ], dtype=float )
+	parsed_values = dict( zip(unique_values, parsed.astype(float)) )
+
+	for col in available_height_tags:
+		if (col in to_parse):
+			df_osm[col] = values[col].map(parsed_values)
+		else:
+			df_osm[col] = values[col].astype(float)
+
+# Spatial operation of each structures relation of the buildings
+relations_operations = { "containing_parts":"contains", "containing_poi":"intersects" }
+
+def _osm_ids(df_osm):
+	""" 
+	OSM identifiers of a data frame rows, which the positions of a relation refer to
+	"""
+	return df_osm.osm_id.values.astype(np.int64)
+
+def relations_structures(df_osm_building_parts, df_osm_pois):
+	""" 
+	Structures of each relation of the buildings
+	"""
+	return { "containing_parts":df_osm_building_parts, "containing_poi":df_osm_pois }
+
+def compute_relations(df_osm_built, df_osm_building_parts, df_osm_pois):
+	""" 
+	Associate to each building its containing building parts, and its intersecting points of interest (see `associate_structures`)
+	Relations hold positions in the data frames: The OSM identifiers of the buildings and structures are kept along, to check they are used with the same data frames
+
+	Parameters
+	----------
+	df_osm_built : geopandas.GeoDataFrame
+		buildings
+	df_osm_building_parts : geopandas.GeoDataFrame
+		building parts
+	df_osm_pois : geopandas.GeoDataFrame
+		points of interest
+
+	Returns
+	----------
+	dict
+		relation name ('containing_parts', 'containing_poi') -> [ indptr, indices ] arrays, identifiers of the buildings ('osm_id') and of the structures of each relation (e.g. 'containing_poi_osm_id')
+	"""
+	relations = { "osm_id":_osm_ids(df_osm_built) }
+	for name, df_osm_structures in relations_structures(df_osm_building_parts, df_osm_pois).items():
+		relations[name] = associate_structures(df_osm_built, df_osm_structures, operation=relations_operations[name])
+		relations[ name + "_osm_id" ] = _osm_ids(df_osm_structures)
+	return relations
+
+def associate_structures(df_osm_encompassing_structures, df_osm_structures, operation='contains'):
 	""" 
 	Associate input structure geometries to its encompassing structures
 	Structures are associated using the operation 'contains' or 'intersects'
-	A new column in the encompassing data frame is added, incorporating the indices of the containing structures
+	The relation is returned in CSR form: The structures of the encompassing row i are at positions indices[indptr[i]:indptr[i+1]] of their data frame
 
 	Parameters
 	----------
@@ -169,19 +452,79 @@ def associate_structures(df_osm_encompassing_structures, df_osm_structures, oper
 		structures data frame
 	operation : string
 		spatial join operation to associate structures
-	column : string
-		name of the column to add in encompassing data frame
 
 	Returns
 	----------
-	
+	[ np.array, np.array ]
+		indptr, and positions of the structures in their data frame
 	"""
 	# Find, for each geometry, all containing structures
 	sjoin = gpd.sjoin(df_osm_encompassing_structures[['geometry']], df_osm_structures[['geometry']], op=operation, rsuffix='cont')
-	# Group by: polygon_index -> list of containing points indices
-	group_indices = sjoin.groupby( sjoin.index, as_index=True )['index_cont'].apply(list)
-	# Create new column
-	df_osm_encompassing_structures.loc[ group_indices.index, column ] = group_indices.values
+	owners = df_osm_encompassing_structures.index.get_indexer(sjoin.index)
+	structures = df_osm_structures.index.get_indexer(sjoin['index_cont'])
+	# Sort by: encompassing position, then structure position
+	order = np.lexsort( (structures, owners) )
+	indptr = np.concatenate( ( [0], np.cumsum( np.bincount(owners, minlength=len(df_osm_encompassing_structures)) ) ) ).astype(np.int64)
 	# Reset indices
 	df_osm_encompassing_structures.index.rename('',inplace=True)
-	df_osm_structures.index.rename('',inplace=True)
\ No newline at end of file
+	df_osm_structures.index.rename('',inplace=True)
+	return indptr, structures[order].astype(np.int64)
+
+def relation_rows(relation, positions):
+	""" 
+	Restrict a structures relation to some of its encompassing rows (see `associate_structures`)
+
+	Parameters
+	----------
+	relation : [ np.array, np.array ]
+		indptr and indices arrays
+	positions : np.array
+		positions of the encompassing rows to keep
+
+	Returns
+	----------
+	[ np.array, np.array ]
+		indptr, and positions of the structures of the kept rows
+	"""
+	indptr, indices = relation
+	counts = np.diff(indptr)[positions]
+	rows_indptr = np.concatenate( ( [0], np.cumsum(counts) ) ).astype(np.int64)
+	take = np.repeat( indptr[:-1][positions] - rows_indptr[:-1], counts ) + np.arange( rows_indptr[-1] )
+	return rows_indptr, indices[take]
+
+def update_relation(relation, rows, structures_positions, to_update, updated_relation):
+	""" 
+	Update a structures relation (see `associate_structures`) after its encompassing rows and its structures changed
+	Kept rows keep their stored structures, while the structures of the rows to update are replaced
+
+	Parameters
+	----------
+	relation : [ np.array, np.array ]
+		stored indptr and indices arrays
+	rows : np.array
+		stored position of each encompassing row, -1 for new rows
+	structures_positions : np.array
+		new position of each stored structure, -1 for removed structures
+	to_update : np.array
+		positions of the rows whose structures are replaced (including new rows)
+	updated_relation : [ np.array, np.array ]
+		indptr and indices arrays of the rows to update, in the order of `to_update`
+
+	Returns
+	----------
+	[ np.array, np.array ]
+		indptr, and positions of the structures in their data frame
+	"""
+	kept = np.flatnonzero( rows >= 0 )
+	kept = kept[ ~ np.isin(kept, to_update) ]
+	kept_indptr, kept_indices = relation_rows(relation, rows[kept])
+	kept_owners = np.repeat( kept, np.diff(kept_indptr) )
+	kept_indices = np.asarray(structures_positions, dtype=np.int64)[kept_indices]
+	valid = kept_indices >= 0
+	updated_indptr, updated_indices = updated_relation
+	owners = np.concatenate( ( kept_owners[valid], np.repeat( np.asarray(to_update, dtype=np.int64), np.diff(updated_indptr) ) ) )
+	structures = np.concatenate( ( kept_indices[valid], updated_indices ) ).astype(np.int64)
+	# Sort by: encompassing position, then structure position
+	order = np.lexsort( (structures, owners) )
+	indptr = np.concatenate( ( [0], np.cumsum( np.bincount(owners, minlength=len(rows)) ) ) ).astype(np.int64)
+	return indptr, structures[order]
@@ -6,6 +6,8 @@
 import geopandas as gpd
 import osmnx as ox
 
+from ..osm.utils import get_landuses_m2
+
 from keras import callbacks, optimizers
 from keras.models import Sequential
 from keras.layers import Activation, Flatten, Conv1D
@@ -34,7 +36,8 @@ def proportional_population_downscaling(df_osm_built, df_insee):
 		assert(df_insee.crs == df_osm_built.crs)
 
 	df_osm_built['geom'] = df_osm_built.geometry
-	df_osm_built_residential = df_osm_built[ df_osm_built.apply(lambda x: x.landuses_m2['residential'] > 0, axis = 1) ]
+	residential_m2 = get_landuses_m2(df_osm_built, 'residential')
+	df_osm_built_residential = df_osm_built[ residential_m2 > 0 ].assign( m2_residential=residential_m2[ residential_m2 > 0 ] )
 
 	# Loading/saving using geopandas loses the 'ellps' key
 	df_insee.crs = df_osm_built_residential.crs
@@ -42,7 +45,7 @@ def proportional_population_downscaling(df_osm_built, df_insee):
 	# Intersecting gridded population - buildings
 	sjoin = gpd.sjoin( df_insee, df_osm_built_residential, op='intersects')
 	# Calculate area within square (percentage of building with the square)
-	sjoin['residential_m2_within'] = sjoin.apply(lambda x: x.landuses_m2['residential'] * (x.geom.intersection(x.geometry).area / x.geom.area), axis=1 )
+	sjoin['residential_m2_within'] = sjoin.m2_residential * sjoin.apply(lambda x: x.geom.intersection(x.geometry).area / x.geom.area, axis=1 )
 	# Initialize
 	df_insee['residential_m2_within'] = 0
 	# Sum residential area within square
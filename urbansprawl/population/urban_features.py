@@ -21,6 +21,7 @@ from .data_extract import get_extract_population_data
 # Sprawl indices
 from ..sprawl.dispersion import compute_grid_dispersion
 from ..sprawl.landusemix import compute_grid_landusemix
+from ..osm.utils import expand_landuses_m2
 
 from shapely.geometry import Polygon
 
@@ -79,6 +80,8 @@ def compute_full_urban_features(city_ref, df_osm_built=None, df_osm_pois=None,
 	log("Calculating urban features")
 	start = time.time()
 
+	# Surfaces stored as a dict per building: One column per land use
+	expand_landuses_m2(df_osm_built)
 	# Conserve building geometries
 	df_osm_built['geom_building'] = df_osm_built['geometry']
 
@@ -90,7 +93,7 @@ def compute_full_urban_features(city_ref, df_osm_built=None, df_osm_pois=None,
 	# Replace NaN for urban features calculation
 	min_polygon = Polygon([(0,0), (0,np.finfo(float).eps), (np.finfo(float).eps,np.finfo(float).eps)])
 	df_insee_urban_features.loc[null_idx, 'geom_building'] = df_insee_urban_features.loc[null_idx, 'geom_building'].apply(lambda x: min_polygon)
-	df_insee_urban_features.loc[null_idx, 'landuses_m2' ] = len( null_idx ) * [{'residential':0, 'activity':0}]
+	df_insee_urban_features.loc[null_idx, ['m2_residential', 'm2_activity'] ] = 0
 	df_insee_urban_features.loc[null_idx, 'building_levels'] = len(null_idx) * [0]
 
 	### Pre-calculation of urban features
@@ -98,8 +101,8 @@ def compute_full_urban_features(city_ref, df_osm_built=None, df_osm_pois=None,
 	# Apply percentage of building presence within square: 1 if fully contained, 0.5 if half the building contained, ...
 	df_insee_urban_features['building_ratio'] = df_insee_urban_features.apply( lambda x: x.geom_building.intersection(x.geometry).area / x.geom_building.area, axis=1 )
 
-	df_insee_urban_features['m2_total_residential'] = df_insee_urban_features.apply( lambda x: x.building_ratio * x.landuses_m2['residential'], axis=1 )
-	df_insee_urban_features['m2_total_activity'] = df_insee_urban_features.apply( lambda x: x.building_ratio * x.landuses_m2['activity'], axis=1 )
+	df_insee_urban_features['m2_total_residential'] = df_insee_urban_features.building_ratio * df_insee_urban_features.m2_residential
+	df_insee_urban_features['m2_total_activity'] = df_insee_urban_features.building_ratio * df_insee_urban_features.m2_activity
 
 	df_insee_urban_features['m2_footprint_residential'] = 0
 	df_insee_urban_features.loc[ df_insee_urban_features.classification.isin(['residential']), 'm2_footprint_residential' ] = df_insee_urban_features.loc[ df_insee_urban_features.classification.isin(['residential']) ].apply(lambda x: x.building_ratio * x.geom_building.area, axis=1 )
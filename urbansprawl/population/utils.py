@@ -12,6 +12,7 @@ from shapely.geometry import Polygon
 from shapely.geometry import Point
 
 from ..settings import storage_folder
+from ..osm.utils import get_landuses_m2
 
 # Format for load/save the geo-data ['geojson','shp']
 geo_format = 'geojson' # 'shp'
@@ -214,7 +215,7 @@ def population_downscaling_validation(df_osm_built, df_insee):
 
 	"""
 	df_osm_built['geom'] = df_osm_built.geometry
-	df_osm_built_residential = df_osm_built[ df_osm_built.apply(lambda x: x.landuses_m2['residential'] > 0, axis = 1) ]
+	df_osm_built_residential = df_osm_built[ get_landuses_m2(df_osm_built, 'residential') > 0 ]
 	df_insee.crs = df_osm_built_residential.crs
 
 	# Intersecting gridded population - buildings
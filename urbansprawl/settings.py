@@ -5,3 +5,47 @@
 
 storage_folder = 'data'
 images_folder = 'images'
+
+# Overpass responses cache (None: disabled)
+overpass_cache_folder = storage_folder + '/overpass_cache'
+# Maximum size of the cache, in bytes. Least recently used responses are evicted first
+overpass_cache_max_size = 2 * 1024**3
+# Maximum age of a cached response, in seconds (None: never expires). Queries at a past date never expire
+overpass_cache_max_age = 7 * 24 * 3600
+
+# Overpass API endpoint
+overpass_endpoint = 'http://overpass-api.de/api/interpreter'
+# Pool of Overpass API endpoints the requests are balanced over, e.g. internal mirrors (None: `overpass_endpoint` only)
+overpass_endpoints = None
+# Endpoints health: Interval between checks of their status page, and pause of a failing endpoint, in seconds
+overpass_status_interval = 60.
+overpass_endpoint_cooldown = 60.
+
+# Maximum number of Overpass requests in flight, shared by all the queries of the process (layers, tiles and dates retrieved concurrently)
+# Keep it within the number of query slots allowed by the Overpass server
+overpass_max_workers = 2
+# Rate limit shared by all Overpass sub-queries: Requests per second, and burst size
+overpass_requests_per_second = 1.
+overpass_burst = 2
+# Failed sub-queries: Number of retries, and initial backoff in seconds (doubled at each retry)
+overpass_max_retries = 3
+overpass_retry_backoff = 5.
+
+# Node location index used to read .osm.pbf extracts (see pyosmium index types, e.g. 'flex_mem', 'dense_file_array,nodes.cache')
+pbf_location_index = 'flex_mem'
+
+# Zoom level of the Web Mercator tile grid the Overpass sub-queries are aligned to (None: sub-queries follow the region of interest)
+# Tiles are cached by date and shared by overlapping regions, their features clipped to each region. Zoom 13 tiles span ~4.9 km at the equator
+# Tiled queries always select bounding boxes: Places are not queried by their Overpass area, nor polygons by their simplified shape,
+# and small regions fetch the whole tiles covering them. Worth enabling when retrieving many overlapping regions
+overpass_tile_zoom = None
+
+# Polygon queries: Maximum number of vertices of the query polygons, and initial outward buffer (simplification tolerance) in meters
+# Features are clipped client-side to the exact polygon
+overpass_polygon_max_vertices = 200
+overpass_polygon_buffer = 50.
+
+# Sub-queries aborted by the server for lack of resources (timeout, memory) are split into quadrants: Maximum recursion depth
+# Split queries are learned (file, None: not stored), and split upfront by later runs
+overpass_max_split_depth = 4
+overpass_split_file = storage_folder + '/overpass_splits.json'
@@ -16,7 +16,8 @@ import shutil
 from multiprocessing import cpu_count
 
 from osmnx import log
-from .utils import divide_long_edges_graph
+from .utils import divide_long_edges_graph, divide_long_edges_csr
+from ..osm.graph import CSRGraph
 
 ##############################################################
 ### Compute accessibility grid
@@ -31,7 +32,7 @@ def compute_grid_accessibility(df_indices, G, df_osm_built, df_osm_pois, kw_args
 	----------
 	df_indices : geopandas.GeoDataFrame
 		data frame containing the (x,y) reference points to calculate indices
-	G : networkx multidigraph
+	G : networkx multidigraph or CSRGraph
 		input graph to calculate accessibility
 	df_osm_built : geopandas.GeoDataFrame
 		data frame containing the building's geometries and corresponding land uses
@@ -81,9 +82,12 @@ def compute_grid_accessibility(df_indices, G, df_osm_built, df_osm_pois, kw_args
 	# Prepare input data: As many chunks of data as cores
 	prepare_data(G, df_osm_built, df_osm_pois, df_indices, num_cores, kw_arguments )
 
+	# Compact graphs are stored as a folder of arrays, memory mapped by the subprocesses
+	graph_file = "temp/graph.csr" if isinstance(G, CSRGraph) else "temp/graph.gpickle"
+
 	#This command could have multiple commands separated by a new line \n
 	parallel_code = os.path.realpath(__file__).replace(".py","_parallel.py")
-	command_call = "python " + parallel_code + " temp/graph.gpickle temp/points_NUM_CHUNK.pkl temp/arguments.pkl"
+	command_call = "python " + parallel_code + " " + graph_file + " temp/points_NUM_CHUNK.pkl temp/arguments.pkl"
 	
 	##############
 	### Verify amount of memory used per subprocess
@@ -144,7 +148,7 @@ def prepare_data(G, df_osm_built, df_osm_pois, df_indices, num_processes, kw_arg
 
 	Parameters
 	----------
-	G : networkx multidigraph
+	G : networkx multidigraph or CSRGraph
 		input graph to calculate accessibility
 	df_osm_built : geopandas.GeoDataFrame
 		buildings data
@@ -161,14 +165,45 @@ def prepare_data(G, df_osm_built, df_osm_pois, df_indices, num_processes, kw_arg
 	----------
 
 	"""
-	# Divide long edges
-	divide_long_edges_graph(G, kw_arguments.max_edge_length )
-	log("Graph long edges shortened")
-
 	# Get activities
 	df_built_activ = df_osm_built[ df_osm_built.classification.isin(["activity","mixed"]) ]
 	df_pois_activ = df_osm_pois[ df_osm_pois.classification.isin(["activity","mixed"]) ]
-	
+
+	if ( isinstance(G, CSRGraph) ): # Compact graph: Computation on its arrays
+		prepare_csr_graph(G, df_built_activ, df_pois_activ, kw_arguments.max_edge_length)
+	else:
+		prepare_networkx_graph(G, df_built_activ, df_pois_activ, kw_arguments.max_edge_length)
+
+	# Prepare input indices points
+	data_split = np.array_split(df_indices, num_processes)
+	for i in range(num_processes):
+		data_split[i].to_pickle("temp/points_"+str(i)+".pkl")
+	# Pickle arguments
+	kw_arguments.to_pickle("temp/arguments.pkl")
+
+def prepare_networkx_graph(G, df_built_activ, df_pois_activ, max_edge_length):
+	"""
+	Divides long edges, associates activities to graph nodes, and pickles the graph to the temporary folder
+
+	Parameters
+	----------
+	G : networkx multidigraph
+		input graph to calculate accessibility
+	df_built_activ : geopandas.GeoDataFrame
+		buildings with activity uses
+	df_pois_activ : geopandas.GeoDataFrame
+		points of interest with activity uses
+	max_edge_length : float
+		maximum tolerated edge length
+
+	Returns
+	----------
+
+	"""
+	# Divide long edges
+	divide_long_edges_graph(G, max_edge_length )
+	log("Graph long edges shortened")
+
 	# Associate them to its closest node in the graph
 	associate_activities_closest_node(G, df_built_activ, df_pois_activ )
 	log("Activities associated to graph nodes")
@@ -192,12 +227,39 @@ def prepare_data(G, df_osm_built, df_osm_pois, df_indices, num_processes, kw_arg
 	# Pickle graph
 	nx.write_gpickle(G, "temp/graph.gpickle")
 
-	# Prepare input indices points
-	data_split = np.array_split(df_indices, num_processes)
-	for i in range(num_processes):
-		data_split[i].to_pickle("temp/points_"+str(i)+".pkl")
-	# Pickle arguments
-	kw_arguments.to_pickle("temp/arguments.pkl")
+def prepare_csr_graph(G, df_built_activ, df_pois_activ, max_edge_length):
+	"""
+	Divides long edges of a compact graph, associates activities to its nodes, and stores its arrays to the temporary folder
+	The adjacency matrix of edge lengths (parallel edges reduced to the shortest one) and node coordinates are stored as a CSRGraph, plus the number of activities of each node
+
+	Parameters
+	----------
+	G : CSRGraph
+		input graph to calculate accessibility
+	df_built_activ : geopandas.GeoDataFrame
+		buildings with activity uses
+	df_pois_activ : geopandas.GeoDataFrame
+		points of interest with activity uses
+	max_edge_length : float
+		maximum tolerated edge length
+
+	Returns
+	----------
+
+	"""
+	# Divide long edges
+	G = divide_long_edges_csr(G, max_edge_length)
+	log("Graph long edges shortened")
+
+	# Number of activities of each node: Closest node to each activity
+	centroids = pd.concat( [ df_built_activ.geometry.centroid, df_pois_activ.geometry.centroid ] )
+	nodes = G.nearest_nodes(centroids.x.values, centroids.y.values) if len(centroids) else np.zeros(0, dtype=np.int64)
+	num_activities = np.bincount(nodes, minlength=G.number_of_nodes())
+	log("Activities associated to graph nodes")
+
+	adjacency = G.to_scipy()
+	CSRGraph(adjacency.indptr, adjacency.indices, adjacency.data, G.x, G.y, G.osmid, crs=G.crs, name=G.name).save("temp/graph.csr")
+	np.save("temp/graph.csr/num_activities.npy", num_activities)
 
 def associate_activities_closest_node(G, df_activities_built, df_activities_pois ):
 	""" 
@@ -230,7 +292,7 @@ def associate_activities_closest_node(G, df_activities_built, df_activities_pois
 
 	def associate_to_node(tree, point, G):
 		distance, idx_node = tree.query( (point.x,point.y) )
-		G.node[ df_nodes.loc[ idx_node, "node"] ]["num_activities"] += 1
+		G.nodes[ df_nodes.loc[ idx_node, "node"] ]["num_activities"] += 1
 	
 	# Associate each activity to its closest node
 	df_activities_built.apply(lambda x: associate_to_node(tree, x.geometry.centroid, G) , axis=1)
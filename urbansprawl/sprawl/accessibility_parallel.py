@@ -4,12 +4,17 @@
 ###################################################################################################
 
 import sys
+import os
 import numpy as np
 import pandas as pd
 import networkx as nx
 from bisect import bisect
 import time
 
+# Run as a script (see `accessibility.compute_grid_accessibility`): The package is imported from its location
+sys.path.insert(0, os.path.dirname( os.path.dirname( os.path.dirname( os.path.realpath(__file__) ) ) ) )
+from urbansprawl.osm.graph import CSRGraph
+
 def get_nearest_node_utm(G, point, return_dist=False):
 	"""
 	Return the nearest graph node to some specified point in UTM coordinates
@@ -87,7 +92,7 @@ def get_count_activities_fixed_distance(G, point_ref, arguments):
 		visited_nodes.add(N_visit)
 
 		# Update traveled activities
-		num_activities_travelled += G.node[N_visit]["num_activities"]
+		num_activities_travelled += G.nodes[N_visit]["num_activities"]
 
 		# Reached sufficient number of activities
 		if ( num_activities_travelled >= arguments.fixed_distance_max_num_activities ): return arguments.fixed_distance_max_num_activities
@@ -152,7 +157,7 @@ def get_minimum_cost_activities_travel(G, point_ref, arguments):
 		visited_nodes.append(N_visit)
 
 		# Update traveled activities
-		activities_travelled += G.node[N_visit]["num_activities"]
+		activities_travelled += G.nodes[N_visit]["num_activities"]
 
 		# Add to neighboring_nodes the neighbors of visited node
 		for N_i in G.neighbors(N_visit):
@@ -178,6 +183,81 @@ def get_minimum_cost_activities_travel(G, point_ref, arguments):
 	# Accomplished. End node: visited_nodes[-1]
 	return nx.shortest_path_length(G,N0,visited_nodes[-1],weight="length")
 
+##############################################
+### Accessibility indices calculation: Compact graph
+##############################################
+
+def _nearest_node(G, point_ref):
+	""" Position of the graph node closest to a point, and its distance """
+	nodes, distances = G.nearest_nodes(point_ref.x, point_ref.y, return_dist=True)
+	return nodes[0], distances[0]
+
+def get_count_activities_fixed_distance_csr(G, num_activities, point_ref, arguments):
+	"""
+	Compact graph version of `get_count_activities_fixed_distance`
+	The nodes visited are those reached within the maximum distance to travel: Their activities are summed up
+
+	Parameters
+	----------
+	G : CSRGraph
+		input graph to calculate accessibility
+	num_activities : np.array
+		number of activities associated to each node (see `accessibility.prepare_csr_graph`)
+	point_ref: shapely.Point
+		reference point to calculate accesisibility
+
+	Returns
+	----------
+	int
+		returns the number of reached activities
+	"""
+	# Find closest node to point_ref
+	N0, distance = _nearest_node(G, point_ref)
+	# Distance to closest node too high?
+	if (distance > arguments.max_node_distance): return np.nan
+
+	shortest_path_length_N0_ = G.shortest_path_lengths(N0, arguments.fixed_distance_max_travel_distance)
+	num_activities_travelled = num_activities[ np.isfinite(shortest_path_length_N0_) ].sum()
+	return min( num_activities_travelled, arguments.fixed_distance_max_num_activities )
+
+def get_minimum_cost_activities_travel_csr(G, num_activities, point_ref, arguments):
+	"""
+	Compact graph version of `get_minimum_cost_activities_travel`
+	Nodes are visited by increasing shortest path length, until the minimum number of activities is reached
+
+	Parameters
+	----------
+	G : CSRGraph
+		input graph to calculate accessibility
+	num_activities : np.array
+		number of activities associated to each node (see `accessibility.prepare_csr_graph`)
+	point_ref: shapely.Point
+		reference point to calculate accessibility
+
+	Returns
+	----------
+	float
+		returns the computed radius cost length
+	"""
+	# Find closest node to point_ref
+	N0, distance = _nearest_node(G, point_ref)
+	# Distance to closest node too high?
+	if (distance > arguments.max_node_distance): return np.nan
+
+	shortest_path_length_N0_ = G.shortest_path_lengths(N0, arguments.fixed_activities_max_travel_distance)
+	reached = np.isfinite(shortest_path_length_N0_)
+	visited_nodes = np.flatnonzero(reached)
+	visited_nodes = visited_nodes[ np.argsort(shortest_path_length_N0_[visited_nodes], kind='stable') ]
+	# First node where the minimum number of activities is reached
+	end = np.searchsorted( np.cumsum( num_activities[visited_nodes] ), arguments.fixed_activities_min_number )
+	if ( end < len(visited_nodes) ): # Accomplished
+		return shortest_path_length_N0_[ visited_nodes[end] ]
+
+	# Reached maximum distance tolerated if farther nodes exist (cut iteration), otherwise no more neighbors
+	if ( np.any( ~ reached[ G.to_scipy()[visited_nodes].indices ] ) ):
+		return arguments.fixed_activities_max_travel_distance
+	return np.nan
+
 
 def main(argv):
 	""" 
@@ -195,7 +275,12 @@ def main(argv):
 	start = time.time()
 
 	# Load graph
-	G = nx.read_gpickle(argv[1])
+	if ( os.path.isdir(argv[1]) ): # Compact graph: Memory mapped arrays, shared by the subprocesses
+		G = CSRGraph.load(argv[1])
+		graph_args = ( G, np.load( os.path.join(argv[1], 'num_activities.npy'), mmap_mode='r' ) )
+	else:
+		G = nx.read_gpickle(argv[1])
+		graph_args = ( G, )
 
 	# Load indices points
 	indices = pd.read_pickle( argv[2] )
@@ -204,7 +289,6 @@ def main(argv):
 	arguments = pd.read_pickle( argv[3] )
 
 	if ( ( len(argv) > 4 ) and (argv[4] == "memory_test" ) ): # Test memory used for current subprocess
-		import os
 		import psutil
 		process = psutil.Process(os.getpid())
 		Allocated_process_MB = process.memory_info().rss / 1000 / 1000
@@ -217,14 +301,14 @@ def main(argv):
 
 
 	if (arguments.fixed_activities):
-		_calculate_accessibility = get_minimum_cost_activities_travel
+		_calculate_accessibility = get_minimum_cost_activities_travel_csr if isinstance(G, CSRGraph) else get_minimum_cost_activities_travel
 	elif (arguments.fixed_distance):
-		_calculate_accessibility = get_count_activities_fixed_distance
+		_calculate_accessibility = get_count_activities_fixed_distance_csr if isinstance(G, CSRGraph) else get_count_activities_fixed_distance
 	else:
 		assert(False)
 
 	# Calculate accessibility
-	indices["accessibility"] = indices.geometry.apply(lambda x: _calculate_accessibility(G, x, arguments) )
+	indices["accessibility"] = indices.geometry.apply(lambda x: _calculate_accessibility(*graph_args, x, arguments) )
 
 	# Store results
 	indices.to_pickle( argv[2].replace('points','indices') )
@@ -10,6 +10,7 @@ from osmnx import log
 from shapely.geometry import Point
 
 from ..osm.core import get_route_graph, get_processed_osm_data
+from ..osm.utils import load_relations, get_relations_filename
 from .landusemix import compute_grid_landusemix
 from .accessibility import compute_grid_accessibility
 from .dispersion import compute_grid_dispersion
@@ -184,7 +185,8 @@ def process_spatial_indices(city_ref=None, region_args={"polygon":None, "place":
 		if (indices_computation.get("accessibility")):
 			compute_grid_accessibility(df_indices, G, df_osm_built, df_osm_pois, accessibility_args)
 		if (indices_computation.get("landusemix")):
-			compute_grid_landusemix(df_indices, df_osm_built, df_osm_pois, landusemix_args)
+			relations = load_relations(get_relations_filename(city_ref), df_osm_built, df_osm_pois=df_osm_pois)
+			compute_grid_landusemix(df_indices, df_osm_built, df_osm_pois, landusemix_args, relations=relations)
 		if (indices_computation.get("dispersion")):
 			compute_grid_dispersion(df_indices, df_osm_built, dispersion_args)
 
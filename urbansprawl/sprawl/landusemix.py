@@ -10,6 +10,7 @@ import time
 
 from sklearn.neighbors.kde import KernelDensity
 from .utils import WeightedKernelDensityEstimation
+from ..osm.utils import get_landuses_m2, get_structures_relation
 
 from osmnx import log
 
@@ -50,7 +51,7 @@ _land_use_mix = metric_phi_entropy
 ### Land use mix indices calculation
 ##############################################################
 
-def compute_grid_landusemix(df_indices, df_osm_built, df_osm_pois, kw_args={'walkable_distance':600,'compute_activity_types_kde':True,'weighted_kde':True,'pois_weight':9,'log_weighted':True} ):
+def compute_grid_landusemix(df_indices, df_osm_built, df_osm_pois, kw_args={'walkable_distance':600,'compute_activity_types_kde':True,'weighted_kde':True,'pois_weight':9,'log_weighted':True}, relations=None ):
 	""" 
 	Calculate land use mix indices on input grid
 
@@ -74,6 +75,8 @@ def compute_grid_landusemix(df_indices, df_osm_built, df_osm_pois, kw_args={'wal
 				Points of interest weight equivalence with buildings (squared meter)
 			log_weighted : bool
 				apply natural logarithmic function to surface weights
+	relations : dict
+		stored structures relations of the buildings (see `load_relations`): Computed again if not given, or if they refer to other buildings or points of interest
 
 	Returns
 	----------
@@ -89,10 +92,10 @@ def compute_grid_landusemix(df_indices, df_osm_built, df_osm_pois, kw_args={'wal
 	weighted_kde = kw_args["weighted_kde"]
 	X_weights = None
 
-	# Get full list of contained POIs
-	contained_pois = list(set([element for list_ in df_osm_built.containing_poi[ df_osm_built.containing_poi.notnull() ] for element in list_]))
+	# Get full list of contained POIs: Stored relation if available
+	_, contained_pois = get_structures_relation(df_osm_built, df_osm_pois, "containing_poi", relations)
 	# Get the POIs not contained by any building
-	df_osm_pois_not_contained = df_osm_pois[ ~ df_osm_pois.index.isin( contained_pois) ]
+	df_osm_pois_not_contained = df_osm_pois[ ~ np.isin( np.arange( len(df_osm_pois) ), contained_pois ) ]
 
 	############
 	### Calculate land use density estimations
@@ -102,7 +105,7 @@ def compute_grid_landusemix(df_indices, df_osm_built, df_osm_pois, kw_args={'wal
 	# Residential
 	####
 	df_osm_built_indexed = df_osm_built[ df_osm_built.classification.isin(["residential","mixed"]) ]
-	if (weighted_kde): X_weights = df_osm_built_indexed.landuses_m2.apply(lambda x: x["residential"] )
+	if (weighted_kde): X_weights = get_landuses_m2(df_osm_built_indexed, "residential")
 
 	df_indices["residential_pdf"] = calculate_kde(df_indices.geometry, df_osm_built_indexed, None, bandwidth, X_weights, kw_args["pois_weight"], kw_args["log_weighted"] )
 	log("Residential density estimation done")
@@ -112,7 +115,7 @@ def compute_grid_landusemix(df_indices, df_osm_built, df_osm_pois, kw_args={'wal
 	####
 	df_osm_built_indexed = df_osm_built[ df_osm_built.classification.isin(["activity","mixed"]) ]
 	df_osm_pois_not_cont_indexed = df_osm_pois_not_contained[ df_osm_pois_not_contained.classification.isin(["activity","mixed"]) ]
-	if (weighted_kde): X_weights = df_osm_built_indexed.landuses_m2.apply(lambda x: x["activity"] )
+	if (weighted_kde): X_weights = get_landuses_m2(df_osm_built_indexed, "activity")
 	
 	df_indices["activity_pdf"] = calculate_kde(df_indices.geometry, df_osm_built_indexed, df_osm_pois_not_cont_indexed, bandwidth, X_weights, kw_args["pois_weight"], kw_args["log_weighted"] )
 	log("Activity density estimation done")
@@ -133,7 +136,7 @@ def compute_grid_landusemix(df_indices, df_osm_built, df_osm_pois, kw_args={'wal
 			# Buildings and POIs within that category
 			df_built_category = df_osm_built_indexed[ df_osm_built_indexed.activity_category.apply(lambda x: (isinstance(x,list)) and (cat in x) ) ]
 			df_pois_category = df_osm_pois_not_cont_indexed[ df_osm_pois_not_cont_indexed.activity_category.apply(lambda x: (isinstance(x,list)) and (cat in x) ) ]
-			if (weighted_kde): X_weights = df_built_category.landuses_m2.apply(lambda x: x[ cat ] )
+			if (weighted_kde): X_weights = get_landuses_m2(df_built_category, cat)
 			
 			df_indices[ cat + "_pdf" ] = calculate_kde( df_indices.geometry, df_built_category, df_pois_category, bandwidth, X_weights, kw_args["pois_weight"], kw_args["log_weighted"] )
 		
@@ -10,6 +10,8 @@ import math
 from shapely.geometry import LineString
 from scipy.spatial.distance import cdist
 
+from ..osm.graph import CSRGraph
+
 
 def WeightedKernelDensityEstimation(X, Weights, bandwidth, Y, max_mb_per_chunk = 1000):
     """ 
@@ -133,8 +135,8 @@ def verify_divide_edge(G, u, v, key, data, node_creation_counter, max_edge_lengt
 	if ( data.get("geometry",None) ): # Geometry exists
 		geometry = data["geometry"]
 	else: # Real geometry is a straight line between the two nodes
-		P_U = G.node[u]["x"], G.node[u]["y"]
-		P_V = G.node[v]["x"], G.node[v]["y"]
+		P_U = G.nodes[u]["x"], G.nodes[u]["y"]
+		P_V = G.nodes[v]["x"], G.nodes[v]["y"]
 		geometry = LineString( (P_U, P_V) )
 	
 	# Get geometries for edge(u,middle), edge(middle,v) and node(middle)
@@ -197,4 +199,66 @@ def divide_long_edges_graph(G, max_edge_length):
 	for u, v, key, data in list( G.edges(data=True, keys=True) ):
 		if ( data["length"] > max_edge_length ):
 			# Divide the edge (u,v) recursively
-			verify_divide_edge(G, u, v, key, data, node_creation_counter, max_edge_length)
\ No newline at end of file
+			verify_divide_edge(G, u, v, key, data, node_creation_counter, max_edge_length)
+
+def divide_long_edges_csr(G, max_edge_length):
+	"""
+	Divide all edges of a compact graph with a higher length than input threshold, as `divide_long_edges_graph`
+	Each edge is halved recursively: New nodes are placed along the edge geometry (or the straight line between its nodes), and given negative osm ids
+
+	Parameters
+	----------
+	G : CSRGraph
+		input graph
+	max_edge_length : float
+		maximum tolerated edge length
+
+	Returns
+	----------
+	CSRGraph
+		graph with divided edges (node coordinates, edge lengths and osm ids only)
+	"""
+	if ( G.number_of_edges() == 0 ):
+		return G
+	u, v = G.edges()
+	lengths = G.lengths.astype(np.float64)
+	# Number of pieces of each edge
+	pieces = np.ones(len(lengths), dtype=np.int64)
+	long_edges = ( lengths > max_edge_length )
+	pieces[long_edges] = 2 ** np.ceil( np.log2( lengths[long_edges] / max_edge_length ) ).astype(np.int64)
+
+	# New nodes, at regular fractions of their edge
+	inner = pieces - 1
+	num_new = inner.sum()
+	new_edge = np.repeat( np.arange(len(pieces)), inner )
+	fraction = ( np.arange(num_new) - np.repeat(np.cumsum(inner) - inner, inner) + 1 ) / pieces[new_edge]
+	x_new = G.x[ u[new_edge] ] + fraction * ( G.x[ v[new_edge] ] - G.x[ u[new_edge] ] )
+	y_new = G.y[ u[new_edge] ] + fraction * ( G.y[ v[new_edge] ] - G.y[ u[new_edge] ] )
+	# Follow the edge geometry if it exists
+	first_new = np.cumsum(inner) - inner
+	for edge in np.flatnonzero( ( inner > 0 ) & ( np.diff(G.geometry_indptr) > 0 ) ).tolist():
+		start, end = G.geometry_indptr[edge], G.geometry_indptr[edge+1]
+		line = LineString( np.column_stack( (G.geometry_x[start:end], G.geometry_y[start:end]) ) )
+		for i in range(first_new[edge], first_new[edge] + inner[edge]):
+			point = line.interpolate(fraction[i], normalized=True)
+			x_new[i], y_new[i] = point.x, point.y
+
+	# Chains of nodes of each edge: u, new nodes, v
+	chain_indptr = np.concatenate( ( [0], np.cumsum(pieces + 1) ) )
+	chain = np.empty(chain_indptr[-1], dtype=np.int64)
+	is_new = np.ones(len(chain), dtype=bool)
+	is_new[ chain_indptr[:-1] ] = is_new[ chain_indptr[1:] - 1 ] = False
+	chain[ chain_indptr[:-1] ], chain[ chain_indptr[1:] - 1 ] = u, v
+	chain[is_new] = G.number_of_nodes() + np.arange(num_new)
+	same_chain = np.ones(len(chain) - 1, dtype=bool)
+	same_chain[ chain_indptr[1:-1] - 1 ] = False
+
+	# Nodes sorted by osm id
+	osmid = np.concatenate( ( G.osmid, - np.arange(1, num_new + 1) ) )
+	order = np.argsort(osmid, kind='stable')
+	position = np.empty(len(order), dtype=np.int64)
+	position[order] = np.arange(len(order))
+
+	return CSRGraph.from_edges( position[ chain[:-1][same_chain] ], position[ chain[1:][same_chain] ], np.repeat(lengths / pieces, pieces),
+							   np.concatenate( (G.x, x_new) )[order], np.concatenate( (G.y, y_new) )[order], osmid[order],
+							   edge_osmid=np.repeat(G.edge_osmid, pieces), crs=G.crs, name=G.name )
@@ -43,11 +43,14 @@ from urbansprawl.osm.overpass import (create_buildings_gdf,
                                       create_building_parts_gdf,
                                       create_pois_gdf,
                                       create_landuse_gdf,
-                                      retrieve_route_graph)
+                                      retrieve_route_graph,
+                                      load_route_graph)
 from urbansprawl.osm.utils import (sanity_check_height_tags,
-                                   associate_structures)
-from urbansprawl.osm.classification import (classify_tag,
-                                            classify_activity_category,
+                                   compute_relations,
+                                   store_relations,
+                                   load_relations)
+from urbansprawl.osm.classification import (classify_tags,
+                                            classify_activity_categories,
                                             compute_landuse_inference)
 from urbansprawl.osm.surface import compute_landuses_m2
 from urbansprawl.sprawl.core import get_indices_grid_from_bbox
@@ -72,12 +75,12 @@ else:
 # Columns of interest corresponding to OSM keys
 OSM_TAG_COLUMNS = [ "amenity", "landuse", "leisure", "shop", "man_made",
                     "building", "building:use", "building:part" ]
-COLUMNS_OF_INTEREST = OSM_TAG_COLUMNS + ["osm_id", "geometry", "height_tags"]
 COLUMNS_OF_INTEREST_POIS = OSM_TAG_COLUMNS + ["osm_id", "geometry"]
 COLUMNS_OF_INTEREST_LANDUSES = ["osm_id", "geometry", "landuse"]
 HEIGHT_TAGS = [ "min_height", "height", "min_level", "levels",
                 "building:min_height", "building:height", "building:min_level",
                 "building:levels", "building:levels:underground" ]
+COLUMNS_OF_INTEREST = OSM_TAG_COLUMNS + ["osm_id", "geometry"] + HEIGHT_TAGS
 BUILDING_PARTS_TO_FILTER = ["no", "roof"]
 MINIMUM_M2_BUILDING_AREA = 9.0
 
@@ -109,6 +112,23 @@ def define_filename(description, city, date, datapath, extension):
     return os.path.join(datapath, city, filename)
 
 
+def define_relations_filename(buildings_path):
+    """Build the filename of the structures relations stored along a
+    buildings file (see `urbansprawl.osm.utils.store_relations`)
+
+    Parameters
+    ----------
+    buildings_path : str
+        Path of the buildings file on the file system
+
+    Returns
+    -------
+    str
+        Full path name of the relations file
+    """
+    return os.path.splitext(buildings_path)[0] + "-relations.npz"
+
+
 def set_list_as_str(l):
     """Small utility function to transform list in string
 
@@ -322,14 +342,8 @@ class SanityCheck(luigi.Task):
 
     def run(self):
         gdf = gpd.read_file(self.input().path)
+        # Height tags are kept as numeric columns
         sanity_check_height_tags(gdf)
-        def remove_nan_dict(x):
-            """Remove entries with nan values
-            """
-            return {k:v for k, v in x.items() if pd.notnull(v)}
-        gdf['height_tags'] = gdf[[c for c in HEIGHT_TAGS
-                                  if c in gdf.columns]].apply(lambda x:
-                                                              remove_nan_dict(x.to_dict() ), axis=1)
         columns_to_drop = [col for col in list(gdf.columns)
                            if not col in COLUMNS_OF_INTEREST]
         gdf.drop(columns_to_drop, axis=1, inplace=True)
@@ -389,7 +403,7 @@ class GetClassifiedInfo(luigi.Task):
 
     def run(self):
         gdf = gpd.read_file(self.input().path)
-        gdf['classification'], gdf['key_value'] = list( zip(*gdf.apply(classify_tag, axis=1)) )
+        gdf['classification'], gdf['key_value'] = classify_tags(gdf)
         if self.table == "buildings":
             gdf.drop(gdf[gdf.classification.isnull()].index, inplace=True)
             gdf.reset_index(inplace=True, drop=True)
@@ -595,16 +609,15 @@ class ComputeLandUse(luigi.Task):
             buildings.crs = utm_proj
             building_parts.crs = utm_proj
             pois.crs = utm_proj
-        associate_structures(buildings, building_parts,
-                             operation='contains', column='containing_parts')
-        associate_structures(buildings, pois,
-                             operation='intersects', column='containing_poi')
-        buildings['activity_category'] = buildings.apply(lambda x: classify_activity_category(x.key_value), axis=1)
-        building_parts['activity_category'] = building_parts.apply(lambda x: classify_activity_category(x.key_value), axis=1)
-        pois['activity_category'] = pois.apply(lambda x: classify_activity_category(x.key_value), axis=1)
+        relations = compute_relations(buildings, building_parts, pois)
+        buildings['activity_category'] = classify_activity_categories(buildings.key_value)
+        building_parts['activity_category'] = classify_activity_categories(building_parts.key_value)
+        pois['activity_category'] = classify_activity_categories(pois.key_value)
         compute_landuses_m2(buildings,
                             building_parts,
                             pois,
+                            relations["containing_parts"],
+                            relations["containing_poi"],
                             default_height=self.default_height,
                             meters_per_level=self.meters_per_level,
                             mixed_building_first_floor_activity=True)
@@ -612,12 +625,13 @@ class ComputeLandUse(luigi.Task):
         building_parts.loc[building_parts.activity_category.apply(lambda x: len(x)==0 ), "activity_category" ] = np.nan
         pois.loc[pois.activity_category.apply(lambda x: len(x)==0 ), "activity_category" ] = np.nan
         # Set the composed classification given, for each building, its containing Points of Interest and building parts classification
-        buildings.loc[buildings.apply(lambda x: x.landuses_m2["activity"]>0 and
-        x.landuses_m2["residential"]>0, axis=1 ), "classification" ] = "mixed"
-        clean_list_in_geodataframe_column(buildings, "containing_parts")
-        clean_list_in_geodataframe_column(buildings, "containing_poi")
+        buildings.loc[(buildings.m2_activity > 0) &
+                      (buildings.m2_residential > 0), "classification"] = "mixed"
         clean_list_in_geodataframe_column(buildings, "activity_category")
         buildings.to_file(self.output().path, driver="GeoJSON")
+        # Containing building parts and POIs, for the downstream tasks
+        store_relations(relations,
+                        define_relations_filename(self.output().path))
 
 
 class GetRouteGraph(luigi.Task):
@@ -778,12 +792,15 @@ class ComputeGridLandUseMix(luigi.Task):
         grid = gpd.read_file(self.input()["grid"].path)
         buildings = gpd.read_file(self.input()["buildings"].path)
         pois = gpd.read_file(self.input()["pois"].path)
+        relations = load_relations(define_relations_filename(self.input()["buildings"].path),
+                                   buildings, df_osm_pois=pois)
         landusemix_args = {'walkable_distance': self.walkable_distance,
                            'compute_activity_types_kde': self.compute_activity_types_kd,
                            'weighted_kde': self.weighted_kde,
                            'pois_weight': self.pois_weights,
                            'log_weighted': self.log_weighted}
-        compute_grid_landusemix(grid, buildings, pois, landusemix_args)
+        compute_grid_landusemix(grid, buildings, pois, landusemix_args,
+                                relations=relations)
         grid.to_file(self.output().path, driver="GeoJSON")
 
 
@@ -871,7 +888,7 @@ class PlotLandUseMix(luigi.Task):
         if not self.plotted_feature in valid_features:
             raise ValueError("Choose a valid feature to plot amongst"
                              f" {valid_features}")
-        graph = osmnx.load_graphml(self.input()["graph"].path, folder="")
+        graph = load_route_graph(self.input()["graph"].path)
         fig, ax = osmnx.plot_graph(graph,
                                    fig_height=self.figsize,
                                    fig_width=self.figsize,
@@ -959,7 +976,7 @@ class ComputeGridAccessibility(luigi.Task):
 
     def run(self):
         grid = gpd.read_file(self.input()["grid"].path)
-        graph = osmnx.load_graphml(self.input()["graph"].path, folder="")
+        graph = load_route_graph(self.input()["graph"].path, compact=True)
         buildings = gpd.read_file(self.input()["buildings"].path)
         pois = gpd.read_file(self.input()["pois"].path)
         accessibility_args = {'fixed_distance': self.fixed_distance,
@@ -1050,7 +1067,7 @@ class PlotAccessibility(luigi.Task):
 
     def run(self):
         grid_accessibility = gpd.read_file(self.input()["grid"].path)
-        graph = osmnx.load_graphml(self.input()["graph"].path, folder="")
+        graph = load_route_graph(self.input()["graph"].path)
         fig, ax = osmnx.plot_graph(graph,
                                    fig_height=self.figsize,
                                    fig_width=self.figsize,
@@ -1211,7 +1228,7 @@ class PlotDispersion(luigi.Task):
 
     def run(self):
         grid_dispersion = gpd.read_file(self.input()["grid"].path)
-        graph = osmnx.load_graphml(self.input()["graph"].path, folder="")
+        graph = load_route_graph(self.input()["graph"].path)
         fig, ax = osmnx.plot_graph(graph,
                                    fig_height=self.figsize,
                                    fig_width=self.figsize,
@@ -1503,7 +1520,7 @@ class PlotINSEEData(luigi.Task):
 
     def run(self):
         population = gpd.read_file(self.input()["population"].path)
-        graph = osmnx.load_graphml(self.input()["graph"].path, folder="")
+        graph = load_route_graph(self.input()["graph"].path)
         proj_path = os.path.join(
             self.datapath, self.city, "utm_projection.json"
         )
@@ -1652,7 +1669,7 @@ class PlotGPWData(luigi.Task):
         )
         with open(proj_path) as f:
             population.to_crs(json.load(f), inplace=True)
-        graph = osmnx.load_graphml(self.input()["graph"].path, folder="")
+        graph = load_route_graph(self.input()["graph"].path)
         fig, ax = osmnx.plot_graph(
             graph, fig_height=self.figsize, fig_width=self.figsize, close=False,
             show=False, edge_color='black', edge_alpha=0.15, node_alpha=0.05